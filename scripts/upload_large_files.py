@@ -1,8 +1,217 @@
-import requests
+import argparse
+import hashlib
 import os
-import uuid
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_URL = "http://localhost:8000/api/videos/chunked_upload/"
+
+# Status codes worth retrying; anything else in the 4xx range is a client bug.
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# With S3 storage every chunk but the last becomes a multipart part, so
+# chunks must be at least the service's minimum part size (5 MiB on AWS).
+MIN_BLOCK_SIZE = 5 * 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkedUploader:
+    """
+    Client for the chunked upload endpoint.
+
+    The file is split into fixed ``block_size`` chunks (the server's unit of
+    bookkeeping). Each request carries a run of consecutive blocks, and the run
+    length adapts so a request takes about ``target_seconds`` at the measured
+    throughput. Up to ``concurrency`` requests are in flight on a pooled
+    keep-alive session. Uploads resume from the server-reported missing chunks.
+    """
+
+    def __init__(self, url, token, concurrency=4, block_size=MIN_BLOCK_SIZE,
+                 initial_blocks=1, max_blocks=16, target_seconds=2.0,
+                 retries=5, backoff=0.5, timeout=60, log=print):
+        self.url = url
+        self.concurrency = concurrency
+        self.block_size = block_size
+        self.initial_blocks = initial_blocks
+        self.max_blocks = max_blocks
+        self.target_seconds = target_seconds
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.log = log
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Authorization"] = f"Token {token}"
+
+        self._lock = threading.Lock()
+        self._blocks_per_request = initial_blocks
+        self.latencies = []
+
+    def status_url(self, file_id):
+        return f"{self.url.rstrip('/')}/{file_id}/status/"
+
+    def missing_chunks(self, file_id, total_chunks):
+        """
+        Chunks the server still needs, or all of them for a new upload.
+        """
+        response = self._request("get", self.status_url(file_id))
+        if response.status_code == 404:
+            return list(range(1, total_chunks + 1)), None
+        data = response.json()
+        return data["missing_chunks"], data.get("video")
+
+    def upload(self, file_path, file_id=None):
+        """
+        Upload a file and return the server's final response body.
+        """
+        file_size = os.path.getsize(file_path)
+        file_name = os.path.basename(file_path)
+        file_id = file_id or default_file_id(file_path)
+        total_chunks = max(1, (file_size + self.block_size - 1) // self.block_size)
+
+        missing, video = self.missing_chunks(file_id, total_chunks)
+        if not missing:
+            self.log("Upload already complete.")
+            return {"video": video}
+        if len(missing) < total_chunks:
+            self.log(f"Resuming: {len(missing)} of {total_chunks} chunks missing.")
 
-def chunked_upload(file_path, url, token, chunk_size=5 * 1024 * 1024):
+        fields = {
+            "total_chunks": total_chunks,
+            "file_id": file_id,
+            "file_name": file_name,
+            "chunk_size": self.block_size,
+            "total_size": file_size,
+        }
+        pending = list(missing)
+        result = None
+        sent_bytes = 0
+        started = time.monotonic()
+
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                in_flight = set()
+                while pending or in_flight:
+                    while pending and len(in_flight) < self.concurrency:
+                        first, count = self._next_run(pending)
+                        in_flight.add(pool.submit(self._send, fd, fields, first, count, file_size))
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        response, first, count, size, latency = future.result()
+                        sent_bytes += size
+                        self._record(size, latency)
+                        self.log(
+                            f"Chunks {first}-{first + count - 1}/{total_chunks}: "
+                            f"{size / 1024:.0f} KiB in {latency * 1000:.0f} ms"
+                        )
+                        if response.status_code == 201:
+                            result = response.json()
+        finally:
+            os.close(fd)
+
+        elapsed = time.monotonic() - started
+        self.report(sent_bytes, elapsed)
+        if result is None:
+            # Another client may have sent the final chunk.
+            missing, video = self.missing_chunks(file_id, total_chunks)
+            if missing:
+                raise UploadError(f"Server is still missing chunks {missing[:10]}")
+            result = {"video": video}
+        return result
+
+    def report(self, sent_bytes, elapsed):
+        if not self.latencies:
+            return
+        latencies = sorted(self.latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.log(
+            f"Sent {sent_bytes / 1024 / 1024:.1f} MiB in {elapsed:.2f} s "
+            f"({sent_bytes / 1024 / 1024 / max(elapsed, 1e-9):.2f} MiB/s), "
+            f"{len(latencies)} requests, latency p50 {statistics.median(latencies) * 1000:.0f} ms, "
+            f"p95 {p95 * 1000:.0f} ms"
+        )
+
+    def _next_run(self, pending):
+        """
+        Pop up to the current run length of consecutive chunks from pending.
+        """
+        with self._lock:
+            limit = self._blocks_per_request
+        first = pending.pop(0)
+        count = 1
+        while pending and count < limit and pending[0] == first + count:
+            pending.pop(0)
+            count += 1
+        return first, count
+
+    def _record(self, size, latency):
+        """
+        Track latency and resize runs to about target_seconds per request.
+        """
+        with self._lock:
+            self.latencies.append(latency)
+            throughput = size / max(latency, 1e-6)
+            blocks = int(throughput * self.target_seconds / self.block_size)
+            self._blocks_per_request = max(1, min(self.max_blocks, blocks))
+
+    def _send(self, fd, fields, first, count, file_size):
+        offset = (first - 1) * self.block_size
+        size = min(count * self.block_size, file_size - offset)
+        data = os.pread(fd, size, offset)
+        started = time.monotonic()
+        response = self._request(
+            "post", self.url,
+            data=dict(fields, chunk_number=first),
+            files={"chunk": ("chunk", data)},
+        )
+        if response.status_code not in (200, 201):
+            raise UploadError(f"Chunk {first} failed: {response.status_code} {response.text}")
+        return response, first, count, size, time.monotonic() - started
+
+    def _request(self, method, url, **kwargs):
+        """
+        Send a request, retrying connection errors and transient statuses
+        with exponential backoff and jitter.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = f"HTTP {response.status_code}"
+            except requests.ConnectionError as e:
+                error = str(e)
+            except requests.Timeout as e:
+                error = str(e)
+            if attempt == self.retries:
+                raise UploadError(f"{method.upper()} {url} failed after {attempt + 1} attempts: {error}")
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            self.log(f"Retrying in {delay:.1f} s ({error})")
+            time.sleep(delay)
+
+
+def default_file_id(file_path):
+    """
+    Stable id for a file, so running the upload again resumes it.
+    """
+    stat = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def chunked_upload(file_path, url, token, chunk_size=5 * 1024 * 1024, concurrency=4):
     """
     Handles chunked file upload.
 
@@ -10,36 +219,39 @@ def chunked_upload(file_path, url, token, chunk_size=5 * 1024 * 1024):
     :param url: Chunked upload endpoint.
     :param chunk_size: Size of each chunk in bytes (default: 5MB).
     """
-    file_id = str(uuid.uuid4())
-    file_name = os.path.basename(file_path)
-    total_chunks = (os.path.getsize(file_path) + chunk_size - 1) // chunk_size
-    headers = {
-            'Authorization': f'Token {token}'
-        }
-    with open(file_path, "rb") as file:
-        for chunk_number in range(1, total_chunks + 1):
-            chunk = file.read(chunk_size)
-            files = {'chunk': ('chunk', chunk)}
-            data = {
-                'chunk_number': chunk_number,
-                'total_chunks': total_chunks,
-                'file_id': file_id,
-                'file_name': file_name
-            }
-            response = requests.post(url, data=data, files=files, headers=headers)
-            if response.status_code == 200:
-                print(f"Chunk {chunk_number}/{total_chunks} uploaded successfully.")
-            elif response.status_code == 201 and chunk_number == total_chunks:
-                print("File uploaded successfully!")
-                print(f"Response: {response.json()}")  # Debugging final response
-            else:
-                print(f"Error uploading chunk {chunk_number}: {response.text}")
-                return
+    uploader = ChunkedUploader(url, token, concurrency=concurrency, block_size=chunk_size, initial_blocks=1)
+    return uploader.upload(file_path)
 
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload a large video with the chunked upload API.")
+    parser.add_argument("file_path", help="Path to the file to upload.")
+    parser.add_argument("--url", default=DEFAULT_URL, help="Chunked upload endpoint.")
+    parser.add_argument("--token", default=os.getenv("VIDEO_MANAGER_TOKEN"), help="API token (default: $VIDEO_MANAGER_TOKEN).")
+    parser.add_argument("--file-id", help="Upload id; defaults to one derived from the file, so reruns resume.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once.")
+    parser.add_argument("--block-size", type=int, default=MIN_BLOCK_SIZE,
+                        help="Server chunk size in bytes (at least 5 MiB with S3 storage).")
+    parser.add_argument("--max-blocks", type=int, default=16, help="Most chunks sent in one request.")
+    parser.add_argument("--target-seconds", type=float, default=2.0, help="Target duration of one request.")
+    parser.add_argument("--retries", type=int, default=5, help="Retries per request.")
+    args = parser.parse_args()
+
+    if not args.token:
+        parser.error("an API token is required (--token or $VIDEO_MANAGER_TOKEN)")
+
+    uploader = ChunkedUploader(
+        args.url, args.token,
+        concurrency=args.concurrency,
+        block_size=args.block_size,
+        max_blocks=args.max_blocks,
+        target_seconds=args.target_seconds,
+        retries=args.retries,
+    )
+    result = uploader.upload(args.file_path, file_id=args.file_id)
     print("File uploaded successfully!")
+    print(f"Response: {result}")
+
 
-# Example Usage
-file_path = ""  # Path to your large file
-upload_url = "http://localhost:8000/api/videos/chunked_upload/"  # Your chunked upload endpoint
-token = ''
-chunked_upload(file_path, upload_url, token)
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from kombu import Queue
 
 # Load environment variables from .env file
 load_dotenv()
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'videos.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'video_manager.urls'
@@ -78,12 +80,37 @@ WSGI_APPLICATION = 'video_manager.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL when DATABASE_ENGINE is "postgresql", for many concurrent
+# writers (web requests and Celery workers); otherwise SQLite, in WAL mode
+# (see videos/signals.py) so readers do not block the writer.
+if os.getenv('DATABASE_ENGINE', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DATABASE_NAME', 'video_manager'),
+            'USER': os.getenv('DATABASE_USER', 'postgres'),
+            'PASSWORD': os.getenv('DATABASE_PASSWORD', ''),
+            'HOST': os.getenv('DATABASE_HOST', 'localhost'),
+            'PORT': os.getenv('DATABASE_PORT', '5432'),
+            # Connections are kept open between requests and tasks, and
+            # checked before reuse.
+            'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+            # Behind a transaction-pooling PgBouncer, consecutive queries may
+            # run on different server connections.
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DATABASE_POOLER') == 'pgbouncer',
+            'OPTIONS': {'connect_timeout': 10},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            # Seconds a writer waits for the lock before "database is locked".
+            'OPTIONS': {'timeout': 20},
+        }
     }
-}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -123,7 +150,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "videos.authentication.TimedTokenAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -134,12 +161,72 @@ DJANGO_SETTINGS_MODULE='video_manager.settings pytest --cov=videos videos/tests/
 
 BASE_URL = "http://localhost:8000"
 
+# Cache (listing pages, ETags). Use a shared cache in production so every
+# process sees invalidations.
+if os.getenv('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Celery settings
 CELERY_BROKER_URL = os.getenv('BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('RESULT_BACKEND', 'redis://localhost:6379/0')
 CELERY_RESULT_EXPIRES = 3600
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+# Queues: "light" (cheap trims and merges), "heavy" (jobs estimated to cost at
+# least VIDEO_HEAVY_JOB_COST; see videos/routing.py) and "background"
+# (packaging, thumbnails, garbage collection). Run a worker per queue so
+# heavy jobs can't hold up light ones, e.g.
+#   celery -A video_manager worker -Q light -c 8
+#   celery -A video_manager worker -Q heavy -c 2
+#   celery -A video_manager worker -Q background -c 2
+CELERY_TASK_DEFAULT_QUEUE = 'light'
+# x-max-priority enables priorities on RabbitMQ, which serves 9 first; Redis
+# (below) serves 0 first. videos.routing.broker_priority sends each job's
+# priority in the scheme of the configured broker.
+CELERY_TASK_QUEUES = [
+    Queue('light', queue_arguments={'x-max-priority': 10}),
+    Queue('heavy', queue_arguments={'x-max-priority': 10}),
+    Queue('background', queue_arguments={'x-max-priority': 10}),
+]
+CELERY_TASK_ROUTES = {
+    'videos.tasks.package_video_task': {'queue': 'background'},
+    'videos.tasks.thumbnail_video_task': {'queue': 'background'},
+    'videos.tasks.analyze_video_task': {'queue': 'background'},
+    'videos.tasks.collect_blobs_task': {'queue': 'background'},
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    # Redis emulates priorities with a list per level; 0 is served first.
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+    # With acks_late a task is redelivered if not acknowledged within this
+    # many seconds, so it has to outlast the longest job.
+    'visibility_timeout': int(os.getenv('CELERY_VISIBILITY_TIMEOUT', 6 * 3600)),
+}
+# Media jobs run for minutes: take one message at a time, and acknowledge it
+# only when the task is done so a lost worker's job is run again.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+# Run with `celery -A video_manager beat`.
+CELERY_BEAT_SCHEDULE = {
+    'collect-blobs': {
+        'task': 'videos.tasks.collect_blobs_task',
+        'schedule': 3600.0,
+    },
+}
 
 # Media settings
 MEDIA_URL = '/media/'
@@ -156,4 +243,128 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Site URL
-SITE_URL = "http://127.0.0.1:8000"
\ No newline at end of file
+SITE_URL = "http://127.0.0.1:8000"
+# Video serving: set to "x-accel-redirect" (nginx) or "x-sendfile" (Apache,
+# lighttpd) to let the front-end server send file bytes instead of Python.
+VIDEO_SERVE_ACCEL = os.getenv('VIDEO_SERVE_ACCEL') or None
+# nginx `internal` location that aliases MEDIA_ROOT.
+VIDEO_ACCEL_REDIRECT_PREFIX = os.getenv('VIDEO_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+# Expirable links. Tokens are signed with the first key and verified with any
+# of them, so keys can be rotated (comma separated; default SECRET_KEY and
+# SECRET_KEY_FALLBACKS).
+VIDEO_LINK_SIGNING_KEYS = [key for key in os.getenv('VIDEO_LINK_SIGNING_KEYS', '').split(',') if key]
+VIDEO_LINK_MAX_EXPIRY = int(os.getenv('VIDEO_LINK_MAX_EXPIRY', 7 * 24 * 3600))  # seconds
+VIDEO_LINK_BATCH_SIZE = 500  # videos per batch link request
+# Seconds a process trusts what it read of a video's links (revocation,
+# existence); a revocation reaches other processes within this time.
+VIDEO_LINK_CACHE_TTL = int(os.getenv('VIDEO_LINK_CACHE_TTL', 30))
+# Serve expirable links, task long polls and task event streams from async
+# views. Only for ASGI servers (uvicorn, daphne): under WSGI an async body is
+# read into memory before it is sent.
+VIDEO_ASYNC_SERVE = os.getenv('VIDEO_ASYNC_SERVE', 'False') == 'True'
+
+# Largest upload accepted by VideoUploadView, enforced while the body streams
+# in. Requests can lower it with ``max_size``.
+VIDEO_UPLOAD_MAX_SIZE = int(os.getenv('VIDEO_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024))
+
+# Where blobs are stored (see videos/storage.py): "local", under MEDIA_ROOT,
+# or "s3", a bucket of an S3-compatible service. With s3, MEDIA_ROOT only
+# holds node-local scratch files.
+VIDEO_STORAGE = {'BACKEND': os.getenv('VIDEO_STORAGE_BACKEND', 'local')}
+if VIDEO_STORAGE['BACKEND'] == 's3':
+    VIDEO_STORAGE.update({
+        'ENDPOINT_URL': os.getenv('VIDEO_S3_ENDPOINT_URL', 'https://s3.amazonaws.com'),
+        'BUCKET': os.getenv('VIDEO_S3_BUCKET'),
+        'ACCESS_KEY': os.getenv('VIDEO_S3_ACCESS_KEY'),
+        'SECRET_KEY': os.getenv('VIDEO_S3_SECRET_KEY'),
+        'REGION': os.getenv('VIDEO_S3_REGION', 'us-east-1'),
+        'PREFIX': os.getenv('VIDEO_S3_PREFIX', ''),
+    })
+# Node-local cache of stored files read by workers (default under
+# MEDIA_ROOT), evicting the least recently used beyond this many bytes.
+VIDEO_STORAGE_CACHE_DIR = os.getenv('VIDEO_STORAGE_CACHE_DIR') or None
+VIDEO_STORAGE_CACHE_SIZE = int(os.getenv('VIDEO_STORAGE_CACHE_SIZE', 20 * 1024 ** 3))
+# Files fetched or hit within this many seconds are not evicted, as a worker
+# may have fetched one without opening it yet; the cache can stay over its
+# size until they age.
+VIDEO_STORAGE_CACHE_GRACE = int(os.getenv('VIDEO_STORAGE_CACHE_GRACE', 3600))
+
+# Content-addressed store: unreferenced blobs and stray files are kept this
+# many seconds before blobs.collect_garbage() removes them.
+VIDEO_BLOB_GC_GRACE = int(os.getenv('VIDEO_BLOB_GC_GRACE', 3600))
+
+# Adaptive-bitrate packaging (HLS + DASH). Renditions taller than the source
+# are skipped.
+VIDEO_PACKAGE_ON_UPLOAD = os.getenv('VIDEO_PACKAGE_ON_UPLOAD', 'True') == 'True'
+VIDEO_ABR_SEGMENT_DURATION = 4  # seconds
+VIDEO_ABR_AUDIO_BITRATE = 128000
+VIDEO_ABR_LADDER = [
+    {"name": "1080p", "height": 1080, "bitrate": 5000000},
+    {"name": "720p", "height": 720, "bitrate": 2800000},
+    {"name": "480p", "height": 480, "bitrate": 1400000},
+    {"name": "360p", "height": 360, "bitrate": 800000},
+    {"name": "240p", "height": 240, "bitrate": 400000},
+]
+
+# Scene cut, black frame and silence analysis (see videos/analysis.py), used
+# to snap trim points; a file's content is analyzed once.
+VIDEO_ANALYZE_ON_UPLOAD = os.getenv('VIDEO_ANALYZE_ON_UPLOAD', 'True') == 'True'
+# Trim points move to a boundary or keyframe at most this many seconds away.
+VIDEO_TRIM_SNAP_WINDOW = 2.0
+
+# Thumbnails: a poster frame plus seek-preview sprite sheets and a WebVTT
+# track, generated after upload.
+VIDEO_THUMBNAILS_ON_UPLOAD = os.getenv('VIDEO_THUMBNAILS_ON_UPLOAD', 'True') == 'True'
+VIDEO_THUMBNAIL_INTERVAL = 2  # seconds
+VIDEO_THUMBNAIL_WIDTH = 160
+VIDEO_SPRITE_COLUMNS = 10
+VIDEO_SPRITE_ROWS = 10
+VIDEO_POSTER_WIDTH = 640
+# Disk budget of frames extracted on demand; least recently used go first.
+VIDEO_THUMBNAIL_CACHE_SIZE = int(os.getenv('VIDEO_THUMBNAIL_CACHE_SIZE', 256 * 1024 * 1024))
+
+# Parallel trims and merges (mode "parallel"): sources are cut at keyframes into
+# segments of about this many seconds, each encoded by its own Celery task.
+VIDEO_TRANSCODE_SEGMENT_SECONDS = int(os.getenv('VIDEO_TRANSCODE_SEGMENT_SECONDS', 60))
+
+# Encoding profiles, chosen per trim or merge with ``profile``. ``crf`` sets
+# quality, ``maxrate`` (bits/s) caps the bitrate, ``threads`` 0 lets x264
+# pick, and ``temp_dir`` is where intermediate files go (None: next to the
+# output).
+VIDEO_ENCODING_PROFILES = {
+    "fast-preview": {
+        "preset": "ultrafast", "crf": 30, "maxrate": None, "tune": "fastdecode",
+        "x264_params": "rc-lookahead=10", "threads": 0, "audio_bitrate": 96000, "temp_dir": None,
+    },
+    "web": {
+        "preset": "medium", "crf": 23, "maxrate": 5000000, "tune": None,
+        "x264_params": None, "threads": 0, "audio_bitrate": 128000, "temp_dir": None,
+    },
+    "archive": {
+        "preset": "slow", "crf": 18, "maxrate": None, "tune": "film",
+        "x264_params": "aq-mode=3", "threads": 0, "audio_bitrate": 192000, "temp_dir": None,
+    },
+}
+VIDEO_DEFAULT_ENCODING_PROFILE = os.getenv('VIDEO_DEFAULT_ENCODING_PROFILE', 'web')
+# Ranges a batch trim (/api/videos/<id>/trim/batch/) may cut in one pass.
+VIDEO_BATCH_TRIM_MAX_RANGES = 32
+# Size limits of a transform graph (/api/videos/graph/, see videos/graph.py).
+VIDEO_GRAPH_MAX_NODES = 64
+VIDEO_GRAPH_MAX_OUTPUTS = 32
+
+# Metrics served at /metrics in the Prometheus text format. They are kept in
+# this cache so web and worker processes share them; point it at a shared
+# cache (CACHE_URL) in production, as the default LocMem cache only holds
+# the numbers of the process answering the scrape.
+VIDEO_METRICS_CACHE = os.getenv('VIDEO_METRICS_CACHE', 'default')
+# When set, /metrics requires ``Authorization: Bearer <token>``.
+VIDEO_METRICS_TOKEN = os.getenv('VIDEO_METRICS_TOKEN') or None
+# cProfile stats of tasks run with ``cprofile`` (staff only) are written here.
+VIDEO_CPROFILE_DIR = os.getenv('VIDEO_CPROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+# Trims and merges estimated to cost at least this many megapixel-frames (a
+# minute of 1080p30 encoded is about 3700) go to the heavy queue.
+VIDEO_HEAVY_JOB_COST = float(os.getenv('VIDEO_HEAVY_JOB_COST', 2000))
+# Jobs started within this many seconds count towards the queue wait times
+# reported by /api/videos/queues/.
+VIDEO_QUEUE_STATS_WINDOW = int(os.getenv('VIDEO_QUEUE_STATS_WINDOW', 3600))
@@ -3,11 +3,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from videos.views import metrics_view
 
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/videos/", include("videos.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
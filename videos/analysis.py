@@ -0,0 +1,215 @@
+"""
+Shot boundaries, black frames and silence of a media file, found with
+numpy in one pass over its frames (sampled at ANALYSIS_FPS and scaled down
+to FRAME_WIDTH x FRAME_HEIGHT luma) and one over its audio (mono at
+AUDIO_RATE), and used to snap trim points.
+
+The result is stored as an Analysis row keyed by content hash: an array
+of EVENT_DTYPE records in start time order, 13 bytes each. A scene cut is
+an event with start == end; black and silent stretches span their
+duration. The parameters below are part of VERSION: change them and bump
+it, so stored analyses are redone.
+"""
+import bisect
+import time
+import numpy as np
+from . import ffmpeg
+from .metrics import span
+
+VERSION = 1
+
+SCENE = 0
+BLACK = 1
+SILENCE = 2
+KIND_NAMES = {SCENE: "scenes", BLACK: "black", SILENCE: "silence"}
+# score: histogram distance of a cut (0 to 1), share of dark pixels of a
+# black stretch, mean level in dBFS of a silent one.
+EVENT_DTYPE = np.dtype([("start", "<f4"), ("end", "<f4"), ("kind", "u1"), ("score", "<f4")])
+
+ANALYSIS_FPS = 10
+FRAME_WIDTH = 64
+FRAME_HEIGHT = 36
+# Luma histograms have 256 >> HISTOGRAM_SHIFT bins.
+HISTOGRAM_SHIFT = 4
+HISTOGRAM_BINS = 256 >> HISTOGRAM_SHIFT
+# Half the L1 distance between the luma histograms of consecutive frames
+# above which they are taken to be from different shots.
+SCENE_THRESHOLD = 0.35
+# Pixels at or below this luma are dark; a frame is black when nearly all are.
+BLACK_PIXEL_LEVEL = 24
+BLACK_FRAME_RATIO = 0.98
+AUDIO_RATE = 8000
+AUDIO_WINDOW = 0.05  # seconds
+SILENCE_LEVEL = -50.0  # dBFS
+# Black and silent stretches shorter than this are not reported.
+MIN_STRETCH = 0.5  # seconds
+
+
+def frame_features(frames):
+    """
+    For an (n, height, width) array of luma frames: their normalized
+    HISTOGRAM_BINS-bin histograms and their share of dark pixels.
+    """
+    count = len(frames)
+    pixels = frames.reshape(count, -1)
+    # One bincount for the whole chunk: frame i counts into [i, i + 1) * BINS.
+    bins = (pixels >> HISTOGRAM_SHIFT).astype(np.intp)
+    bins += np.arange(count)[:, None] * HISTOGRAM_BINS
+    histograms = np.bincount(bins.ravel(), minlength=count * HISTOGRAM_BINS).reshape(count, HISTOGRAM_BINS)
+    dark = (pixels <= BLACK_PIXEL_LEVEL).mean(axis=1)
+    return histograms / pixels.shape[1], dark
+
+
+def window_levels(samples):
+    """
+    Level in dBFS of each whole AUDIO_WINDOW of 16-bit samples.
+    """
+    size = round(AUDIO_RATE * AUDIO_WINDOW)
+    windows = samples[:len(samples) // size * size].reshape(-1, size).astype(np.float64)
+    rms = np.sqrt((windows ** 2).mean(axis=1)) / 32768
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def _runs(mask, min_length):
+    """
+    (start, end) indexes of the runs of True in ``mask`` at least
+    ``min_length`` long; end is exclusive.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    keep = ends - starts >= min_length
+    return starts[keep], ends[keep]
+
+
+def _events(kind, starts, ends, scores):
+    events = np.empty(len(starts), EVENT_DTYPE)
+    events["start"], events["end"], events["kind"], events["score"] = starts, ends, kind, scores
+    return events
+
+
+def detect_video(chunks):
+    """
+    Scene cuts and black stretches in chunks of luma frames, as events.
+    """
+    histograms, dark = [], []
+    for chunk in chunks:
+        features = frame_features(np.frombuffer(chunk, np.uint8).reshape(-1, FRAME_HEIGHT, FRAME_WIDTH))
+        histograms.append(features[0])
+        dark.append(features[1])
+    if not histograms:
+        return np.empty(0, EVENT_DTYPE)
+    histograms, dark = np.concatenate(histograms), np.concatenate(dark)
+
+    distance = np.abs(np.diff(histograms, axis=0)).sum(axis=1) / 2
+    cuts = np.flatnonzero(distance >= SCENE_THRESHOLD) + 1
+    scenes = _events(SCENE, cuts / ANALYSIS_FPS, cuts / ANALYSIS_FPS, distance[cuts - 1])
+
+    starts, ends = _runs(dark >= BLACK_FRAME_RATIO, MIN_STRETCH * ANALYSIS_FPS)
+    shares = [dark[start:end].mean() for start, end in zip(starts, ends)]
+    black = _events(BLACK, starts / ANALYSIS_FPS, ends / ANALYSIS_FPS, shares)
+    return np.concatenate((scenes, black))
+
+
+def detect_audio(chunks):
+    """
+    Silent stretches in chunks of 16-bit mono samples, as events.
+    """
+    levels = []
+    rest = np.empty(0, np.int16)
+    window = round(AUDIO_RATE * AUDIO_WINDOW)
+    for chunk in chunks:
+        samples = np.concatenate((rest, np.frombuffer(chunk, "<i2")))
+        whole = len(samples) // window * window
+        levels.append(window_levels(samples[:whole]))
+        rest = samples[whole:]
+    if not levels:
+        return np.empty(0, EVENT_DTYPE)
+    levels = np.concatenate(levels)
+
+    starts, ends = _runs(levels < SILENCE_LEVEL, MIN_STRETCH / AUDIO_WINDOW)
+    means = [levels[start:end].mean() for start, end in zip(starts, ends)]
+    return _events(SILENCE, starts * AUDIO_WINDOW, ends * AUDIO_WINDOW, means)
+
+
+def analyze(file_path, has_audio=True):
+    """
+    The events of a file, in start time order.
+    """
+    with span("decode"):
+        events = [detect_video(ffmpeg.luma_frames(file_path, FRAME_WIDTH, FRAME_HEIGHT, ANALYSIS_FPS))]
+        if has_audio:
+            events.append(detect_audio(ffmpeg.audio_samples(file_path, AUDIO_RATE)))
+    events = np.concatenate(events)
+    return events[np.argsort(events["start"], kind="stable")]
+
+
+def get_analysis(media_info):
+    """
+    The stored Analysis of a file (by its MediaInfo), or None.
+    """
+    from .models import Analysis
+
+    return Analysis.objects.filter(content_hash=media_info.content_key(), version=VERSION).first()
+
+
+def analyze_file(file_path, media_info):
+    """
+    The Analysis of a file, made and stored unless a copy of its content was
+    analyzed before.
+    """
+    from .models import Analysis
+
+    analysis = get_analysis(media_info)
+    if analysis:
+        return analysis
+    started = time.monotonic()
+    events = analyze(file_path, has_audio=bool(media_info.audio_codec))
+    analysis, _ = Analysis.objects.get_or_create(
+        content_hash=media_info.content_key(), version=VERSION,
+        defaults={
+            "duration": media_info.duration or 0,
+            "events": events.tobytes(),
+            "analysis_time": round(time.monotonic() - started, 3),
+        },
+    )
+    return analysis
+
+
+def events(analysis):
+    return np.frombuffer(analysis.events, EVENT_DTYPE)
+
+
+def summary(analysis):
+    """
+    The events of an Analysis grouped by kind: cut times, and [start, end]
+    pairs for black and silent stretches.
+    """
+    records = events(analysis)
+    grouped = {}
+    for kind, name in KIND_NAMES.items():
+        found = records[records["kind"] == kind]
+        if kind == SCENE:
+            grouped[name] = [round(float(start), 3) for start in found["start"]]
+        else:
+            grouped[name] = [[round(float(start), 3), round(float(end), 3)] for start, end in found[["start", "end"]]]
+    return grouped
+
+
+def boundaries(analysis):
+    """
+    Sorted times a trim can snap to: scene cuts, and where black or silent
+    stretches start and end.
+    """
+    records = events(analysis)
+    times = np.unique(np.concatenate((records["start"], records["end"])))
+    return [round(float(seconds), 3) for seconds in times]
+
+
+def snap(seconds, candidates, window):
+    """
+    The candidate (from a sorted list) nearest to ``seconds``, if one is
+    within ``window`` seconds of it; otherwise ``seconds``.
+    """
+    index = bisect.bisect_left(candidates, seconds)
+    nearest = min(candidates[max(index - 1, 0):index + 1], key=lambda candidate: abs(candidate - seconds), default=None)
+    return nearest if nearest is not None and abs(nearest - seconds) <= window else seconds
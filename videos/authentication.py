@@ -0,0 +1,30 @@
+from rest_framework.authentication import TokenAuthentication
+from .metrics import span
+
+
+class TimedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication recording its time as the "auth" stage.
+    """
+
+    def authenticate(self, request):
+        with span("auth"):
+            return super().authenticate(request)
+
+
+async def aauthenticate(request):
+    """
+    TokenAuthentication for async views: the user of an ``Authorization:
+    Token <key>`` header, looked up with the async ORM, or None.
+    """
+    from rest_framework.authtoken.models import Token
+
+    with span("auth"):
+        parts = request.headers.get("Authorization", "").split()
+        if len(parts) != 2 or parts[0].lower() != "token":
+            return None
+        try:
+            token = await Token.objects.select_related("user").aget(key=parts[1])
+        except Token.DoesNotExist:
+            return None
+        return token.user if token.user.is_active else None
@@ -0,0 +1,320 @@
+"""
+Offline benchmarks of the upload, trim, merge and serve hot paths.
+
+Fixtures are synthetic clips generated locally with ffmpeg and kept between
+runs. Scenarios run against Django's test databases and a temporary
+MEDIA_ROOT, so nothing is left behind and no broker is needed.
+Results are plain JSON; compare() reports the scenarios that got slower.
+"""
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from rest_framework.test import APIClient
+from . import ffmpeg
+from .blobs import file_sha256
+from .models import MediaInfo
+from .probe import content_hash
+
+RESULTS_VERSION = 1
+# Settings the scenarios run under: files are read by Python, and nothing is
+# sent to the broker (no worker runs during a benchmark).
+OFFLINE_SETTINGS = {
+    "VIDEO_SERVE_ACCEL": None,
+    "VIDEO_PACKAGE_ON_UPLOAD": False,
+    "VIDEO_THUMBNAILS_ON_UPLOAD": False,
+    "VIDEO_ANALYZE_ON_UPLOAD": False,
+}
+
+# name: (width, height, duration in seconds)
+FIXTURES = {
+    "360p-10s": (640, 360, 10),
+    "360p-60s": (640, 360, 60),
+    "720p-30s": (1280, 720, 30),
+    "1080p-10s": (1920, 1080, 10),
+}
+QUICK_FIXTURES = {
+    "180p-4s": (320, 180, 4),
+    "360p-8s": (640, 360, 8),
+}
+FIXTURE_FPS = 30
+FIXTURE_GOP = 60
+CHUNK_SIZE = 1024 * 1024
+SERVE_RANGE = 1024 * 1024
+
+SCENARIOS = ("validate", "chunked_upload", "trim", "merge", "serve")
+
+
+def make_fixture(directory, name, width, height, duration):
+    """
+    Path of the synthetic clip ``name`` in ``directory``, generating it
+    unless it exists: a test pattern with a tone, H.264/AAC, a keyframe
+    every two seconds.
+    """
+    path = os.path.join(directory, f"{name}.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    partial = f"{path}.partial.mp4"
+    ffmpeg.run_ffmpeg([
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={FIXTURE_FPS}",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+        "-t", str(duration), "-c:v", "libx264", "-preset", "veryfast", "-g", str(FIXTURE_GOP),
+        "-pix_fmt", "yuv420p", "-c:a", "aac", partial,
+    ])
+    os.replace(partial, path)
+    return path
+
+
+def timed(function, repeat, setup=None):
+    """
+    Run ``function`` ``repeat`` times, calling ``setup`` untimed before each
+    run, and return the wall times with their min, median and mean.
+    """
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - started)
+    return {
+        "runs": [round(run, 6) for run in runs],
+        "min": round(min(runs), 6),
+        "median": round(statistics.median(runs), 6),
+        "mean": round(statistics.mean(runs), 6),
+    }
+
+
+def _with_throughput(stats, size):
+    stats["bytes"] = size
+    stats["throughput"] = round(size / stats["median"]) if stats["median"] else None
+    return stats
+
+
+def _client():
+    client = APIClient()
+    client.force_authenticate(User.objects.create_user(username=f"benchmark-{uuid.uuid4().hex[:8]}"))
+    return client
+
+
+def _forget_media_info(path):
+    # Probes are cached by content; drop the entry so each run probes.
+    MediaInfo.objects.filter(content_hash=content_hash(path)).delete()
+
+
+def bench_validate(fixtures, repeat, work_dir):
+    from .upload_handlers import StoredUploadedFile
+    from .utils import validate_video
+
+    results = {}
+    for name, path in fixtures.items():
+        def run():
+            with open(path, "rb") as f:
+                upload = StoredUploadedFile(f, None, os.path.basename(path), "video/mp4", os.path.getsize(path), None)
+                result = validate_video(upload, settings.VIDEO_UPLOAD_MAX_SIZE, 0, 24 * 3600)
+            assert result["success"], result
+
+        results[f"validate/{name}"] = _with_throughput(
+            timed(run, repeat, setup=lambda: _forget_media_info(path)), os.path.getsize(path),
+        )
+    return results
+
+
+def bench_chunked_upload(fixtures, repeat, work_dir):
+    """
+    Upload each fixture in CHUNK_SIZE chunks through the chunked upload
+    view, including reassembly and storing the result.
+    """
+    client = _client()
+    results = {}
+    for name, path in fixtures.items():
+        size = os.path.getsize(path)
+        total_chunks = -(-size // CHUNK_SIZE)
+
+        def run():
+            file_id = str(uuid.uuid4())
+            with open(path, "rb") as f:
+                for number in range(1, total_chunks + 1):
+                    response = client.post("/api/videos/chunked_upload/", {
+                        "file_id": file_id, "file_name": os.path.basename(path),
+                        "chunk_number": number, "total_chunks": total_chunks,
+                        "chunk_size": CHUNK_SIZE, "total_size": size,
+                        "chunk": SimpleUploadedFile("chunk", f.read(CHUNK_SIZE)),
+                    }, format="multipart")
+            assert response.status_code == 201, response.data
+
+        results[f"chunked_upload/{name}"] = _with_throughput(
+            timed(run, repeat, setup=lambda: _forget_media_info(path)), size,
+        )
+    return results
+
+
+def bench_trim(fixtures, repeat, work_dir):
+    """
+    Trim the middle half of each fixture in every trim mode.
+    """
+    from .tasks import TRIM_MODES, trim_video_task
+
+    results = {}
+    for name, path in fixtures.items():
+        duration = ffmpeg.probe(path)["duration"]
+        for mode in TRIM_MODES:
+            output_path = os.path.join(work_dir, f"trim-{name}-{mode}.mp4")
+
+            def run():
+                result = trim_video_task(path, duration / 4, duration * 3 / 4, output_path, mode)
+                assert result["status"] == "success", result
+
+            results[f"trim/{mode}/{name}"] = timed(run, repeat)
+    return results
+
+
+def bench_merge(fixtures, repeat, work_dir):
+    """
+    Merge three copies of the smallest fixture (remuxed), then all fixtures
+    (sizes differ, so they are re-encoded).
+    """
+    from .tasks import merge_videos_task
+
+    smallest = min(fixtures.values(), key=os.path.getsize)
+    cases = {"merge/remux": [smallest] * 3}
+    if len(fixtures) > 1:
+        cases["merge/mixed"] = list(fixtures.values())
+    results = {}
+    for case, paths in cases.items():
+        output_path = os.path.join(work_dir, "merged.mp4")
+
+        def run():
+            result = merge_videos_task(paths, output_path)
+            assert result["status"] == "success", result
+
+        results[case] = timed(run, repeat)
+    return results
+
+
+def bench_serve(fixtures, repeat, work_dir):
+    """
+    Read each fixture through ServeVideoView with an expirable link: the
+    whole file, and its first SERVE_RANGE bytes as a range request.
+    """
+    from .models import Video
+    from .utils import generate_expirable_link
+
+    client = _client()
+    results = {}
+    for name, path in fixtures.items():
+        relative = os.path.join("benchmark", os.path.basename(path))
+        target = os.path.join(settings.MEDIA_ROOT, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+        size = os.path.getsize(target)
+        video = Video.objects.create(name=os.path.basename(path), duration=0, size=size, file=relative)
+        url = generate_expirable_link(video, 3600).replace(settings.SITE_URL, "", 1)
+
+        def get(**headers):
+            response = client.get(url, **headers)
+            assert response.status_code in (200, 206), response.status_code
+            return sum(len(chunk) for chunk in response.streaming_content)
+
+        results[f"serve/full/{name}"] = _with_throughput(timed(get, repeat), size)
+        results[f"serve/range/{name}"] = _with_throughput(
+            timed(lambda: get(HTTP_RANGE=f"bytes=0-{SERVE_RANGE - 1}"), repeat), min(size, SERVE_RANGE),
+        )
+    return results
+
+
+BENCHMARKS = {
+    "validate": bench_validate,
+    "chunked_upload": bench_chunked_upload,
+    "trim": bench_trim,
+    "merge": bench_merge,
+    "serve": bench_serve,
+}
+
+
+def run(fixtures_dir, scenarios=SCENARIOS, repeat=3, quick=False, log=print):
+    """
+    Generate (or reuse) the fixtures in ``fixtures_dir``, run the named
+    scenarios and return the results.
+    """
+    specs = QUICK_FIXTURES if quick else FIXTURES
+    fixtures = {}
+    for name, (width, height, duration) in specs.items():
+        log(f"Fixture {name}")
+        fixtures[name] = make_fixture(fixtures_dir, name, width, height, duration)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "ffmpeg": _ffmpeg_version(),
+        },
+        "repeat": repeat,
+        "fixtures": {
+            name: {
+                "width": width, "height": height, "duration": duration,
+                "size": os.path.getsize(fixtures[name]), "sha256": file_sha256(fixtures[name]),
+            }
+            for name, (width, height, duration) in specs.items()
+        },
+        "scenarios": {},
+    }
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root, **OFFLINE_SETTINGS):
+            work_dir = os.path.join(media_root, "benchmark-work")
+            os.makedirs(work_dir)
+            for scenario in scenarios:
+                log(f"Scenario {scenario}")
+                results["scenarios"].update(BENCHMARKS[scenario](fixtures, repeat, work_dir))
+    finally:
+        teardown_databases(databases, verbosity=0)
+        teardown_test_environment()
+    return results
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Scenarios present in both results, as (name, baseline median, current
+    median, ratio, regressed) rows; ``regressed`` is set when the median
+    grew by more than ``threshold`` (a fraction).
+    """
+    rows = []
+    for name, stats in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before or not before["median"]:
+            continue
+        ratio = stats["median"] / before["median"]
+        rows.append((name, before["median"], stats["median"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _ffmpeg_version():
+    proc = subprocess.run([ffmpeg.ffmpeg_binary(), "-version"], capture_output=True, text=True)
+    return proc.stdout.splitlines()[0] if proc.stdout else None
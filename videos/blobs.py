@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, ProtectedError, Q
+from django.utils.timezone import now
+from .storage import LocalStorage, fetch, get_storage
+
+BLOB_DIR = "blobs"
+INCOMING_DIR = os.path.join(BLOB_DIR, "incoming")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def blob_name(sha256, suffix=""):
+    """
+    Storage name of a blob: fanned out by hash prefix so no directory grows
+    too large.
+    """
+    return os.path.join(BLOB_DIR, sha256[:2], sha256[2:4], f"{sha256}{suffix}")
+
+
+def incoming_path(suffix=""):
+    """
+    A new empty file in the local incoming directory under MEDIA_ROOT; with
+    the local backend it is on the same filesystem as the blobs, so
+    ingesting it is a rename.
+    """
+    directory = os.path.join(settings.MEDIA_ROOT, INCOMING_DIR)
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _blob_for(path, sha256, suffix):
+    from .models import Blob
+
+    blob, _ = Blob.objects.get_or_create(
+        sha256=sha256, defaults={"name": blob_name(sha256, suffix), "size": os.path.getsize(path)},
+    )
+    return blob
+
+
+def ingest(path, sha256=None, suffix=None):
+    """
+    Move the local file at ``path`` into the store under its SHA-256
+    (computed unless given) and return its Blob. If the content is already
+    stored, ``path`` is removed instead. References are counted by the rows
+    that point at the blob, not here.
+    """
+    if suffix is None:
+        suffix = os.path.splitext(path)[1].lower()
+    blob = _blob_for(path, sha256 or file_sha256(path), suffix)
+    storage = get_storage()
+    if storage.exists(blob.name):
+        os.remove(path)
+    else:
+        storage.save(blob.name, path)
+    return blob
+
+
+def ingest_stored(name, suffix):
+    """
+    ingest() for a file already in the store as ``name``, such as a
+    completed chunked upload: it is renamed to its blob's name, or removed
+    if the content is already stored.
+    """
+    storage = get_storage()
+    path = fetch(name)
+    blob = _blob_for(path, file_sha256(path), suffix)
+    if storage.exists(blob.name):
+        storage.delete(name)
+    else:
+        storage.move(name, blob.name)
+    return blob
+
+
+def acquire(*sha256s):
+    """
+    Count one more reference to each of the blobs, in one UPDATE.
+    """
+    from .models import Blob
+
+    if sha256s:
+        Blob.objects.filter(sha256__in=sha256s).update(refcount=F("refcount") + 1, released_at=None)
+
+
+def release(sha256):
+    from .models import Blob
+
+    Blob.objects.filter(sha256=sha256, refcount__gt=0).update(refcount=F("refcount") - 1)
+    Blob.objects.filter(sha256=sha256, refcount=0, released_at=None).update(released_at=now())
+
+
+def params_hash(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def source_hash(sources):
+    """
+    Key of an ordered list of source blob hashes.
+    """
+    if len(sources) == 1:
+        return sources[0]
+    return hashlib.sha256("\n".join(sources).encode()).hexdigest()
+
+
+def find_artifact(sources, operation, params):
+    """
+    The stored Artifact for (sources, operation, params), if its blob is
+    still in the store.
+    """
+    from .models import Artifact
+
+    artifact = Artifact.objects.select_related("blob").filter(
+        source_hash=source_hash(sources), operation=operation, params_hash=params_hash(params),
+    ).first()
+    if artifact and get_storage().exists(artifact.blob.name):
+        return artifact
+    return None
+
+
+def record_artifact(path, sources, operation, params, result):
+    """
+    Ingest a task's output file and record it as the artifact for (sources,
+    operation, params). Returns the Artifact, which may already have been
+    recorded by a concurrent identical task.
+    """
+    from .models import Artifact
+
+    blob = ingest(path)
+    artifact, _ = Artifact.objects.get_or_create(
+        source_hash=source_hash(sources), operation=operation, params_hash=params_hash(params),
+        defaults={"params": params, "sources": list(sources), "blob": blob, "result": result},
+    )
+    return artifact
+
+
+def collect_garbage(grace=None):
+    """
+    Delete blobs that have been unreferenced for longer than ``grace``
+    seconds (default settings.VIDEO_BLOB_GC_GRACE), artifacts derived from
+    deleted blobs, and stray files in the store older than ``grace``: failed
+    uploads in the incoming directory and files whose row was rolled back.
+    Returns the number of files and bytes removed.
+    """
+    from .models import Artifact, Blob
+
+    grace = settings.VIDEO_BLOB_GC_GRACE if grace is None else grace
+    removed, freed = 0, 0
+    storage = get_storage()
+
+    while True:
+        # Artifacts of deleted blobs release theirs, which may then be due too.
+        cutoff = now() - timedelta(seconds=grace)
+        candidates = Blob.objects.filter(refcount=0).filter(
+            Q(released_at__lt=cutoff) | Q(released_at=None, created_at__lt=cutoff)
+        )
+        collected = set()
+        for blob in candidates:
+            try:
+                count, _ = Blob.objects.filter(sha256=blob.sha256, refcount=0).delete()
+            except ProtectedError:
+                # Referenced by a row created after the count was read.
+                continue
+            if count:
+                collected.add(blob.sha256)
+                size = storage.delete(blob.name)
+                if size is not None:
+                    removed, freed = removed + 1, freed + size
+        if not collected:
+            break
+        for artifact in Artifact.objects.only("id", "sources", "blob"):
+            if collected.intersection(artifact.sources):
+                artifact.delete()
+        # Newly released blobs are only due after their own grace period.
+        if grace:
+            break
+
+    known = set(Blob.objects.values_list("name", flat=True))
+    # The local incoming directory is scratch space of every backend.
+    stores = [(storage, BLOB_DIR)] + ([] if storage.local else [(LocalStorage(), INCOMING_DIR)])
+    for store, prefix in stores:
+        for stored in list(store.list(prefix)):
+            if stored.name not in known and stored.st_mtime < cutoff.timestamp():
+                if store.delete(stored.name) is not None:
+                    removed, freed = removed + 1, freed + stored.st_size
+    return removed, freed
@@ -0,0 +1,598 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from moviepy.config import get_setting
+from .metrics import span
+
+# Called as callback(seconds, finished) while ffmpeg runs; see reporting().
+_progress = ContextVar("ffmpeg_progress", default=None)
+# {"peak_rss": bytes} of the runs in a measuring() block.
+_usage = ContextVar("ffmpeg_usage", default=None)
+# ru_maxrss is in kilobytes, except on macOS where it is in bytes.
+RSS_SCALE = 1 if sys.platform == "darwin" else 1024
+
+
+def ffmpeg_binary():
+    """
+    Path of the ffmpeg binary moviepy is configured with.
+    """
+    return get_setting("FFMPEG_BINARY")
+
+
+@contextmanager
+def reporting(callback):
+    """
+    Within the block, every run_ffmpeg() call reports how many seconds of
+    output it has written as ``callback(seconds, finished)``; ``finished`` is
+    True once, for the final figure of each run. (ffmpeg only counts frames
+    when it encodes, so the output time is what stream copies report too.)
+    """
+    token = _progress.set(callback)
+    try:
+        yield
+    finally:
+        _progress.reset(token)
+
+
+@contextmanager
+def measuring():
+    """
+    Within the block, the peak resident set size of every run_ffmpeg()
+    process is read from its own resource usage as it exits; peak_rss()
+    gives the largest.
+    """
+    token = _usage.set({"peak_rss": 0})
+    try:
+        yield
+    finally:
+        _usage.reset(token)
+
+
+def peak_rss():
+    """
+    Peak resident set size in bytes of the largest run_ffmpeg() process of
+    the enclosing measuring() block so far, or None outside one.
+    """
+    usage = _usage.get()
+    return usage["peak_rss"] if usage is not None else None
+
+
+def _wait(proc):
+    """
+    proc.wait() for an ffmpeg process, reaped with wait4() so its peak RSS
+    is recorded for measuring().
+    """
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    usage = _usage.get()
+    if usage is not None:
+        usage["peak_rss"] = max(usage["peak_rss"], rusage.ru_maxrss * RSS_SCALE)
+    return proc.returncode
+
+
+def run_ffmpeg(args):
+    """
+    Run ffmpeg with the given arguments, raising IOError on failure.
+    """
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-y"] + list(args)
+    callback = _progress.get()
+    if callback is None:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        with proc.stderr:
+            stderr = proc.stderr.read()
+        if _wait(proc):
+            raise IOError(stderr.decode("utf8", errors="replace")[-2000:])
+        return
+
+    # -progress writes key=value blocks, each ending with a progress= line,
+    # to stdout; stderr goes to a file so neither pipe can fill up.
+    cmd[1:1] = ["-progress", "pipe:1", "-nostats"]
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        seconds = 0.0
+        for line in proc.stdout:
+            key, _, value = line.decode("ascii", errors="replace").strip().partition("=")
+            if key == "out_time_us" and value.lstrip("-").isdigit():
+                seconds = max(int(value) / 1e6, 0.0)
+            elif key == "progress":
+                callback(seconds, value == "end")
+        proc.stdout.close()
+        if _wait(proc):
+            stderr.seek(0)
+            raise IOError(stderr.read().decode("utf8", errors="replace")[-2000:])
+
+
+def probe(file_path):
+    """
+    Read stream information from the container header of a media file.
+    Nothing is decoded; ffmpeg stops after printing the input description.
+    """
+    proc = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", file_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    output = proc.stderr.decode("utf8", errors="replace")
+    if "No such file or directory" in output or "Invalid data found" in output:
+        raise IOError(f"Could not read media file: {file_path}")
+
+    info = {
+        "duration": None,
+        "bitrate": None,
+        "video_codec": None,
+        "video_profile": None,
+        "width": None,
+        "height": None,
+        "fps": None,
+        "timebase": None,
+        "pix_fmt": None,
+        "audio_codec": None,
+        "audio_sample_rate": None,
+        "audio_channels": None,
+    }
+
+    match = re.search(r"Duration: (\d+):(\d+):(\d+\.\d+)", output)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    match = re.search(r"bitrate: (\d+) kb/s", output)
+    if match:
+        info["bitrate"] = int(match.group(1)) * 1000
+
+    for line in output.splitlines():
+        if "Stream #" not in line:
+            continue
+        if "Video:" in line and info["video_codec"] is None:
+            description = line.split("Video:", 1)[1]
+            info["video_codec"] = description.split()[0].strip(",")
+            match = re.match(r"\s*\S+ \(([^)]+)\)", description)
+            if match and "/" not in match.group(1):
+                info["video_profile"] = match.group(1)
+            match = re.search(r"[ ,]([a-z0-9]+)(?:\(.*?\))?, (\d{2,5})x(\d{2,5})", description)
+            if match:
+                info["pix_fmt"] = match.group(1)
+                info["width"] = int(match.group(2))
+                info["height"] = int(match.group(3))
+            match = re.search(r"([\d.]+)(k?) fps", description)
+            if match:
+                info["fps"] = float(match.group(1)) * (1000 if match.group(2) else 1)
+            match = re.search(r"([\d.]+)(k?) tbn", description)
+            if match:
+                info["timebase"] = int(float(match.group(1)) * (1000 if match.group(2) else 1))
+        elif "Audio:" in line and info["audio_codec"] is None:
+            description = line.split("Audio:", 1)[1]
+            info["audio_codec"] = description.split()[0].strip(",")
+            match = re.search(r"(\d+) Hz, ([^,]+)", description)
+            if match:
+                info["audio_sample_rate"] = int(match.group(1))
+                info["audio_channels"] = _channel_count(match.group(2).strip())
+
+    if info["duration"] is None and info["video_codec"] is None:
+        raise IOError(f"Could not read media file: {file_path}")
+    return info
+
+
+def _channel_count(layout):
+    named = {"mono": 1, "stereo": 2, "2.1": 3, "quad": 4, "5.0": 5, "5.1": 6, "7.1": 8}
+    if layout in named:
+        return named[layout]
+    match = re.match(r"(\d+) channels", layout)
+    return int(match.group(1)) if match else None
+
+
+def keyframe_times(file_path):
+    """
+    Return the presentation times (in seconds) of the video keyframes.
+    Only keyframes are decoded, so this is cheap even for 4K sources.
+    """
+    cmd = [
+        ffmpeg_binary(), "-hide_banner", "-nostdin", "-nostats",
+        "-skip_frame", "nokey", "-i", file_path,
+        "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-",
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode:
+        raise IOError(proc.stderr.decode("utf8", errors="replace")[-2000:])
+    output = proc.stderr.decode("utf8", errors="replace")
+    times = [float(t) for t in re.findall(r"pts_time:\s*(-?[\d.]+)", output)]
+    return sorted(set(times))
+
+
+# Pieces that are later spliced with concat_copy keep their H.264 parameter
+# sets in-band, so pieces from different encoders decode correctly.
+INTERMEDIATE_ARGS = ["-bsf:v", "h264_mp4toannexb", "-f", "nut"]
+
+
+@span("remux")
+def copy_segment(file_path, start_time, end_time, output_path, fps=None, intermediate=False):
+    """
+    Copy the packets between two keyframe-aligned times without decoding.
+
+    Packets are selected in decode order, so with B-frames a time limit alone
+    lets a couple of frames from the next GOP through; passing ``fps`` caps
+    the video at the exact frame count of the range.
+    """
+    args = [
+        "-ss", f"{start_time:.6f}", "-i", file_path,
+        "-t", f"{end_time - start_time:.6f}",
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c", "copy", "-avoid_negative_ts", "make_zero",
+    ]
+    if fps:
+        args += ["-frames:v", str(round((end_time - start_time) * fps))]
+    if intermediate:
+        args += INTERMEDIATE_ARGS
+    run_ffmpeg(args + [output_path])
+
+
+@span("encode")
+def encode_segment(file_path, start_time, end_time, output_path, intermediate=False, profile=None, target=None):
+    """
+    Re-encode a short time range with frame accuracy. With ``target`` (a
+    probe() result, normally the source's) the streams are encoded to its
+    layout, so the range can be spliced with packets copied from the source.
+    """
+    args = [
+        "-ss", f"{start_time:.6f}", "-i", file_path,
+        "-t", f"{end_time - start_time:.6f}",
+        "-map", "0:v:0", "-map", "0:a:0?",
+    ]
+    if target:
+        args += _target_video_args(target, container=not intermediate, profile=profile)
+        if target["audio_codec"]:
+            args += _target_audio_args(target, profile)
+    else:
+        args += ["-pix_fmt", "yuv420p"] + x264_args(profile) + aac_args(profile)
+    if intermediate:
+        args += INTERMEDIATE_ARGS
+    run_ffmpeg(args + [output_path])
+
+
+@span("encode")
+def encode_graph(inputs, filters, outputs):
+    """
+    Run a compiled transform graph (see graph.plan) as one ffmpeg process.
+    ``inputs`` are (path, seek, duration) with None to read the whole file,
+    ``filters`` the chains of the filter_complex, and ``outputs`` (video
+    label, audio label or None, output path, encoding profile). Every
+    output is encoded at the same time from the frames decoded once.
+    """
+    args = []
+    for path, seek, duration in inputs:
+        if seek is not None:
+            args += ["-ss", f"{seek:.6f}", "-t", f"{duration:.6f}"]
+        args += ["-i", path]
+    args += ["-filter_complex", ";".join(filters)]
+    for video, audio, output_path, profile in outputs:
+        args += ["-map", f"[{video}]", "-pix_fmt", "yuv420p"] + x264_args(profile)
+        if audio:
+            args += ["-map", f"[{audio}]"] + aac_args(profile)
+        args += ["-movflags", "+faststart", output_path]
+    run_ffmpeg(args)
+
+
+def _write_concat_list(file_paths, list_path, durations=None):
+    with open(list_path, "w") as list_file:
+        for i, path in enumerate(file_paths):
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+            if durations:
+                list_file.write(f"duration {durations[i]:.6f}\n")
+
+
+@span("remux")
+def concat_copy(file_paths, output_path, list_path):
+    """
+    Concatenate files with identical stream layouts using the concat demuxer.
+    Packets are remuxed, never decoded.
+    """
+    _write_concat_list(file_paths, list_path)
+    run_ffmpeg([
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+        "-movflags", "+faststart", output_path,
+    ])
+
+
+# Stream properties that must match for files to be decoded one after the
+# other as a single input: the concat demuxer keeps the first file's codecs
+# and time bases, so files that differ here come out mistimed.
+DECODE_KEYS = ("video_codec", "timebase", "audio_codec", "audio_sample_rate")
+
+# Stream properties that must match for packets to be concatenated as-is.
+CONCAT_KEYS = (
+    "video_codec", "video_profile", "width", "height", "pix_fmt", "fps", "timebase",
+    "audio_codec", "audio_sample_rate", "audio_channels",
+)
+
+H264_PROFILES = {"Baseline": "baseline", "Constrained Baseline": "baseline", "Main": "main", "High": "high"}
+
+
+def stream_signature(info):
+    """
+    Tuple of the stream properties that decide whether two files can be
+    concatenated without re-encoding.
+    """
+    return tuple(round(info[key], 2) if key == "fps" and info[key] else info[key] for key in CONCAT_KEYS)
+
+
+@span("encode")
+def normalize(file_path, source, target, output_path, profile=None):
+    """
+    Re-encode a file so its streams match ``target``, letterboxing to the
+    target size and adding silence if audio is missing. ``source`` and
+    ``target`` are probe() results.
+    """
+    args = ["-i", file_path]
+    if target["audio_codec"] and not source["audio_codec"]:
+        layout = "mono" if target["audio_channels"] == 1 else "stereo"
+        args += ["-f", "lavfi", "-i", f"anullsrc=r={target['audio_sample_rate']}:cl={layout}", "-shortest"]
+        audio_map = ["-map", "1:a:0"]
+    else:
+        audio_map = ["-map", "0:a:0"]
+
+    args += ["-map", "0:v:0"] + _target_video_args(target, profile=profile)
+    if target["audio_codec"]:
+        args += audio_map + _target_audio_args(target, profile)
+    else:
+        args += ["-an"]
+    run_ffmpeg(args + [output_path])
+
+
+@span("encode")
+def concat_encode(file_paths, target, output_path, list_path, profile=None):
+    """
+    Decode files one after the other through the concat demuxer and encode
+    them into ``target``'s layout in a single pass. Only one input is open
+    at a time whatever the number of files; sizes, frame rates and pixel
+    formats may change from file to file, but the files must share
+    DECODE_KEYS (and so all have audio or all lack it).
+    """
+    _write_concat_list(file_paths, list_path)
+    args = ["-f", "concat", "-safe", "0", "-i", list_path, "-map", "0:v:0"]
+    args += _target_video_args(target, profile=profile)
+    if target["audio_codec"]:
+        # async fills gaps between files' audio with silence.
+        args += ["-map", "0:a:0?", "-af", f"aresample={target['audio_sample_rate']}:async=1"]
+        args += _target_audio_args(target, profile)
+    else:
+        args += ["-an"]
+    run_ffmpeg(args + ["-movflags", "+faststart", output_path])
+
+
+@span("encode")
+def encode_part(file_path, start_time, end_time, source, target, output_path, profile=None):
+    """
+    Encode a time range into ``target``'s video layout as an intermediate
+    piece for stitch_parts(). Audio is kept as PCM (silence if the source
+    has none) so pieces join without encoder priming gaps; it is encoded
+    once, when stitched.
+    """
+    args = ["-ss", f"{start_time:.6f}", "-i", file_path, "-t", f"{end_time - start_time:.6f}"]
+    if target["audio_codec"] and not source["audio_codec"]:
+        layout = "mono" if target["audio_channels"] == 1 else "stereo"
+        args += ["-f", "lavfi", "-i", f"anullsrc=r={target['audio_sample_rate']}:cl={layout}", "-shortest"]
+        audio_map = ["-map", "1:a:0"]
+    else:
+        audio_map = ["-map", "0:a:0"]
+
+    args += ["-map", "0:v:0"] + _target_video_args(target, container=False, profile=profile)
+    if target["audio_codec"]:
+        args += audio_map + [
+            "-c:a", "pcm_s16le",
+            "-ar", str(target["audio_sample_rate"]),
+            "-ac", str(target["audio_channels"]),
+        ]
+    else:
+        args += ["-an"]
+    run_ffmpeg(args + INTERMEDIATE_ARGS + [output_path])
+
+
+@span("remux")
+def stitch_parts(file_paths, durations, target, output_path, list_path, profile=None):
+    """
+    Join pieces written by encode_part() without re-encoding the video,
+    encoding their audio in one go. Each piece is placed after the
+    ``durations`` of the ones before it: a piece's own duration counts the
+    B-frame delay at its start, which would leave gaps.
+    """
+    _write_concat_list(file_paths, list_path, durations)
+    args = ["-f", "concat", "-safe", "0", "-i", list_path, "-map", "0:v:0", "-c:v", "copy"]
+    if target["timebase"]:
+        args += ["-video_track_timescale", str(target["timebase"])]
+    if target["audio_codec"]:
+        args += ["-map", "0:a:0"] + _target_audio_args(target, profile)
+    run_ffmpeg(args + ["-movflags", "+faststart", output_path])
+
+
+def _target_video_args(target, container=True, profile=None):
+    """
+    Output options fitting the video into ``target``, letterboxed.
+    """
+    width, height = target["width"], target["height"]
+    video_filter = (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={target['fps']}"
+    )
+    args = ["-vf", video_filter, "-pix_fmt", target["pix_fmt"]] + x264_args(profile)
+    if target["video_profile"] in H264_PROFILES:
+        args += ["-profile:v", H264_PROFILES[target["video_profile"]]]
+    if container and target["timebase"]:
+        args += ["-video_track_timescale", str(target["timebase"])]
+    return args
+
+
+def _target_audio_args(target, profile=None):
+    return aac_args(profile) + [
+        "-ar", str(target["audio_sample_rate"]),
+        "-ac", str(target["audio_channels"]),
+    ]
+
+
+def x264_args(profile=None):
+    """
+    libx264 output options of an encoding profile (see
+    settings.VIDEO_ENCODING_PROFILES); x264's defaults without one.
+    """
+    args = ["-c:v", "libx264"]
+    if profile:
+        args += ["-preset", profile["preset"]] + x264_rate_args(profile)
+        if profile.get("threads") is not None:
+            args += ["-threads", str(profile["threads"])]
+    return args
+
+
+def x264_rate_args(profile):
+    """
+    The quality, bitrate and tuning options of an encoding profile.
+    """
+    args = []
+    if profile.get("crf") is not None:
+        args += ["-crf", str(profile["crf"])]
+    if profile.get("maxrate"):
+        args += ["-maxrate", str(profile["maxrate"]), "-bufsize", str(2 * profile["maxrate"])]
+    if profile.get("tune"):
+        args += ["-tune", profile["tune"]]
+    if profile.get("x264_params"):
+        args += ["-x264-params", profile["x264_params"]]
+    return args
+
+
+def aac_args(profile=None):
+    args = ["-c:a", "aac"]
+    if profile and profile.get("audio_bitrate"):
+        args += ["-b:a", str(profile["audio_bitrate"])]
+    return args
+
+
+@span("encode")
+def package_abr(file_path, ladder, audio_bitrate, segment_duration, output_dir):
+    """
+    Decode once and encode every rung of ``ladder`` (dicts with width,
+    height and bitrate) in the same pass, writing fMP4 segments plus an HLS
+    master playlist (master.m3u8) and a DASH manifest (manifest.mpd).
+    Keyframes are forced on segment boundaries so renditions switch cleanly.
+    Stream i of the output is ladder[i]; the audio stream, if
+    ``audio_bitrate`` is set, comes last.
+    """
+    split = f"[0:v]split={len(ladder)}" + "".join(f"[v{i}]" for i in range(len(ladder)))
+    scales = [f"[v{i}]scale={rung['width']}:{rung['height']}[out{i}]" for i, rung in enumerate(ladder)]
+    args = ["-i", file_path, "-filter_complex", ";".join([split] + scales)]
+    for i, rung in enumerate(ladder):
+        args += [
+            "-map", f"[out{i}]",
+            f"-b:v:{i}", str(rung["bitrate"]),
+            f"-maxrate:v:{i}", str(int(rung["bitrate"] * 1.1)),
+            f"-bufsize:v:{i}", str(rung["bitrate"] * 2),
+        ]
+    args += [
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-sc_threshold", "0", "-force_key_frames", f"expr:gte(t,n_forced*{segment_duration})",
+    ]
+    adaptation_sets = "id=0,streams=v"
+    if audio_bitrate:
+        args += ["-map", "0:a:0", "-c:a", "aac", "-b:a", str(audio_bitrate), "-ac", "2"]
+        adaptation_sets += " id=1,streams=a"
+    args += [
+        "-f", "dash", "-seg_duration", str(segment_duration),
+        "-use_template", "1", "-use_timeline", "0", "-hls_playlist", "1",
+        "-adaptation_sets", adaptation_sets,
+        "-init_seg_name", "init-$RepresentationID$.m4s",
+        "-media_seg_name", "chunk-$RepresentationID$-$Number%05d$.m4s",
+        os.path.join(output_dir, "manifest.mpd"),
+    ]
+    run_ffmpeg(args)
+
+
+@span("decode")
+def keyframe_images(file_path, width, height, output_dir):
+    """
+    Decode only the keyframes of a file, in a single pass, and write each one
+    scaled to ``width`` x ``height`` as key-NNNNNN.jpg in output_dir.
+    Returns (time, path) pairs in presentation order.
+    """
+    cmd = [
+        ffmpeg_binary(), "-hide_banner", "-nostdin", "-nostats",
+        "-skip_frame", "nokey", "-i", file_path,
+        "-map", "0:v:0", "-vf", f"scale={width}:{height},showinfo",
+        "-vsync", "0", "-q:v", "5", os.path.join(output_dir, "key-%06d.jpg"),
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode:
+        raise IOError(proc.stderr.decode("utf8", errors="replace")[-2000:])
+    output = proc.stderr.decode("utf8", errors="replace")
+    times = [float(t) for t in re.findall(r"pts_time:\s*(-?[\d.]+)", output)]
+    return [(time, os.path.join(output_dir, f"key-{i + 1:06d}.jpg")) for i, time in enumerate(times)]
+
+
+@span("encode")
+def tile_images(input_pattern, columns, rows, output_pattern):
+    """
+    Tile a numbered image sequence into sprite sheets of columns x rows,
+    in order. The last sheet keeps the full size, with unused tiles blank.
+    """
+    run_ffmpeg([
+        "-framerate", "1", "-i", input_pattern,
+        "-vf", f"tile={columns}x{rows}", "-q:v", "5", output_pattern,
+    ])
+
+
+@span("decode")
+def extract_frame(file_path, time, width, output_path):
+    """
+    Write the frame at ``time`` as a JPEG ``width`` pixels wide. The input is
+    seeked to the keyframe before ``time`` and decoded from there.
+    """
+    run_ffmpeg([
+        "-ss", f"{time:.6f}", "-i", file_path,
+        "-map", "0:v:0", "-frames:v", "1", "-vf", f"scale={width}:-2",
+        "-c:v", "mjpeg", "-q:v", "3", "-f", "image2", "-update", "1", output_path,
+    ])
+
+
+def _raw_output(args, chunk_size):
+    """
+    Run ffmpeg writing raw data to stdout and yield it in chunks of
+    ``chunk_size`` bytes (the last may be shorter), raising IOError if it
+    fails. Closing the generator early stops ffmpeg.
+    """
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-nostats", "-loglevel", "error"] + list(args) + ["pipe:1"]
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while chunk := proc.stdout.read(chunk_size):
+                yield chunk
+            proc.stdout.close()
+            if proc.wait():
+                stderr.seek(0)
+                raise IOError(stderr.read().decode("utf8", errors="replace")[-2000:])
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+def luma_frames(file_path, width, height, fps, frames_per_chunk=256):
+    """
+    Decode the first video stream, sampled at ``fps`` and scaled to ``width``
+    x ``height``, as 8-bit luma: yields chunks of whole frames of
+    width * height bytes each. The loop filter is skipped, which speeds up
+    decoding and does not matter at this size.
+    """
+    return _raw_output([
+        "-skip_loop_filter", "all", "-i", file_path, "-map", "0:v:0",
+        "-vf", f"fps={fps},scale={width}:{height}:flags=area,format=gray", "-f", "rawvideo",
+    ], width * height * frames_per_chunk)
+
+
+def audio_samples(file_path, rate, samples_per_chunk=1 << 16):
+    """
+    Decode the first audio stream, downmixed to mono at ``rate`` Hz: yields
+    chunks of signed 16-bit little-endian samples.
+    """
+    return _raw_output([
+        "-i", file_path, "-map", "0:a:0", "-ac", "1", "-ar", str(rate), "-f", "s16le",
+    ], 2 * samples_per_chunk)
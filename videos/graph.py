@@ -0,0 +1,461 @@
+"""
+Transform graphs: a job spec describing a DAG of operations over one or
+more input videos, run as a single ffmpeg pass (see ffmpeg.encode_graph).
+Each input is decoded once and each operation becomes a chain in one
+filter_complex. Each output is encoded from the node it names. A trim,
+a resize and a watermark therefore cost one decode and one encode, and
+every extra output of the same graph costs one more encode.
+
+A spec is a dict:
+
+    {
+        "inputs": {"main": "<video>", "logo": "<video>"},
+        "nodes": {
+            "cut": {"op": "trim", "source": "main", "start": 10, "end": 20},
+            "small": {"op": "scale", "source": "cut", "width": 640},
+            "marked": {"op": "watermark", "source": "small", "image": "logo"},
+        },
+        "outputs": [{"node": "marked", "name": "clip.mp4"}, {"node": "cut", "profile": "archive"}],
+    }
+
+Inputs are Video ids in requests and storage names in tasks. Inputs and
+nodes share one namespace. A node's ``source`` names an input or another
+node; concat takes a list of them as ``sources``. The operations (OPS):
+
+- trim: from ``start`` to ``end`` seconds (default the end of the source).
+- concat: ``sources`` one after the other, letterboxed to ``width`` x
+  ``height`` at ``fps`` (default those of the first source). Sources
+  without audio add silence.
+- scale: to ``width`` and/or ``height``. With only one of them, the other
+  keeps the aspect ratio.
+- fps: resample to ``fps`` frames per second.
+- watermark: overlay ``image`` (an input or node), ``width`` pixels wide
+  (default its own width), at ``position`` (see POSITIONS), ``margin``
+  pixels in from the edges, with an ``opacity`` from 0 to 1. Of a video
+  image, the first frame is used.
+
+An output names a ``node``. It may also give a file ``name``, an encoding
+``profile`` and ``"audio": false``.
+"""
+from collections import namedtuple
+from django.conf import settings
+from .profiles import profile_names
+
+OPS = ("trim", "concat", "scale", "fps", "watermark")
+POSITIONS = {
+    "top-left": ("{margin}", "{margin}"),
+    "top-right": ("W-w-{margin}", "{margin}"),
+    "bottom-left": ("{margin}", "H-h-{margin}"),
+    "bottom-right": ("W-w-{margin}", "H-h-{margin}"),
+    "center": ("(W-w)/2", "(H-h)/2"),
+}
+# Channel layout of concatenated audio.
+CONCAT_CHANNELS = "stereo"
+# Seconds decoded past the latest trim end of a seeked input, so the last
+# frame of the range is not lost to the input's -t limit.
+SEEK_SLACK = 0.25
+
+
+class GraphError(ValueError):
+    """
+    A spec that is malformed or does not fit its inputs.
+    """
+
+
+# A parsed spec; ``order`` lists the nodes so that sources come first.
+Graph = namedtuple("Graph", "inputs nodes outputs order")
+
+# What a node produces: its video size, frame rate and duration in seconds,
+# and the sample rate of its audio (None without audio).
+Layout = namedtuple("Layout", "width height fps duration audio")
+
+# A compiled graph. ``inputs`` are (input name, seek, duration) in ffmpeg
+# input order, with None for a whole file. ``filters`` are the chains of
+# the filter_complex. ``outputs`` are (video label, audio label or None)
+# and ``layouts`` the Layout of each output.
+Plan = namedtuple("Plan", "inputs filters outputs layouts")
+
+
+def _sources(node):
+    """
+    Names a node reads, in order: its sources, then a watermark's image.
+    """
+    if node["op"] == "concat":
+        return list(node["sources"])
+    return [node["source"]] + ([node["image"]] if node["op"] == "watermark" else [])
+
+
+def _number(node, key, name, default=None, minimum=0, integer=False):
+    value = node.get(key, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+        raise GraphError(f"{key} of node {name!r} must be a number of at least {minimum}.")
+    if integer and value != int(value):
+        raise GraphError(f"{key} of node {name!r} must be a whole number.")
+    return int(value) if integer else float(value)
+
+
+def _check_node(name, node):
+    if not isinstance(node, dict) or node.get("op") not in OPS:
+        raise GraphError(f"op of node {name!r} must be one of {', '.join(OPS)}.")
+    op = node["op"]
+    if op == "concat":
+        sources = node.get("sources")
+        if not isinstance(sources, list) or len(sources) < 2 or not all(isinstance(s, str) for s in sources):
+            raise GraphError(f"sources of node {name!r} must be a list of at least two names.")
+        _number(node, "width", name, minimum=2, integer=True)
+        _number(node, "height", name, minimum=2, integer=True)
+        _number(node, "fps", name, minimum=1)
+    elif not isinstance(node.get("source"), str):
+        raise GraphError(f"source of node {name!r} must be a name.")
+    if op == "trim":
+        start = _number(node, "start", name, default=0)
+        end = _number(node, "end", name)
+        if end is not None and end <= start:
+            raise GraphError(f"end of node {name!r} must be after its start.")
+    elif op == "scale":
+        width = _number(node, "width", name, minimum=2, integer=True)
+        height = _number(node, "height", name, minimum=2, integer=True)
+        if width is None and height is None:
+            raise GraphError(f"Node {name!r} needs a width or a height.")
+    elif op == "fps":
+        if _number(node, "fps", name, minimum=1) is None:
+            raise GraphError(f"Node {name!r} needs an fps.")
+    elif op == "watermark":
+        if not isinstance(node.get("image"), str):
+            raise GraphError(f"image of node {name!r} must be a name.")
+        if node.get("position", "bottom-right") not in POSITIONS:
+            raise GraphError(f"position of node {name!r} must be one of {', '.join(POSITIONS)}.")
+        _number(node, "width", name, minimum=2, integer=True)
+        _number(node, "margin", name, integer=True)
+        opacity = _number(node, "opacity", name, default=1)
+        if opacity > 1:
+            raise GraphError(f"opacity of node {name!r} must be between 0 and 1.")
+
+
+def parse(spec):
+    """
+    Check a spec and return its Graph. Raises GraphError if it is
+    malformed, names something that does not exist, has a cycle, has an
+    input or node no output uses, or has more than
+    settings.VIDEO_GRAPH_MAX_NODES nodes or settings.VIDEO_GRAPH_MAX_OUTPUTS
+    outputs.
+    """
+    if not isinstance(spec, dict):
+        raise GraphError("The spec must be an object with inputs, nodes and outputs.")
+    inputs, nodes, outputs = spec.get("inputs"), spec.get("nodes", {}), spec.get("outputs")
+    if not isinstance(inputs, dict) or not inputs or not all(isinstance(v, str) for v in inputs.values()):
+        raise GraphError("inputs must map names to videos.")
+    if not isinstance(nodes, dict):
+        raise GraphError("nodes must map names to operations.")
+    if len(nodes) > settings.VIDEO_GRAPH_MAX_NODES:
+        raise GraphError(f"A graph has at most {settings.VIDEO_GRAPH_MAX_NODES} nodes.")
+    if not isinstance(outputs, list) or not 0 < len(outputs) <= settings.VIDEO_GRAPH_MAX_OUTPUTS:
+        raise GraphError(f"outputs must be a list of 1 to {settings.VIDEO_GRAPH_MAX_OUTPUTS} outputs.")
+    if set(inputs) & set(nodes):
+        raise GraphError(f"Names used for both an input and a node: {', '.join(sorted(set(inputs) & set(nodes)))}.")
+    for name, node in nodes.items():
+        _check_node(name, node)
+        for source in _sources(node):
+            if source not in inputs and source not in nodes:
+                raise GraphError(f"Node {name!r} reads {source!r}, which is not an input or a node.")
+    for output in outputs:
+        if not isinstance(output, dict) or (output.get("node") not in nodes and output.get("node") not in inputs):
+            raise GraphError("Each output must name a node or an input.")
+        if output.get("profile") is not None and output["profile"] not in profile_names():
+            raise GraphError(f"profile must be one of {', '.join(profile_names())}.")
+
+    # Depth-first from the outputs: sources before the nodes reading them.
+    order, state = [], {}
+
+    def visit(name):
+        if name in inputs or state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise GraphError(f"The graph has a cycle through node {name!r}.")
+        state[name] = "visiting"
+        for source in _sources(nodes[name]):
+            visit(source)
+        state[name] = "done"
+        order.append(name)
+
+    for output in outputs:
+        visit(output["node"])
+    used = {output["node"] for output in outputs}.union(*(_sources(nodes[name]) for name in order))
+    unused = (set(nodes) | set(inputs)) - used - set(order)
+    if unused:
+        raise GraphError(f"Not used by any output: {', '.join(sorted(unused))}.")
+    return Graph(inputs, nodes, outputs, order)
+
+
+def _even(value):
+    return max(2, round(value / 2) * 2)
+
+
+def _layout(node, name, layouts):
+    """
+    The Layout a node produces from those of its sources.
+    """
+    op = node["op"]
+    source = layouts[node["sources"][0] if op == "concat" else node["source"]]
+    if op == "trim":
+        start = node.get("start", 0)
+        end = node.get("end", source.duration)
+        if end > source.duration + 1e-3 or start >= end:
+            raise GraphError(f"Node {name!r} trims {start:g}-{end:g}s of {source.duration:g}s.")
+        return source._replace(duration=end - start)
+    if op == "concat":
+        sources = [layouts[s] for s in node["sources"]]
+        rates = [layout.audio for layout in sources if layout.audio]
+        return Layout(
+            _even(node.get("width", source.width)), _even(node.get("height", source.height)),
+            node.get("fps", source.fps), sum(layout.duration for layout in sources),
+            rates[0] if rates else None,
+        )
+    if op == "scale":
+        width, height = node.get("width"), node.get("height")
+        if width is None:
+            width = height * source.width / source.height
+        if height is None:
+            height = width * source.height / source.width
+        return source._replace(width=_even(width), height=_even(height))
+    if op == "fps":
+        return source._replace(fps=node["fps"])
+    return source
+
+
+def _input_layout(info):
+    return Layout(
+        info["width"], info["height"], info["fps"] or 25, info["duration"] or 0.0,
+        info["audio_sample_rate"] if info["audio_codec"] else None,
+    )
+
+
+def plan(graph, infos):
+    """
+    Compile a Graph into a Plan, given the media info dicts of its inputs
+    by input name. Raises GraphError if it does not fit them, such as a
+    trim past the end of its source.
+
+    Inputs read only by trims are seeked to the earliest start and cut at
+    the latest end, so the frames before and after are not decoded. A
+    stream read more than once is split, and audio is only processed for
+    nodes whose audio reaches an output.
+    """
+    inputs, nodes, outputs = graph.inputs, graph.nodes, graph.outputs
+    layouts = {name: _input_layout(infos[name]) for name in inputs}
+    for name in graph.order:
+        layouts[name] = _layout(nodes[name], name, layouts)
+
+    # Readers of each name's video, and of its audio where that is used.
+    video_reads = {name: 0 for name in list(inputs) + graph.order}
+    audio_reads = dict(video_reads)
+    output_audio = [output.get("audio", True) is not False and bool(layouts[output["node"]].audio)
+                    for output in outputs]
+    for output, audio in zip(outputs, output_audio):
+        video_reads[output["node"]] += 1
+        audio_reads[output["node"]] += audio
+    for name in reversed(graph.order):
+        node = nodes[name]
+        for source in _sources(node):
+            video_reads[source] += 1
+        if audio_reads[name]:
+            audio_sources = node["sources"] if node["op"] == "concat" else [node["source"]]
+            for source in audio_sources:
+                audio_reads[source] += bool(layouts[source].audio)
+
+    # Seek inputs that only trims read.
+    seeks = {}
+    for name in inputs:
+        readers = [nodes[n] for n in graph.order if name in _sources(nodes[n])]
+        if readers and all(n["op"] == "trim" and n["source"] == name for n in readers) and \
+                not any(output["node"] == name for output in outputs):
+            start = min(n.get("start", 0) for n in readers)
+            end = max(n.get("end", layouts[name].duration) for n in readers)
+            seeks[name] = (start, end - start + SEEK_SLACK)
+
+    filters = []
+    labels = {}  # name: ([video labels], [audio labels]) left to hand out
+
+    def publish(name, video, audio):
+        pools = []
+        for label, reads, split in ((video, video_reads[name], "split"), (audio, audio_reads[name], "asplit")):
+            if label is None or not reads:
+                pools.append([])
+            elif reads == 1:
+                pools.append([label])
+            else:
+                copies = [f"{label}_{i}" for i in range(reads)]
+                filters.append(f"[{label}]{split}={reads}" + "".join(f"[{copy}]" for copy in copies))
+                pools.append(copies)
+        labels[name] = pools
+
+    def take(name, audio=False):
+        return labels[name][audio].pop()
+
+    plan_inputs = []
+    for index, name in enumerate(inputs):
+        seek, duration = seeks.get(name, (None, None))
+        plan_inputs.append((name, seek, duration))
+        video = f"in{index}v"
+        filters.append(f"[{index}:v:0]null[{video}]")
+        audio = None
+        if audio_reads[name]:
+            audio = f"in{index}a"
+            filters.append(f"[{index}:a:0]anull[{audio}]")
+        publish(name, video, audio)
+
+    for index, name in enumerate(graph.order):
+        node, layout = nodes[name], layouts[name]
+        video, audio = f"n{index}v", f"n{index}a" if audio_reads[name] else None
+        op = node["op"]
+        if op == "trim":
+            offset = seeks.get(node["source"], (0, None))[0]
+            start = node.get("start", 0) - offset
+            end = start + layout.duration
+            trim = f"start={start:.6f}:end={end:.6f}"
+            filters.append(f"[{take(node['source'])}]trim={trim},setpts=PTS-STARTPTS[{video}]")
+            if audio:
+                filters.append(f"[{take(node['source'], True)}]atrim={trim},asetpts=PTS-STARTPTS[{audio}]")
+        elif op == "concat":
+            fit = (
+                f"scale={layout.width}:{layout.height}:force_original_aspect_ratio=decrease,"
+                f"pad={layout.width}:{layout.height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={layout.fps},format=yuv420p"
+            )
+            pairs = ""
+            for i, source in enumerate(node["sources"]):
+                filters.append(f"[{take(source)}]{fit}[{video}_{i}]")
+                pairs += f"[{video}_{i}]"
+                if audio:
+                    fmt = f"aresample={layout.audio},aformat=sample_fmts=fltp:channel_layouts={CONCAT_CHANNELS}"
+                    if layouts[source].audio:
+                        filters.append(f"[{take(source, True)}]{fmt}[{audio}_{i}]")
+                    else:
+                        filters.append(
+                            f"anullsrc=r={layout.audio}:cl={CONCAT_CHANNELS},"
+                            f"atrim=duration={layouts[source].duration:.6f},{fmt}[{audio}_{i}]"
+                        )
+                    pairs += f"[{audio}_{i}]"
+            count = len(node["sources"])
+            if audio:
+                filters.append(f"{pairs}concat=n={count}:v=1:a=1[{video}][{audio}]")
+            else:
+                filters.append(f"{pairs}concat=n={count}:v=1:a=0[{video}]")
+        elif op == "watermark":
+            image = take(node["image"])
+            # The image's first frame, held for as long as the source runs:
+            # an image that is itself a video must not outlast it.
+            chain = ["trim=end_frame=1"]
+            if node.get("width"):
+                chain.append(f"scale={node['width']}:-2")
+            if node.get("opacity", 1) < 1:
+                chain += ["format=rgba", f"colorchannelmixer=aa={node['opacity']:.3f}"]
+            filters.append(f"[{image}]{','.join(chain)}[{video}_image]")
+            image = f"{video}_image"
+            x, y = (
+                value.format(margin=node.get("margin", 16))
+                for value in POSITIONS[node.get("position", "bottom-right")]
+            )
+            filters.append(f"[{take(node['source'])}][{image}]overlay=x={x}:y={y}:eof_action=repeat[{video}]")
+        else:
+            if op == "scale":
+                step = f"scale={layout.width}:{layout.height},setsar=1"
+            else:
+                step = f"fps={layout.fps}"
+            filters.append(f"[{take(node['source'])}]{step}[{video}]")
+        if audio and op in ("scale", "fps", "watermark"):
+            filters.append(f"[{take(node['source'], True)}]anull[{audio}]")
+        publish(name, video, audio)
+
+    plan_outputs = [
+        (take(output["node"]), take(output["node"], True) if audio else None)
+        for output, audio in zip(outputs, output_audio)
+    ]
+    return Plan(plan_inputs, filters, plan_outputs, [layouts[output["node"]] for output in outputs])
+
+
+def _upstream(graph, name):
+    """
+    The nodes and inputs ``name`` depends on, itself included.
+    """
+    seen, pending = set(), [name]
+    while pending:
+        name = pending.pop()
+        if name not in seen:
+            seen.add(name)
+            if name in graph.nodes:
+                pending.extend(_sources(graph.nodes[name]))
+    return seen
+
+
+def artifact_params(graph, output):
+    """
+    What identifies an output apart from the content of its inputs: the
+    names of the inputs it reads, sorted (their blobs are the artifact's
+    sources, in that order), and params holding the nodes it depends on and
+    its options other than the file name.
+    """
+    names = _upstream(graph, output["node"])
+    inputs = sorted(names & set(graph.inputs))
+    return inputs, {
+        "inputs": inputs,
+        "nodes": {name: graph.nodes[name] for name in graph.order if name in names},
+        "output": {key: value for key, value in output.items() if key != "name"},
+    }
+
+
+def _chain(spec, last, transforms):
+    """
+    Append ``transforms`` (nodes without a source) after node ``last`` and
+    make the end of the chain the spec's one output. A watermark's image is
+    a video, added as an input.
+    """
+    for i, transform in enumerate(transforms):
+        transform = dict(transform)
+        if transform.get("op") == "watermark":
+            spec["inputs"][f"image{i}"] = transform.get("image")
+            transform["image"] = f"image{i}"
+        spec["nodes"][f"step{i}"] = dict(transform, source=last)
+        last = f"step{i}"
+    spec["outputs"] = [{"node": last}]
+    return spec
+
+
+def trim_spec(video, start, end, transforms=()):
+    """
+    The trim preset: ``video`` from ``start`` to ``end`` seconds, then
+    ``transforms``.
+    """
+    spec = {"inputs": {"source": video}, "nodes": {"trim": {"op": "trim", "source": "source", "start": start,
+                                                             "end": end}}}
+    return _chain(spec, "trim", transforms)
+
+
+def merge_spec(videos, transforms=()):
+    """
+    The merge preset: ``videos`` one after the other, then ``transforms``.
+    A video listed twice is decoded once.
+    """
+    names = {}
+    for video in videos:
+        names.setdefault(video, f"input{len(names)}")
+    spec = {"inputs": {name: video for video, name in names.items()}, "nodes": {}}
+    if len(videos) == 1:
+        return _chain(spec, names[videos[0]], transforms)
+    spec["nodes"]["merge"] = {"op": "concat", "sources": [names[video] for video in videos]}
+    return _chain(spec, "merge", transforms)
+
+
+def batch_trim_spec(video, ranges):
+    """
+    The batch trim preset: an output per (start, end) range of ``video``.
+    """
+    return {
+        "inputs": {"source": video},
+        "nodes": {
+            f"range{i}": {"op": "trim", "source": "source", "start": start, "end": end}
+            for i, (start, end) in enumerate(ranges)
+        },
+        "outputs": [{"node": f"range{i}"} for i in range(len(ranges))],
+    }
@@ -0,0 +1,231 @@
+import os
+import time
+from celery import Task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+from . import ffmpeg
+from .blobs import acquire
+from .metrics import capture_profile
+from .models import Blob, Job, Video
+from .probe import get_media_info
+from .routing import route
+from .signals import invalidate_video_list
+from .storage import fetch
+
+# Time of the last PROGRESS update stored per running task.
+_last_progress = {}
+
+
+class JobTask(Task):
+    """
+    Base class of tasks run for a Job (the task id is the job id). The
+    task's update_state calls are mirrored onto the Job row (PROGRESS
+    updates at most every ``progress_interval`` seconds, except the one
+    reaching the last frame), and a successful result's output file is
+    registered as a Video. The task runs within ffmpeg.measuring(), so its
+    ffmpeg processes' peak memory is its own.
+    """
+
+    progress_interval = 0.5
+
+    def __call__(self, *args, **kwargs):
+        with ffmpeg.measuring():
+            if self.request.called_directly:
+                return super().__call__(*args, **kwargs)
+            # Run by a worker or apply(), which pushed the request already;
+            # Task.__call__ would push a bare one over it.
+            return self.run(*args, **kwargs)
+
+    def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+        task_id = task_id or self.request.id
+        if task_id is None:
+            # Called directly rather than run as a task.
+            return
+        if state == "PROGRESS" and meta and meta.get("frame") != meta.get("total_frames"):
+            last = _last_progress.get(task_id, 0)
+            if time.monotonic() - last < self.progress_interval:
+                return
+            _last_progress[task_id] = time.monotonic()
+        if not self.request.is_eager:
+            super().update_state(task_id, state, meta, **kwargs)
+        record_progress(task_id, meta or {})
+
+    def before_start(self, task_id, args, kwargs):
+        Job.objects.filter(id=task_id).update(status=Job.RUNNING, started_at=now(), version=F("version") + 1)
+
+    def on_success(self, retval, task_id, args, kwargs):
+        _last_progress.pop(task_id, None)
+        finish_job(task_id, retval)
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        _last_progress.pop(task_id, None)
+        Job.objects.filter(id=task_id).update(
+            status=Job.FAILURE, error=str(exc), finished_at=now(), version=F("version") + 1,
+        )
+
+
+def enqueue(task, kind, args, sources, output_name, params=None, cprofile=False, cost=None):
+    """
+    Create the Job for a task and send the task with the job id as its id,
+    so the row exists before the worker reports on it. The queue and
+    priority follow from the job's estimated ``cost`` (see routing.route).
+    With ``cprofile`` the task runs under cProfile.
+    """
+    options = route(cost)
+    job = Job.objects.create(kind=kind, params=params or {}, output_name=output_name, cost=cost, **options)
+    job.sources.set(sources)
+    if cprofile:
+        capture_profile(job.id)
+    task.apply_async(args, task_id=str(job.id), **options)
+    return job
+
+
+def record_progress(job_id, meta):
+    """
+    Copy the progress fields of an update_state ``meta`` onto the Job.
+    """
+    fields = {key: meta[key] for key in ("message", "current", "total", "frame", "total_frames") if key in meta}
+    if not fields:
+        return
+    if meta.get("total_frames"):
+        fields["percent"] = min(100.0, 100.0 * meta.get("frame", 0) / meta["total_frames"])
+    elif meta.get("total"):
+        fields["percent"] = min(100.0, 100.0 * meta.get("current", 0) / meta["total"])
+    fields["message"] = fields.get("message", "")[:255]
+    Job.objects.filter(id=job_id).update(version=F("version") + 1, **fields)
+
+
+class FrameProgress:
+    """
+    ffmpeg.reporting() callback turning the output time of one or more
+    ffmpeg runs into frame-level PROGRESS updates of ``task``, against
+    ``seconds`` of output across all runs at ``fps``.
+    """
+
+    def __init__(self, task, seconds, fps, message):
+        self.task = task
+        self.fps = fps or 25
+        self.total_frames = max(round(seconds * self.fps), 1)
+        self.message = message
+        self.done = 0.0
+
+    def __call__(self, seconds, finished):
+        current = self.done + seconds
+        if finished:
+            self.done = current
+        self.task.update_state(state="PROGRESS", meta={
+            "message": self.message,
+            "frame": min(round(current * self.fps), self.total_frames),
+            "total_frames": self.total_frames,
+        })
+
+
+def finish_job(job_id, result):
+    """
+    Mark a job finished with the task's result, registering its output as
+    a Video when it succeeded. A job that has already finished is left as
+    it is, so a task delivered twice finishes its job once. The outputs are
+    fetched and probed first; only the row writes run in the transaction.
+    """
+    job = Job.objects.filter(id=job_id).first()
+    if job is None or job.status in Job.FINISHED:
+        return job
+    failed = isinstance(result, dict) and result.get("status") == "error"
+    if failed:
+        outputs = []
+    elif "outputs" in result:
+        # A batch or graph: one Video per output, named as the output asks
+        # or after its range or node; the result keeps the order of the
+        # outputs and says which Video each became.
+        stem, ext = os.path.splitext(job.output_name)
+        names = []
+        for output in result["outputs"]:
+            if output.get("name"):
+                names.append(output["name"])
+            elif "start_time" in output:
+                names.append(f"{stem}_{output['start_time']:g}-{output['end_time']:g}{ext}")
+            else:
+                names.append(f"{stem}_{output['node']}{ext}")
+        outputs = prepare_outputs(result["outputs"], names)
+    else:
+        outputs = prepare_outputs([result], [job.output_name])
+
+    with transaction.atomic():
+        # The first statement writes, so it waits for the row (for the
+        # database, on SQLite) and matches nothing once the job finished.
+        if not Job.objects.filter(id=job_id).exclude(status__in=Job.FINISHED).update(version=F("version") + 1):
+            return Job.objects.filter(id=job_id).first()
+        job = Job.objects.get(id=job_id)
+        job.result = result
+        job.finished_at = now()
+        if failed:
+            job.status = Job.FAILURE
+            job.error = result.get("error", "")
+        elif "outputs" in result:
+            outputs = save_outputs(outputs)
+            for output, video in zip(result["outputs"], outputs):
+                output["video"] = str(video.id)
+            job.outputs.set(outputs)
+            job.encode_time = result.get("encode_time")
+            job.status = Job.SUCCESS
+            job.percent = 100.0
+        else:
+            job.output = save_outputs(outputs)[0]
+            job.encode_time = result.get("encode_time")
+            job.bitrate = result.get("bitrate")
+            job.status = Job.SUCCESS
+            job.percent = 100.0
+        job.save()
+        return job
+
+
+def prepare_outputs(results, names):
+    """
+    Unsaved Videos named ``names`` for a job's output files, each fetched
+    and probed (see save_outputs), with one query for their blobs.
+    """
+    blobs = Blob.objects.in_bulk([result["sha256"] for result in results if result.get("sha256")])
+    videos = []
+    for result, name in zip(results, names):
+        blob = blobs.get(result.get("sha256"))
+        output_path = result["output_path"]
+        local_path = fetch(blob.name) if blob else output_path
+        media_info = get_media_info(local_path, blob.sha256 if blob else None)
+        videos.append(Video(
+            file=blob.name if blob else os.path.relpath(output_path, settings.MEDIA_ROOT),
+            blob=blob,
+            name=name,
+            duration=round(media_info.duration or 0),
+            size=os.path.getsize(local_path),
+            media_info=media_info,
+        ))
+    return videos
+
+
+def save_outputs(videos):
+    """
+    Save the Videos from prepare_outputs, except that an output whose
+    stored blob already has a Video gets that one instead, with one query
+    for those and one insert for the rest. Outputs of the same blob share
+    a Video.
+    """
+    videos_by_blob = {}
+    blob_ids = [video.blob_id for video in videos if video.blob_id]
+    for video in Video.objects.filter(blob__in=blob_ids).order_by("-uploaded_at"):
+        videos_by_blob[video.blob_id] = video  # the oldest is seen last
+    saved, new = [], []
+    for video in videos:
+        existing = videos_by_blob.get(video.blob_id) if video.blob_id else None
+        if existing is None:
+            new.append(video)
+            if video.blob_id:
+                videos_by_blob[video.blob_id] = video
+        saved.append(existing or video)
+    Video.objects.bulk_create(new)
+    # bulk_create sends no post_save, so the blob references and the
+    # listing version are updated here.
+    acquire(*(video.blob_id for video in new if video.blob_id))
+    invalidate_video_list(Video)
+    return saved
@@ -0,0 +1,155 @@
+"""
+Signed links to videos.
+
+A link token is a signed, compressed JSON object carrying the video id, the
+file's path under MEDIA_ROOT and its name, when the link was issued and
+when it expires, so a link is served without looking the video up.
+Tokens are signed with the first of settings.VIDEO_LINK_SIGNING_KEYS and
+verified against all of them: add a new key in front, and drop the old one
+once the links signed with it have expired.
+
+Revoking a video's links (Video.links_revoked_at) rejects every token
+issued before it. Each process reads that state through a small TTL
+cache, so a revocation reaches other processes within
+settings.VIDEO_LINK_CACHE_TTL seconds.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.signing import BadSignature, Signer, TimestampSigner
+
+SALT = "videos.links"
+
+Link = namedtuple("Link", "video_id file name issued_at expires_at")
+# What is known of a video to check its links: None if it does not exist.
+VideoState = namedtuple("VideoState", "file name revoked_at")
+
+
+class InvalidLink(Exception):
+    pass
+
+
+class TTLCache:
+    """
+    A small thread-safe in-process cache; entries expire ``ttl`` seconds
+    after they are stored and the oldest are dropped beyond ``maxsize``.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return default
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_states = TTLCache(maxsize=10000)
+_MISSING = object()
+
+
+def _signer():
+    keys = settings.VIDEO_LINK_SIGNING_KEYS or [settings.SECRET_KEY, *settings.SECRET_KEY_FALLBACKS]
+    return Signer(key=keys[0], fallback_keys=keys[1:], salt=SALT)
+
+
+def sign(video_id, expire_in_seconds, file=None, name=None):
+    """
+    A token for the video, valid for ``expire_in_seconds``. Tokens that only
+    name the video (no ``file``) are for assets found through it, such as
+    its HLS package.
+    """
+    # Milliseconds, so a link made right after a revocation is not caught by it.
+    issued_at = round(time.time(), 3)
+    payload = {"v": str(video_id), "i": issued_at, "e": int(issued_at) + int(expire_in_seconds)}
+    if file is not None:
+        payload.update(f=file, n=name)
+    return _signer().sign_object(payload, compress=True)
+
+
+def verify(token):
+    """
+    The Link of a token, raising InvalidLink if it is forged or expired.
+    Tokens of the earlier format (a TimestampSigner-signed video id and
+    expiry) are still accepted; they carry no file, so check() fills it in.
+    """
+    try:
+        data = _signer().unsign_object(token)
+        link = Link(data["v"], data.get("f"), data.get("n"), data["i"], data["e"])
+    except (BadSignature, KeyError, TypeError, ValueError):
+        try:
+            data = TimestampSigner().unsign_object(token)
+            link = Link(data["video_id"], None, None, 0, data["expires_at"])
+        except (BadSignature, KeyError, TypeError, ValueError):
+            raise InvalidLink("Invalid or expired token")
+    if link.expires_at < time.time():
+        raise InvalidLink("Token has expired")
+    return link
+
+
+def load_state(video_id):
+    from .models import Video
+
+    try:
+        row = Video.objects.filter(id=video_id).values_list("file", "name", "links_revoked_at").first()
+    except ValidationError:
+        row = None
+    state = VideoState(row[0], row[1], row[2].timestamp() if row[2] else None) if row else None
+    _states.set(str(video_id), state, settings.VIDEO_LINK_CACHE_TTL)
+    return state
+
+
+def _checked(link, state):
+    if state is None:
+        raise InvalidLink("Video not found")
+    if state.revoked_at is not None and link.issued_at <= state.revoked_at:
+        raise InvalidLink("Link has been revoked")
+    if link.file is None:
+        link = link._replace(file=state.file, name=state.name)
+    return link
+
+
+def check(link):
+    """
+    The link, with its file filled in, unless its video is gone or its
+    links were revoked since it was issued (InvalidLink).
+    """
+    state = _states.get(link.video_id, _MISSING)
+    if state is _MISSING:
+        state = load_state(link.video_id)
+    return _checked(link, state)
+
+
+async def acheck(link):
+    """
+    check() for async views.
+    """
+    state = _states.get(link.video_id, _MISSING)
+    if state is _MISSING:
+        state = await sync_to_async(load_state)(link.video_id)
+    return _checked(link, state)
+
+
+def forget(video_id):
+    """
+    Drop a video from this process's cache, after it changed.
+    """
+    _states.pop(str(video_id))
@@ -0,0 +1,56 @@
+import json
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from videos import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the upload, trim, merge and serve hot paths on synthetic clips and "
+        "write the results as JSON, optionally comparing them with earlier results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", action="append", choices=benchmarks.SCENARIOS,
+                            help="Scenario to run (repeatable; default: all).")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario.")
+        parser.add_argument("--quick", action="store_true", help="Use small fixtures only.")
+        parser.add_argument("--fixtures-dir", default=os.path.join(settings.BASE_DIR, "benchmarks", "fixtures"))
+        parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>.json).")
+        parser.add_argument("--compare", help="Earlier results file to compare with.")
+        parser.add_argument("--threshold", type=float, default=0.1,
+                            help="Slowdown (fraction of the median) reported as a regression.")
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        results = benchmarks.run(
+            options["fixtures_dir"], scenarios=options["scenario"] or benchmarks.SCENARIOS,
+            repeat=options["repeat"], quick=options["quick"], log=self.stdout.write,
+        )
+
+        output = options["output"] or os.path.join(
+            settings.BASE_DIR, "benchmarks", "results", f"{(results['commit'] or 'local')[:12]}.json",
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+        for name, stats in results["scenarios"].items():
+            line = f"{name:40} median {stats['median'] * 1000:10.1f} ms"
+            if stats.get("throughput"):
+                line += f"  {stats['throughput'] / 1e6:8.1f} MB/s"
+            self.stdout.write(line)
+        self.stdout.write(f"Results written to {output}")
+
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+            regressions = 0
+            for name, before, after, ratio, regressed in benchmarks.compare(baseline, results, options["threshold"]):
+                regressions += regressed
+                line = f"{name:40} {before * 1000:10.1f} ms -> {after * 1000:10.1f} ms  x{ratio:.2f}"
+                self.stdout.write(self.style.ERROR(line) if regressed else line)
+            if regressions:
+                raise CommandError(f"{regressions} scenario(s) slower than {options['compare']}.")
@@ -0,0 +1,257 @@
+"""
+Pipeline metrics, exposed in the Prometheus text format by metrics_view.
+
+Counters and histograms are kept in a Django cache
+(settings.VIDEO_METRICS_CACHE) so web and worker processes add to the same
+series; use a shared cache in production, as a process-local one (LocMem)
+only holds the numbers of the process serving the scrape. Every update is
+an atomic cache incr or add, and a process registers a series once.
+Recording is best effort: a cache error never fails the request or task
+being measured.
+"""
+import cProfile
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "metrics"
+# Upper bounds in seconds of the histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# name: (type, help, label names)
+METRICS = {
+    "video_stage_seconds": (
+        "histogram", "Time spent in a stage (probe, decode, encode, remux, io, auth, db, file_open, request) "
+        "of an operation.", ("operation", "stage"),
+    ),
+    "video_task_seconds": ("histogram", "Run time of Celery tasks.", ("task", "state")),
+    "video_queue_wait_seconds": ("histogram", "Time Celery tasks waited between being sent and starting.", ("task",)),
+    "video_bytes_in_total": ("counter", "Bytes of video received.", ("operation",)),
+    "video_bytes_out_total": ("counter", "Bytes of video sent in file responses.", ("operation",)),
+}
+
+# Name of the task or view being measured; the operation label of spans.
+_operation = ContextVar("metrics_operation", default="other")
+# Profilers and operation tokens of the tasks running in this process.
+_profilers = {}
+_tokens = {}
+# Series this process has registered in the cache.
+_registered = set()
+_warned_local = False
+
+
+def _cache():
+    return caches[settings.VIDEO_METRICS_CACHE]
+
+
+def _key(name, labels, suffix=""):
+    return f"{KEY_PREFIX}:{name}{suffix}:" + "|".join(labels)
+
+
+def _incr(cache, key, amount):
+    """
+    Add ``amount`` to a cache counter; True when the key was missing.
+    """
+    try:
+        cache.incr(key, amount)
+        return False
+    except ValueError:
+        # Missing key; add() keeps a concurrent first increment.
+        cache.add(key, 0, None)
+        cache.incr(key, amount)
+        return True
+
+
+def _register(cache, name, labels, created):
+    """
+    Add a series to the cache's index of ``name`` the first time this
+    process records it, or again when one of its keys was ``created`` (the
+    cache may have lost them). The index is entries numbered by an incr'ed
+    count, and the add() of a per-series flag keeps processes from listing
+    the same series twice.
+    """
+    series = (name, tuple(labels))
+    if series in _registered and not created:
+        return
+    if cache.add(_key(name, labels, "_registered"), True, None):
+        index_key = f"{KEY_PREFIX}:series:{name}"
+        cache.add(index_key, 0, None)
+        number = cache.incr(index_key)
+        cache.set(f"{index_key}:{number}", list(labels), None)
+    _registered.add(series)
+
+
+def inc(name, labels, amount=1):
+    """
+    Add ``amount`` to a counter.
+    """
+    try:
+        cache = _cache()
+        created = _incr(cache, _key(name, labels), int(amount))
+        _register(cache, name, labels, created)
+    except Exception:
+        logger.warning("Could not record %s", name, exc_info=True)
+
+
+def observe(name, labels, seconds):
+    """
+    Record a duration in a histogram. Only the bucket the value falls in is
+    incremented; render() makes the counts cumulative and takes the count
+    from the +Inf bucket.
+    """
+    try:
+        cache = _cache()
+        bucket = next((str(bound) for bound in BUCKETS if seconds <= bound), "+Inf")
+        created = _incr(cache, _key(name, labels, f"_bucket_{bucket}"), 1)
+        created |= _incr(cache, _key(name, labels, "_sum_us"), round(seconds * 1e6))
+        _register(cache, name, labels, created)
+    except Exception:
+        logger.warning("Could not record %s", name, exc_info=True)
+
+
+@contextmanager
+def operation(name):
+    """
+    Within the block, spans are labelled with operation ``name``.
+    """
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def set_operation(name):
+    """
+    Label the spans that follow, up to the end of the enclosing operation()
+    block, with operation ``name``.
+    """
+    _operation.set(name)
+
+
+def current_operation():
+    return _operation.get()
+
+
+@contextmanager
+def span(stage):
+    """
+    Time the block as ``stage`` of the current operation.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("video_stage_seconds", (_operation.get(), stage), time.perf_counter() - started)
+
+
+def render():
+    """
+    All recorded series in the Prometheus text exposition format.
+    """
+    global _warned_local
+    cache = _cache()
+    if isinstance(cache, LocMemCache) and not _warned_local:
+        logger.warning("VIDEO_METRICS_CACHE is process-local; /metrics only shows this process's numbers")
+        _warned_local = True
+    lines = []
+    for name, (kind, help_text, label_names) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for labels in _series(cache, name):
+            label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in zip(label_names, labels))
+            if kind == "counter":
+                lines.append(f"{name}{{{label_text}}} {cache.get(_key(name, labels)) or 0}")
+                continue
+            bounds = [str(bound) for bound in BUCKETS] + ["+Inf"]
+            keys = [_key(name, labels, f"_bucket_{bound}") for bound in bounds]
+            sum_key = _key(name, labels, "_sum_us")
+            values = cache.get_many(keys + [sum_key])
+            total = 0
+            for bound, key in zip(bounds, keys):
+                total += values.get(key, 0)
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {total}')
+            lines.append(f"{name}_sum{{{label_text}}} {values.get(sum_key, 0) / 1e6}")
+            lines.append(f"{name}_count{{{label_text}}} {total}")
+    return "\n".join(lines) + "\n"
+
+
+def _series(cache, name):
+    """
+    Label values of the registered series of ``name``, read from the
+    numbered index entries (an entry not yet written is skipped).
+    """
+    count = cache.get(f"{KEY_PREFIX}:series:{name}") or 0
+    entries = cache.get_many([f"{KEY_PREFIX}:series:{name}:{number}" for number in range(1, count + 1)])
+    return [entries[key] for key in sorted(entries, key=lambda key: int(key.rsplit(":", 1)[1]))]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def capture_profile(task_id):
+    """
+    Run the task with this id under cProfile (unless this worker process is
+    already profiling one); the stats are written to
+    settings.VIDEO_CPROFILE_DIR as ``<task name>-<task id>.prof``.
+    """
+    _cache().set(f"{KEY_PREFIX}:cprofile:{task_id}", True, 24 * 3600)
+
+
+def profile_path(task_name, task_id):
+    return os.path.join(settings.VIDEO_CPROFILE_DIR, f"{task_name.rsplit('.', 1)[-1]}-{task_id}.prof")
+
+
+@before_task_publish.connect
+def _stamp_sent_at(headers=None, **kwargs):
+    if headers is not None:
+        headers["sent_at"] = time.time()
+
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    request = task.request
+    request.metrics_started = time.perf_counter()
+    sent_at = getattr(request, "sent_at", None) or (request.headers or {}).get("sent_at")
+    if sent_at:
+        observe("video_queue_wait_seconds", (task.name,), max(time.time() - sent_at, 0))
+    # Keyed by name too: a task replaced by another runs it under its own id.
+    key = (task_id, task.name)
+    _tokens[key] = _operation.set(task.name.rsplit(".", 1)[-1])
+    try:
+        # The flag is taken by the first task run under the id.
+        if _cache().get(f"{KEY_PREFIX}:cprofile:{task_id}") and not _profilers:
+            _cache().delete(f"{KEY_PREFIX}:cprofile:{task_id}")
+            profiler = cProfile.Profile()
+            profiler.enable()
+            _profilers[key] = profiler
+    except Exception:
+        logger.warning("Could not start profiling task %s", task_id, exc_info=True)
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    key = (task_id, task.name)
+    profiler = _profilers.pop(key, None)
+    if profiler:
+        profiler.disable()
+        os.makedirs(settings.VIDEO_CPROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(profile_path(task.name, task_id))
+    token = _tokens.pop(key, None)
+    if token is not None:
+        try:
+            _operation.reset(token)
+        except ValueError:
+            # Set in another context (the task ran in a different thread).
+            pass
+    started = getattr(task.request, "metrics_started", None)
+    if started is not None:
+        observe("video_task_seconds", (task.name, state or "UNKNOWN"), time.perf_counter() - started)
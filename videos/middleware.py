@@ -0,0 +1,57 @@
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from . import metrics
+
+
+class MetricsMiddleware:
+    """
+    Label the request's spans with its URL name and record the time spent
+    handling it ("request") and in database queries ("db"). Async requests
+    stay async; their queries run in other threads, so async views time
+    them with span("db") themselves.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        db_time = [0.0]
+
+        def timed_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db_time[0] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with metrics.operation("other"):
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timed_query))
+                response = self.get_response(request)
+            operation = metrics.current_operation()
+            metrics.observe("video_stage_seconds", (operation, "request"), time.perf_counter() - started)
+            metrics.observe("video_stage_seconds", (operation, "db"), db_time[0])
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with metrics.operation("other"):
+            response = await self.get_response(request)
+            operation = metrics.current_operation()
+            metrics.observe("video_stage_seconds", (operation, "request"), time.perf_counter() - started)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if match:
+            metrics.set_operation(match.url_name or match.view_name)
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0002_alter_video_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('mtime', models.FloatField()),
+                ('size', models.BigIntegerField()),
+                ('duration', models.FloatField(null=True)),
+                ('bitrate', models.PositiveIntegerField(null=True)),
+                ('video_codec', models.CharField(max_length=32, null=True)),
+                ('video_profile', models.CharField(max_length=32, null=True)),
+                ('width', models.PositiveIntegerField(null=True)),
+                ('height', models.PositiveIntegerField(null=True)),
+                ('fps', models.FloatField(null=True)),
+                ('timebase', models.PositiveIntegerField(null=True)),
+                ('pix_fmt', models.CharField(max_length=32, null=True)),
+                ('audio_codec', models.CharField(max_length=32, null=True)),
+                ('audio_sample_rate', models.PositiveIntegerField(null=True)),
+                ('audio_channels', models.PositiveSmallIntegerField(null=True)),
+                ('keyframes', models.JSONField(default=list)),
+                ('probed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('content_hash', 'mtime')},
+            },
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='media_info',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='videos', to='videos.mediainfo'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0003_mediainfo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('file_id', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('total_chunks', models.PositiveIntegerField()),
+                ('chunk_size', models.PositiveBigIntegerField()),
+                ('total_size', models.PositiveBigIntegerField(null=True)),
+                ('received', models.BinaryField()),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('complete', 'Complete')], default='uploading', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='videos.video')),
+            ],
+        ),
+    ]
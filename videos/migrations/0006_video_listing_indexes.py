@@ -0,0 +1,21 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0005_chunkedupload_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['uploaded_at', 'id'], name='video_uploaded_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['name'], name='video_name_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0006_video_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoPackage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('directory', models.CharField(max_length=255)),
+                ('hls_playlist', models.CharField(default='master.m3u8', max_length=64)),
+                ('dash_manifest', models.CharField(default='manifest.mpd', max_length=64)),
+                ('segment_duration', models.FloatField()),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='package', to='videos.video')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Rendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('kind', models.CharField(choices=[('video', 'Video'), ('audio', 'Audio')], max_length=8)),
+                ('width', models.PositiveIntegerField(null=True)),
+                ('height', models.PositiveIntegerField(null=True)),
+                ('bitrate', models.PositiveIntegerField()),
+                ('playlist', models.CharField(max_length=64)),
+                ('init_segment', models.CharField(max_length=64)),
+                ('package', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='videos.videopackage')),
+            ],
+            options={
+                'ordering': ['kind', '-bitrate'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Segment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField()),
+                ('uri', models.CharField(max_length=64)),
+                ('start_time', models.FloatField()),
+                ('duration', models.FloatField()),
+                ('size', models.PositiveIntegerField()),
+                ('rendition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='videos.rendition')),
+            ],
+            options={
+                'ordering': ['rendition', 'sequence'],
+                'unique_together': {('rendition', 'sequence')},
+            },
+        ),
+    ]
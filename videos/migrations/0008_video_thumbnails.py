@@ -0,0 +1,35 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0007_video_packaging'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThumbnailSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('directory', models.CharField(max_length=255)),
+                ('interval', models.FloatField()),
+                ('tile_width', models.PositiveIntegerField(null=True)),
+                ('tile_height', models.PositiveIntegerField(null=True)),
+                ('columns', models.PositiveIntegerField()),
+                ('rows', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('sprite_count', models.PositiveIntegerField(default=0)),
+                ('vtt', models.CharField(default='thumbnails.vtt', max_length=64)),
+                ('poster', models.CharField(default='poster.jpg', max_length=64)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='thumbnails', to='videos.video')),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0008_video_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['refcount', 'released_at'], name='blob_unreferenced_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='videos', to='videos.blob'),
+        ),
+        migrations.CreateModel(
+            name='Artifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_hash', models.CharField(max_length=64)),
+                ('operation', models.CharField(max_length=32)),
+                ('params_hash', models.CharField(max_length=64)),
+                ('params', models.JSONField(default=dict)),
+                ('sources', models.JSONField(default=list)),
+                ('result', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='artifacts', to='videos.blob')),
+            ],
+            options={
+                'unique_together': {('source_hash', 'operation', 'params_hash')},
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0009_blob_store'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=32)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('success', 'Success'), ('failure', 'Failure')], default='queued', max_length=16)),
+                ('params', models.JSONField(default=dict)),
+                ('output_name', models.CharField(max_length=255)),
+                ('message', models.CharField(blank=True, max_length=255)),
+                ('current', models.PositiveIntegerField(null=True)),
+                ('total', models.PositiveIntegerField(null=True)),
+                ('frame', models.PositiveIntegerField(null=True)),
+                ('total_frames', models.PositiveIntegerField(null=True)),
+                ('percent', models.FloatField(default=0)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('output', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='videos.video')),
+                ('sources', models.ManyToManyField(related_name='jobs', to='videos.video')),
+            ],
+        ),
+    ]
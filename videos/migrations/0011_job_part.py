@@ -0,0 +1,31 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0010_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('source', models.CharField(max_length=1024)),
+                ('start', models.FloatField()),
+                ('end', models.FloatField()),
+                ('path', models.CharField(max_length=1024)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done')], default='pending', max_length=16)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='videos.job')),
+            ],
+            options={
+                'ordering': ['index'],
+                'unique_together': {('job', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 20:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0011_job_part'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='bitrate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='encode_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.18 on 2026-10-18 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0012_job_encode_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='cost',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='priority',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='queue',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['queue', 'status', 'created_at'], name='job_queue_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0013_job_routing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='links_revoked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0014_video_links_revoked_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='outputs',
+            field=models.ManyToManyField(blank=True, related_name='+', to='videos.video'),
+        ),
+    ]
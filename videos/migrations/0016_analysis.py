@@ -0,0 +1,28 @@
+# Generated by Django 4.2.18 on 2026-10-18 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0015_job_outputs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Analysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('version', models.PositiveSmallIntegerField()),
+                ('duration', models.FloatField()),
+                ('events', models.BinaryField()),
+                ('analysis_time', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('content_hash', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 21:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0016_analysis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='upload_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.18 on 2026-10-18 21:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0017_chunkedupload_upload_id'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='video',
+            name='video_name_idx',
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['name'], name='video_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['blob', 'uploaded_at'], name='video_blob_uploaded_at_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 21:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0018_video_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='segment',
+            name='size',
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='video',
+            name='size',
+            field=models.PositiveBigIntegerField(),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 21:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0019_big_file_sizes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediainfo',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -1,15 +1,404 @@
-
-from django.db import models
+import hashlib
+from contextlib import nullcontext
+from django.db import connection, models, transaction
 import os
 from uuid import uuid4
 
+
+def row_lock():
+    """
+    The transaction to hold select_for_update() row locks in, where the
+    backend has them (PostgreSQL). SQLite has none: there, statements run
+    in autocommit instead, since a transaction that reads first and writes
+    later cannot wait for the write lock in WAL mode and fails at once with
+    "database is locked".
+    """
+    return transaction.atomic() if connection.features.has_select_for_update else nullcontext()
+
+
+class MediaInfo(models.Model):
+    """
+    Container-level metadata of a media file, cached by content hash and mtime
+    so a file is probed once no matter how many tasks read it.
+    """
+    content_hash = models.CharField(max_length=64)  # sampled; see probe.content_hash
+    mtime = models.FloatField()
+    sha256 = models.CharField(max_length=64, null=True, blank=True, db_index=True)  # of the whole file, if known
+    size = models.BigIntegerField()  # bytes
+    duration = models.FloatField(null=True)  # seconds
+    bitrate = models.PositiveIntegerField(null=True)  # bits per second
+    video_codec = models.CharField(max_length=32, null=True)
+    video_profile = models.CharField(max_length=32, null=True)
+    width = models.PositiveIntegerField(null=True)
+    height = models.PositiveIntegerField(null=True)
+    fps = models.FloatField(null=True)
+    timebase = models.PositiveIntegerField(null=True)
+    pix_fmt = models.CharField(max_length=32, null=True)
+    audio_codec = models.CharField(max_length=32, null=True)
+    audio_sample_rate = models.PositiveIntegerField(null=True)
+    audio_channels = models.PositiveSmallIntegerField(null=True)
+    keyframes = models.JSONField(default=list)  # seconds
+    probed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("content_hash", "mtime")
+
+    PROBE_FIELDS = (
+        "duration", "bitrate", "video_codec", "video_profile", "width", "height", "fps",
+        "timebase", "pix_fmt", "audio_codec", "audio_sample_rate", "audio_channels",
+    )
+
+    def to_dict(self):
+        """
+        Stream properties in the shape returned by ffmpeg.probe().
+        """
+        return {field: getattr(self, field) for field in self.PROBE_FIELDS}
+
+    def content_key(self):
+        """
+        Key of the file's exact content, for results derived from it: its
+        SHA-256 where known, else its sampled hash with its mtime.
+        """
+        if self.sha256:
+            return self.sha256
+        return hashlib.sha256(f"{self.content_hash}:{self.mtime!r}".encode()).hexdigest()
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.width}x{self.height}, {self.duration}s)"
+
+
+class Analysis(models.Model):
+    """
+    Scene cuts, black frames and silence of a media file (see
+    videos/analysis.py), cached by content so a file is analyzed once for
+    each version of the detection.
+    """
+    content_hash = models.CharField(max_length=64)  # MediaInfo.content_key()
+    version = models.PositiveSmallIntegerField()
+    duration = models.FloatField()  # seconds
+    events = models.BinaryField()  # analysis.EVENT_DTYPE records by start time
+    analysis_time = models.FloatField()  # seconds
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("content_hash", "version")
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} analysis v{self.version}"
+
+
+class Blob(models.Model):
+    """
+    A file in the content-addressed store, named by the SHA-256 of its bytes.
+    ``refcount`` counts the Video and Artifact rows using it (kept up to date
+    by signals); blobs unreferenced for a while are removed by
+    blobs.collect_garbage().
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255)  # storage name (see storage.get_storage)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    released_at = models.DateTimeField(null=True, blank=True)  # when refcount last dropped to zero
+
+    class Meta:
+        indexes = [models.Index(fields=["refcount", "released_at"], name="blob_unreferenced_idx")]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.refcount} refs)"
+
+
+class Artifact(models.Model):
+    """
+    An output derived from stored blobs, keyed by (source hash, operation,
+    parameters), so the same request is answered from the stored result.
+    ``source_hash`` is the source blob's SHA-256, or for several sources the
+    SHA-256 of their hashes in order.
+    """
+    source_hash = models.CharField(max_length=64)
+    operation = models.CharField(max_length=32)
+    params_hash = models.CharField(max_length=64)
+    params = models.JSONField(default=dict)
+    sources = models.JSONField(default=list)  # SHA-256 of every source blob
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="artifacts")
+    result = models.JSONField(default=dict)  # task result when the artifact was made
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("source_hash", "operation", "params_hash")
+
+    def __str__(self):
+        return f"{self.operation} of {self.source_hash[:12]}"
+
+
 class Video(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     file = models.FileField(upload_to="videos/uploads/") # we can change it as per our needs
     name = models.CharField(max_length=255)
     duration = models.PositiveIntegerField()  # seconds
-    size = models.PositiveIntegerField()  # bytes
+    size = models.PositiveBigIntegerField()  # bytes
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    media_info = models.ForeignKey(MediaInfo, null=True, blank=True, on_delete=models.SET_NULL, related_name="videos")
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name="videos")
+    # Links issued up to this time no longer work; see links.py.
+    links_revoked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the listing
+            models.Index(fields=["uploaded_at", "id"], name="video_uploaded_at_id_idx"),
+            # Name prefix filter; on PostgreSQL, LIKE 'prefix%' only uses a
+            # pattern_ops index (other backends ignore opclasses).
+            models.Index(fields=["name"], name="video_name_idx", opclasses=["varchar_pattern_ops"]),
+            # The oldest Video of a stored output (jobs.save_outputs)
+            models.Index(fields=["blob", "uploaded_at"], name="video_blob_uploaded_at_idx"),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ChunkedUpload(models.Model):
+    """
+    State of a chunked upload. Chunks are the parts of one storage multipart
+    upload and are tracked in a bitmap, so they may arrive in any order and
+    in parallel.
+    """
+    UPLOADING = "uploading"
+    ASSEMBLING = "assembling"
+    COMPLETE = "complete"
+    STATUS_CHOICES = [(UPLOADING, "Uploading"), (ASSEMBLING, "Assembling"), (COMPLETE, "Complete")]
+
+    file_id = models.CharField(max_length=255, primary_key=True)
+    file_name = models.CharField(max_length=255)
+    total_chunks = models.PositiveIntegerField()
+    chunk_size = models.PositiveBigIntegerField()  # bytes, every chunk but the last
+    total_size = models.PositiveBigIntegerField(null=True)  # bytes, if the client sent it
+    upload_id = models.CharField(max_length=255, blank=True, default="")  # storage multipart upload
+    received = models.BinaryField()  # bit i set once chunk i + 1 is written
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=UPLOADING)
+    version = models.PositiveIntegerField(default=0)  # bumped on every bitmap update
+    video = models.ForeignKey(Video, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def save(self, *args, **kwargs):
+        if not self.received:
+            self.received = bytes((self.total_chunks + 7) // 8)
+        super().save(*args, **kwargs)
+
+    def has_chunk(self, chunk_number):
+        index = chunk_number - 1
+        return bool(self.received[index // 8] & (1 << (index % 8)))
+
+    def mark_received(self, chunk_number):
+        index = chunk_number - 1
+        bitmap = bytearray(self.received)
+        bitmap[index // 8] |= 1 << (index % 8)
+        self.received = bytes(bitmap)
+
+    def record_chunks(self, chunk_numbers):
+        """
+        Set the bits for chunk_numbers and return the refreshed upload. The
+        write is a compare-and-swap on ``version``, so concurrent requests
+        never lose each other's bits, on any database backend; where rows
+        can be locked (see row_lock), they queue instead of retrying.
+        """
+        while True:
+            with row_lock():
+                current = ChunkedUpload.objects.select_for_update().get(pk=self.pk)
+                for chunk_number in chunk_numbers:
+                    current.mark_received(chunk_number)
+                updated = ChunkedUpload.objects.filter(pk=self.pk, version=current.version).update(
+                    received=current.received, version=current.version + 1,
+                )
+            if updated:
+                current.version += 1
+                return current
+
+    def claim_completion(self):
+        """
+        Move a fully received upload to ASSEMBLING. Only one caller wins.
+        The bitmap is read again (from the locked row, see row_lock), so
+        the check sees every chunk recorded before it.
+        """
+        with row_lock():
+            current = ChunkedUpload.objects.select_for_update().get(pk=self.pk)
+            if current.missing_chunks():
+                return False
+            claimed = ChunkedUpload.objects.filter(pk=self.pk, status=self.UPLOADING).update(status=self.ASSEMBLING)
+        if claimed:
+            self.status = self.ASSEMBLING
+        return bool(claimed)
+
+    def missing_chunks(self):
+        return [number for number in range(1, self.total_chunks + 1) if not self.has_chunk(number)]
+
+    def received_count(self):
+        return self.total_chunks - len(self.missing_chunks())
+
+    def __str__(self):
+        return f"{self.file_name} ({self.file_id})"
+
+
+class VideoPackage(models.Model):
+    """
+    Adaptive-bitrate packaging of a Video: one fMP4 segment set per rendition,
+    described by an HLS master playlist and a DASH manifest.
+    """
+    PENDING = "pending"
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (PROCESSING, "Processing"), (READY, "Ready"), (FAILED, "Failed")]
+
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name="package")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    directory = models.CharField(max_length=255)  # relative to MEDIA_ROOT
+    hls_playlist = models.CharField(max_length=64, default="master.m3u8")
+    dash_manifest = models.CharField(max_length=64, default="manifest.mpd")
+    segment_duration = models.FloatField()  # seconds
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.video} ({self.status})"
+
+
+class Rendition(models.Model):
+    VIDEO = "video"
+    AUDIO = "audio"
+    KIND_CHOICES = [(VIDEO, "Video"), (AUDIO, "Audio")]
+
+    package = models.ForeignKey(VideoPackage, on_delete=models.CASCADE, related_name="renditions")
+    name = models.CharField(max_length=32)
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    width = models.PositiveIntegerField(null=True)
+    height = models.PositiveIntegerField(null=True)
+    bitrate = models.PositiveIntegerField()  # target bits per second
+    playlist = models.CharField(max_length=64)  # relative to the package directory
+    init_segment = models.CharField(max_length=64)
+
+    class Meta:
+        ordering = ["kind", "-bitrate"]
+
+    def __str__(self):
+        return f"{self.package.video} {self.name}"
+
+
+class Segment(models.Model):
+    rendition = models.ForeignKey(Rendition, on_delete=models.CASCADE, related_name="segments")
+    sequence = models.PositiveIntegerField()
+    uri = models.CharField(max_length=64)  # relative to the package directory
+    start_time = models.FloatField()  # seconds
+    duration = models.FloatField()  # seconds
+    size = models.PositiveBigIntegerField()  # bytes
+
+    class Meta:
+        ordering = ["rendition", "sequence"]
+        unique_together = ("rendition", "sequence")
+
+
+class ThumbnailSet(models.Model):
+    """
+    Poster frame and seek-preview sprite sheets of a Video. Thumbnail i
+    covers [i * interval, (i + 1) * interval) and sits at tile i % (columns *
+    rows) of sheet i // (columns * rows); the WebVTT track lists the same.
+    """
+    PENDING = "pending"
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (PROCESSING, "Processing"), (READY, "Ready"), (FAILED, "Failed")]
+
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name="thumbnails")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    directory = models.CharField(max_length=255)  # relative to MEDIA_ROOT
+    interval = models.FloatField()  # seconds
+    tile_width = models.PositiveIntegerField(null=True)
+    tile_height = models.PositiveIntegerField(null=True)
+    columns = models.PositiveIntegerField()
+    rows = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    sprite_count = models.PositiveIntegerField(default=0)
+    vtt = models.CharField(max_length=64, default="thumbnails.vtt")
+    poster = models.CharField(max_length=64, default="poster.jpg")
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.video} thumbnails ({self.status})"
+
+
+class Job(models.Model):
+    """
+    A trim or merge request and the Celery task running it (the id is the
+    task id). Progress reported through update_state is mirrored here;
+    ``version`` goes up on every change so clients can wait for the next one.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCESS = "success"
+    FAILURE = "failure"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (SUCCESS, "Success"), (FAILURE, "Failure")]
+    FINISHED = (SUCCESS, FAILURE)
+
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    kind = models.CharField(max_length=32)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    params = models.JSONField(default=dict)
+    sources = models.ManyToManyField(Video, related_name="jobs")
+    output_name = models.CharField(max_length=255)  # name of the Video made from the output
+    output = models.ForeignKey(Video, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    outputs = models.ManyToManyField(Video, blank=True, related_name="+")  # of a batch job
+    message = models.CharField(max_length=255, blank=True)
+    current = models.PositiveIntegerField(null=True)
+    total = models.PositiveIntegerField(null=True)
+    frame = models.PositiveIntegerField(null=True)
+    total_frames = models.PositiveIntegerField(null=True)
+    percent = models.FloatField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    encode_time = models.FloatField(null=True, blank=True)  # wall seconds
+    bitrate = models.PositiveIntegerField(null=True, blank=True)  # of the output, bits/s
+    queue = models.CharField(max_length=64, blank=True)  # Celery queue it was sent to
+    priority = models.PositiveSmallIntegerField(null=True, blank=True)
+    cost = models.FloatField(null=True, blank=True)  # estimated, in megapixel-frames; see routing
+    version = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["queue", "status", "created_at"], name="job_queue_status_idx")]
+
+    def __str__(self):
+        return f"{self.kind} {self.id} ({self.status})"
+
+
+class JobPart(models.Model):
+    """
+    One segment of a job split across workers: a time range of a source
+    file, encoded to ``path``. Parts that are done are skipped when the
+    job is run again.
+    """
+    PENDING = "pending"
+    DONE = "done"
+    STATUS_CHOICES = [(PENDING, "Pending"), (DONE, "Done")]
+
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name="parts")
+    index = models.PositiveIntegerField()
+    source = models.CharField(max_length=1024)
+    start = models.FloatField()
+    end = models.FloatField()
+    path = models.CharField(max_length=1024)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+
+    class Meta:
+        unique_together = ("job", "index")
+        ordering = ["index"]
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f"{self.job_id} part {self.index} ({self.status})"
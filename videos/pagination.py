@@ -0,0 +1,50 @@
+import base64
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(video):
+    """
+    Opaque cursor pointing just past ``video`` in (uploaded_at, id) order.
+    """
+    raw = json.dumps([video.uploaded_at.isoformat(), str(video.id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        uploaded_at, video_id = json.loads(raw)
+        uploaded_at = parse_datetime(uploaded_at)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor.")
+    if uploaded_at is None:
+        raise InvalidCursor("Invalid cursor.")
+    return uploaded_at, video_id
+
+
+def keyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=False):
+    """
+    Return (rows, next_cursor) for one page of queryset ordered by
+    (uploaded_at, id). Each page is an index range scan: no OFFSET, no COUNT.
+    """
+    if cursor:
+        uploaded_at, video_id = decode_cursor(cursor)
+        if descending:
+            after = Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=video_id)
+        else:
+            after = Q(uploaded_at__gt=uploaded_at) | Q(uploaded_at=uploaded_at, id__gt=video_id)
+        queryset = queryset.filter(after)
+
+    ordering = ("-uploaded_at", "-id") if descending else ("uploaded_at", "id")
+    rows = list(queryset.order_by(*ordering)[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
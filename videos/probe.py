@@ -0,0 +1,257 @@
+import bisect
+import hashlib
+import os
+import struct
+from . import ffmpeg
+from .metrics import span
+
+# Bytes read from each end of a file for its content hash.
+HASH_SAMPLE_SIZE = 1024 * 1024
+
+
+def content_hash(file_path):
+    """
+    SHA-256 of the file size plus its first and last megabyte. Media files
+    differ within their headers and trailers, so this identifies content
+    without reading gigabytes on every lookup.
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(HASH_SAMPLE_SIZE))
+        if size > HASH_SAMPLE_SIZE:
+            f.seek(max(size - HASH_SAMPLE_SIZE, HASH_SAMPLE_SIZE))
+            digest.update(f.read(HASH_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+@span("probe")
+def get_media_info(file_path, sha256=None):
+    """
+    Return the MediaInfo row for a file, probing it only if neither this
+    exact file (content hash and mtime) nor, when the caller knows the
+    file's full ``sha256`` (as a blob's), a copy of it was probed before.
+    The sampled content hash alone does not identify a file: files of the
+    same size may share their first and last megabyte.
+    """
+    from .models import MediaInfo
+
+    stat = os.stat(file_path)
+    file_hash = content_hash(file_path)
+    cached = MediaInfo.objects.filter(content_hash=file_hash, mtime=stat.st_mtime).first()
+    if cached:
+        if sha256 and not cached.sha256:
+            MediaInfo.objects.filter(pk=cached.pk).update(sha256=sha256)
+            cached.sha256 = sha256
+        return cached
+
+    # Same bytes under a new mtime (e.g. a blob fetched to another node):
+    # reuse the metadata instead of probing again.
+    same_content = MediaInfo.objects.filter(sha256=sha256).first() if sha256 else None
+    if same_content:
+        fields = same_content.to_dict()
+        fields["keyframes"] = same_content.keyframes
+    else:
+        fields = ffmpeg.probe(file_path)
+        fields["keyframes"] = mp4_keyframe_times(file_path)
+        if fields["keyframes"] is None:
+            fields["keyframes"] = ffmpeg.keyframe_times(file_path) if fields["video_codec"] else []
+
+    info, _ = MediaInfo.objects.get_or_create(
+        content_hash=file_hash, mtime=stat.st_mtime,
+        defaults=dict(fields, size=stat.st_size, sha256=sha256),
+    )
+    return info
+
+
+# Leading bytes of the containers ffmpeg is expected to read: (offset, magic).
+CONTAINER_SIGNATURES = (
+    (4, b"ftyp"),  # MP4, MOV, 3GP
+    (4, b"moov"),  # QuickTime without ftyp
+    (4, b"mdat"),
+    (4, b"wide"),
+    (4, b"free"),
+    (0, b"\x1a\x45\xdf\xa3"),  # Matroska, WebM
+    (0, b"RIFF"),  # AVI
+    (0, b"FLV"),
+    (0, b"OggS"),
+    (0, b"\x00\x00\x01\xba"),  # MPEG program stream
+    (0, b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"),  # ASF, WMV
+)
+
+
+def sniff_container(header):
+    """
+    Whether the first bytes of a file look like a video container.
+    """
+    if any(header[offset:offset + len(magic)] == magic for offset, magic in CONTAINER_SIGNATURES):
+        return True
+    # MPEG transport stream: a sync byte every 188 bytes.
+    return len(header) > 188 and header[0] == header[188] == 0x47
+
+
+def mp4_header_duration(header):
+    """
+    Movie duration in seconds from the mvhd box, if the first bytes of an MP4
+    already contain it (files written with ``+faststart``). Returns None
+    otherwise.
+    """
+    for box_type, start, end in _boxes(header):
+        if box_type != b"moov":
+            continue
+        mvhd = _child(header, start, end, b"mvhd")
+        if mvhd is None or mvhd[1] - mvhd[0] < 32:
+            return None
+        timescale = _timescale(header, mvhd)
+        if header[mvhd[0]] == 1:
+            duration = struct.unpack_from(">Q", header, mvhd[0] + 24)[0]
+        else:
+            duration = struct.unpack_from(">I", header, mvhd[0] + 16)[0]
+        return duration / timescale if timescale else None
+    return None
+
+
+def _boxes(data, start=0, end=None):
+    """
+    Yield (type, payload_start, payload_end) for the ISO-BMFF boxes in data.
+    """
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _child(data, start, end, *path):
+    for box_type, payload_start, payload_end in _boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, payload_end
+            return _child(data, payload_start, payload_end, *path[1:])
+    return None
+
+
+def _read_moov(f):
+    """
+    Return the moov box payload of an MP4/MOV file, skipping over mdat.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, box_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            return None
+        if box_type == b"moov":
+            f.seek(offset + header_size)
+            return f.read(size - header_size)
+        offset += size
+    return None
+
+
+def _run_lookup(runs):
+    """
+    Turn (count, value) runs into a function mapping a 0-based sample index
+    to (value, sum of values before it).
+    """
+    starts, totals, values = [], [], []
+    sample, total = 0, 0
+    for count, value in runs:
+        starts.append(sample)
+        totals.append(total)
+        values.append(value)
+        sample += count
+        total += count * value
+
+    def lookup(index):
+        run = bisect.bisect_right(starts, index) - 1
+        if run < 0:
+            return 0, 0
+        return values[run], totals[run] + (index - starts[run]) * values[run]
+    return lookup
+
+
+def _timescale(data, box):
+    """
+    Timescale field of an mvhd or mdhd box.
+    """
+    start, _ = box
+    return struct.unpack_from(">I", data, start + (20 if data[start] == 1 else 12))[0]
+
+
+def _table(data, box, entry_format):
+    start, _ = box
+    count = struct.unpack_from(">I", data, start + 4)[0]
+    size = struct.calcsize(entry_format)
+    return [struct.unpack_from(entry_format, data, start + 8 + i * size) for i in range(count)]
+
+
+def mp4_keyframe_times(file_path):
+    """
+    Keyframe presentation times of the first video track, read from the MP4
+    sample tables (stss, stts, ctts, elst) without touching media data.
+    Returns None for files that are not MP4/MOV.
+    """
+    with open(file_path, "rb") as f:
+        moov = _read_moov(f)
+    if moov is None:
+        return None
+
+    for box_type, start, end in _boxes(moov):
+        if box_type != b"trak":
+            continue
+        hdlr = _child(moov, start, end, b"mdia", b"hdlr")
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+
+        timescale = _timescale(moov, _child(moov, start, end, b"mdia", b"mdhd"))
+
+        stbl = _child(moov, start, end, b"mdia", b"minf", b"stbl")
+        stts = _child(moov, stbl[0], stbl[1], b"stts")
+        ctts = _child(moov, stbl[0], stbl[1], b"ctts")
+        stss = _child(moov, stbl[0], stbl[1], b"stss")
+        elst = _child(moov, start, end, b"edts", b"elst")
+
+        durations = _run_lookup(_table(moov, stts, ">II"))
+        offsets = _run_lookup(_table(moov, ctts, ">Ii") if ctts else [])
+        if stss:
+            samples = [number - 1 for (number,) in _table(moov, stss, ">I")]
+        else:
+            total = sum(count for count, _ in _table(moov, stts, ">II"))
+            samples = range(total)
+
+        # The edit list may delay the track (empty edits, in movie time) and
+        # skip its first media samples (in track time).
+        delay, shift = 0.0, 0
+        if elst:
+            entry_format = ">Qq" if moov[elst[0]] == 1 else ">Ii"
+            for segment_duration, media_time, _ in _table(moov, elst, entry_format + "I"):
+                if media_time != -1:
+                    shift = media_time
+                    break
+                delay += segment_duration / _timescale(moov, _child(moov, 0, len(moov), b"mvhd"))
+
+        times = []
+        for index in samples:
+            _, dts = durations(index)
+            offset, _ = offsets(index)
+            times.append(round(delay + max(dts + offset - shift, 0) / timescale, 6))
+        return sorted(times)
+    return []
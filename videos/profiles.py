@@ -0,0 +1,27 @@
+import os
+from django.conf import settings
+
+
+def profile_names():
+    return tuple(settings.VIDEO_ENCODING_PROFILES)
+
+
+def get_profile(name=None):
+    """
+    The encoding profile called ``name`` (default
+    settings.VIDEO_DEFAULT_ENCODING_PROFILE), with its name under "name".
+    Raises ValueError for an unknown name.
+    """
+    name = name or settings.VIDEO_DEFAULT_ENCODING_PROFILE
+    try:
+        return dict(settings.VIDEO_ENCODING_PROFILES[name], name=name)
+    except KeyError:
+        raise ValueError(f"Unknown encoding profile: {name}.")
+
+
+def work_dir(profile, output_path):
+    """
+    Directory for a task's intermediate files: the profile's ``temp_dir``,
+    or the output's directory.
+    """
+    return profile.get("temp_dir") or os.path.dirname(output_path) or None
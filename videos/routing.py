@@ -0,0 +1,161 @@
+"""
+Which Celery queue a job goes to, and at what priority, from an estimate of
+its cost made with the probe metadata of its sources.
+
+The cost of a job is in megapixel-frames: width x height x frames of the
+video it decodes and encodes, in millions. Copying packets (remuxing)
+costs a small fraction of encoding the same video. Jobs costing at least
+settings.VIDEO_HEAVY_JOB_COST go to the heavy queue, the others to the
+light queue. Within a queue, cheaper jobs get a more urgent priority, in
+the configured broker's scheme (see broker_priority).
+"""
+import math
+import statistics
+from datetime import timedelta
+from celery import current_app
+from django.conf import settings
+from django.utils.timezone import now
+from kombu import Connection
+from .models import Job
+
+LIGHT = "light"
+HEAVY = "heavy"
+BACKGROUND = "background"
+QUEUES = (LIGHT, HEAVY, BACKGROUND)
+
+# Priorities as the Redis transport orders them: 0 is served first. AMQP
+# brokers (RabbitMQ) serve the highest first; see broker_priority().
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 5
+# Cost of remuxing a second of video, relative to encoding it.
+REMUX_COST_FACTOR = 0.02
+# Seconds re-encoded at the edges of an accurate trim (about two GOPs).
+ACCURATE_EDGE_SECONDS = 4.0
+# Layout assumed for sources that were never probed.
+DEFAULT_LAYOUT = {"width": 1280, "height": 720, "fps": 30}
+
+
+def _megapixel_frames(info, seconds):
+    layout = {key: (info or {}).get(key) or DEFAULT_LAYOUT[key] for key in DEFAULT_LAYOUT}
+    return layout["width"] * layout["height"] * layout["fps"] * max(seconds, 0) / 1e6
+
+
+def job_cost(pieces):
+    """
+    The cost of a job made of (media info dict, seconds, encoded) pieces.
+    """
+    return sum(
+        _megapixel_frames(info, seconds) * (1 if encoded else REMUX_COST_FACTOR)
+        for info, seconds, encoded in pieces
+    )
+
+
+def trim_cost(info, start_time, end_time, mode):
+    seconds = end_time - start_time
+    if mode == "keyframe":
+        return job_cost([(info, seconds, False)])
+    if mode == "accurate":
+        edges = min(seconds, ACCURATE_EDGE_SECONDS)
+        return job_cost([(info, edges, True), (info, seconds - edges, False)])
+    return job_cost([(info, seconds, True)])
+
+
+def merge_cost(infos, encode_all=False):
+    """
+    The cost of merging sources with these media info dicts: the ones that
+    do not match the merge target are encoded (all of them with
+    ``encode_all``), the others remuxed.
+    """
+    from . import ffmpeg
+    from .tasks import _merge_target
+
+    target = ffmpeg.stream_signature(_merge_target(infos)) if infos else None
+    return job_cost([
+        (info, info.get("duration") or 0, encode_all or ffmpeg.stream_signature(info) != target)
+        for info in infos
+    ])
+
+
+def graph_cost(plan):
+    """
+    The cost of running a compiled transform graph: encoding each output
+    (see graph.plan).
+    """
+    return job_cost([(layout._asdict(), layout.duration, True) for layout in plan.layouts])
+
+
+def broker_priority(rank):
+    """
+    The priority to send a message of ``rank`` (0 is the most urgent, up to
+    MAX_PRIORITY) with on the configured broker: the rank itself on Redis
+    and other transports serving 0 first, reversed on AMQP.
+    """
+    driver = Connection(settings.CELERY_BROKER_URL).transport.driver_type
+    return MAX_PRIORITY - rank if driver == "amqp" else rank
+
+
+def route(cost):
+    """
+    Celery options (queue and priority) of a job costing ``cost``; a cost
+    of None (unknown) goes to the light queue at the default priority.
+    """
+    if cost is None:
+        return {"queue": LIGHT, "priority": broker_priority(DEFAULT_PRIORITY)}
+    threshold = settings.VIDEO_HEAVY_JOB_COST
+    # A job at the threshold gets rank 6, one four times over it 8.
+    rank = min(MAX_PRIORITY, int(math.log2(1 + 64 * cost / threshold)))
+    return {"queue": HEAVY if cost >= threshold else LIGHT, "priority": broker_priority(rank)}
+
+
+def broker_depth(queue):
+    """
+    Messages waiting in a queue on the broker, or None if the broker can't
+    be reached.
+    """
+    try:
+        with current_app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=0)
+            return connection.default_channel.queue_declare(queue=queue, passive=True).message_count
+    except Exception:
+        return None
+
+
+def queue_stats(window=None):
+    """
+    Per queue: jobs queued and running, messages on the broker, how long the
+    oldest queued job has waited, and the wait (sent to started, in seconds)
+    of the jobs started in the last ``window`` seconds.
+    """
+    window = window or settings.VIDEO_QUEUE_STATS_WINDOW
+    current = now()
+    stats = []
+    for queue in QUEUES:
+        jobs = Job.objects.filter(queue=queue)
+        oldest = jobs.filter(status=Job.QUEUED).order_by("created_at").values_list("created_at", flat=True).first()
+        waits = sorted(
+            (started_at - created_at).total_seconds()
+            for created_at, started_at in jobs.filter(
+                started_at__gte=current - timedelta(seconds=window),
+            ).values_list("created_at", "started_at")
+        )
+        stats.append({
+            "name": queue,
+            "queued": jobs.filter(status=Job.QUEUED).count(),
+            "running": jobs.filter(status=Job.RUNNING).count(),
+            "broker_depth": broker_depth(queue),
+            "oldest_wait": (current - oldest).total_seconds() if oldest else None,
+            "wait": {
+                "samples": len(waits),
+                "mean": statistics.mean(waits) if waits else None,
+                "p50": _percentile(waits, 0.5),
+                "p95": _percentile(waits, 0.95),
+                "max": waits[-1] if waits else None,
+            },
+        })
+    return stats
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
@@ -1,7 +1,40 @@
 from rest_framework import serializers
-from .models import Video
+from .models import Job, MediaInfo, Video
+
+
+class MediaInfoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MediaInfo
+        fields = [
+            "duration", "bitrate", "video_codec", "video_profile", "width", "height", "fps",
+            "pix_fmt", "audio_codec", "audio_sample_rate", "audio_channels",
+        ]
+
 
 class VideoSerializer(serializers.ModelSerializer):
+    media_info = MediaInfoSerializer(read_only=True)
+
     class Meta:
         model = Video
-        fields = ["id", "name", "duration", "size", "file", "uploaded_at"]
+        fields = ["id", "name", "duration", "size", "file", "uploaded_at", "media_info"]
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    task_id = serializers.UUIDField(source="id", read_only=True)
+    sources = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    output = VideoSerializer(read_only=True)
+    outputs = VideoSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Job
+        fields = [
+            "task_id", "kind", "status", "params", "sources", "queue", "priority", "cost", "message", "current",
+            "total", "frame", "total_frames", "percent", "result", "error", "encode_time", "bitrate", "output",
+            "outputs", "version", "created_at", "started_at", "finished_at",
+        ]
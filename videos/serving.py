@@ -0,0 +1,280 @@
+import asyncio
+import mimetypes
+import os
+import re
+from uuid import uuid4
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from . import metrics
+from .storage import get_storage, read_range
+
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("application/dash+xml", ".mpd")
+mimetypes.add_type("video/iso.segment", ".m4s")
+
+STREAM_BLOCK_SIZE = 64 * 1024
+# Requests asking for more ranges than this get the whole file instead.
+MAX_RANGES = 16
+
+RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    Parse a ``Range: bytes=...`` header into sorted, merged (start, end)
+    pairs with inclusive ends. Returns None if the header should be ignored
+    and an empty list if no range is satisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        match = RANGE_RE.match(part)
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if not first:
+            # Suffix range: the last N bytes.
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        # Weak comparison, as RFC 9110 requires for If-None-Match.
+        etags = [tag[2:] if tag.startswith("W/") else tag for tag in parse_etags(if_none_match)]
+        return "*" in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(mtime) <= date
+
+
+async def aread_range(path, start, end, block_size=STREAM_BLOCK_SIZE):
+    """
+    read_range for async responses. Each read runs in a worker thread, and
+    the next block is only read once the server has sent the previous one,
+    so a slow client holds one block in memory and no thread.
+    """
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await asyncio.to_thread(f.read, min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+async def aiterate(iterator):
+    """
+    Iterate a blocking iterator from async code, each step in a worker
+    thread, such as a ranged read from a storage service.
+    """
+    done = object()
+    while True:
+        data = await asyncio.to_thread(next, iterator, done)
+        if data is done:
+            break
+        yield data
+
+
+def multipart_parts(ranges, size, content_type, boundary):
+    """
+    Header bytes for each part of a multipart/byteranges body, plus the
+    closing delimiter, and the total body length.
+    """
+    headers = [
+        (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        for start, end in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    length = sum(len(h) for h in headers) + sum(end - start + 1 for start, end in ranges) + len(closing)
+    return headers, closing, length
+
+
+def _multipart_body(reader, path, ranges, headers, closing):
+    for header, (start, end) in zip(headers, ranges):
+        yield header
+        yield from reader(path, start, end)
+    yield closing
+
+
+async def _amultipart_body(reader, path, ranges, headers, closing):
+    for header, (start, end) in zip(headers, ranges):
+        yield header
+        async for data in reader(path, start, end):
+            yield data
+    yield closing
+
+
+def serve_file(request, path, name, url_path=None, stat=None, asynchronous=False, storage=None):
+    """
+    Build the response for a GET/HEAD of a local media file, with ETag and
+    Last-Modified validators, single and multi-range 206 responses, and
+    optional hand-off of the transfer to the front-end server
+    (settings.VIDEO_SERVE_ACCEL: "x-accel-redirect" or "x-sendfile").
+    ``url_path`` is the file's path relative to MEDIA_ROOT. Bytes sent by
+    Python are counted in video_bytes_out_total. With ``asynchronous`` the
+    body is an async iterator, for async views (see aserve_file). With a
+    non-local ``storage``, ``path`` is a stored file's name and its bytes
+    are streamed from ranged reads of the storage service.
+    """
+    remote = storage is not None and not storage.local
+    if stat is None:
+        with metrics.span("file_open"):
+            stat = storage.stat(path) if remote else os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    disposition = f'inline; filename="{os.path.basename(name)}"'
+
+    # There is no local file for the front-end server to send.
+    accel = None if remote else getattr(settings, "VIDEO_SERVE_ACCEL", None)
+    if accel == "x-accel-redirect" and url_path:
+        # nginx serves the bytes, including ranges and conditional requests.
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, "VIDEO_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+        response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + url_path.lstrip("/")
+        response["Content-Disposition"] = disposition
+        return response
+    if accel == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = os.path.abspath(path)
+        response["Content-Disposition"] = disposition
+        return response
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(stat.st_mtime)
+        return response
+
+    ranges = None
+    range_header = request.META.get("HTTP_RANGE")
+    if range_header and _if_range_matches(request, etag, stat.st_mtime):
+        ranges = parse_range(range_header, size)
+
+    if remote:
+        def reader(path, start, end):
+            blocks = storage.read_range(path, start, end, STREAM_BLOCK_SIZE)
+            return aiterate(blocks) if asynchronous else blocks
+    elif asynchronous:
+        reader = aread_range
+    else:
+        def reader(path, start, end):
+            return read_range(path, start, end, STREAM_BLOCK_SIZE)
+    if ranges is None and (asynchronous or remote):
+        response = StreamingHttpResponse(reader(path, 0, size - 1), content_type=content_type)
+        response["Content-Length"] = str(size)
+    elif ranges is None:
+        # Whole file: FileResponse lets the server use wsgi.file_wrapper.
+        with metrics.span("file_open"):
+            file = open(path, "rb")
+        response = FileResponse(file, content_type=content_type)
+        response["Content-Length"] = str(size)
+    elif not ranges:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(reader(path, start, end), status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+    else:
+        boundary = uuid4().hex
+        headers, closing, length = multipart_parts(ranges, size, content_type, boundary)
+        body = _amultipart_body if asynchronous else _multipart_body
+        response = StreamingHttpResponse(
+            body(reader, path, ranges, headers, closing),
+            status=206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+        )
+        response["Content-Length"] = str(length)
+
+    if response.status_code != 416:
+        metrics.inc("video_bytes_out_total", (metrics.current_operation(),), int(response["Content-Length"]))
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Content-Disposition"] = disposition
+    return response
+
+
+async def aserve_file(request, path, name, url_path=None):
+    """
+    serve_file for async views: the file is stat'ed and read in worker
+    threads, so the event loop never waits on the disk.
+    """
+    with metrics.span("file_open"):
+        stat = await asyncio.to_thread(os.stat, path)
+    return serve_file(request, path, name, url_path, stat=stat, asynchronous=True)
+
+
+def serve_stored(request, name, display_name):
+    """
+    serve_file for the stored file ``name`` (see storage.get_storage).
+    """
+    storage = get_storage()
+    if storage.local:
+        return serve_file(request, storage.path(name), display_name, url_path=name)
+    return serve_file(request, name, display_name, storage=storage)
+
+
+async def aserve_stored(request, name, display_name):
+    """
+    aserve_file for the stored file ``name``.
+    """
+    storage = get_storage()
+    if storage.local:
+        return await aserve_file(request, storage.path(name), display_name, url_path=name)
+    with metrics.span("file_open"):
+        stat = await asyncio.to_thread(storage.stat, name)
+    return serve_file(request, name, display_name, stat=stat, asynchronous=True, storage=storage)
@@ -0,0 +1,62 @@
+from uuid import uuid4
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .blobs import acquire, release
+from .links import forget
+from .models import Artifact, MediaInfo, Video
+
+LIST_VERSION_KEY = "videos:list:version"
+
+
+def list_version():
+    """
+    Version of the video listing; replaced whenever a Video row changes, so
+    cached pages and ETags from before the change stop matching.
+    """
+    version = cache.get(LIST_VERSION_KEY)
+    if version is None:
+        cache.add(LIST_VERSION_KEY, uuid4().hex, timeout=None)
+        version = cache.get(LIST_VERSION_KEY)
+    return version
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+@receiver(post_save, sender=MediaInfo)
+def invalidate_video_list(sender, **kwargs):
+    cache.set(LIST_VERSION_KEY, uuid4().hex, timeout=None)
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Artifact)
+def acquire_blob(sender, instance, created, **kwargs):
+    if created and instance.blob_id:
+        acquire(instance.blob_id)
+
+
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Artifact)
+def release_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        release(instance.blob_id)
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def forget_link_state(sender, instance, **kwargs):
+    forget(instance.id)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Put SQLite in WAL mode, so readers never wait for the writer and the
+    writer only waits for other writers (up to the connection's timeout).
+    With WAL, syncing at each checkpoint rather than each commit is safe.
+    """
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
@@ -0,0 +1,510 @@
+"""
+Where stored files live: a directory (MEDIA_ROOT) or a bucket of an
+S3-compatible service, as set in settings.VIDEO_STORAGE. Files are named
+by their path under the root, such as a blob's name.
+
+Workers read stored files through fetch(), which returns a local path: the
+file itself with the local backend, otherwise a copy in a node-local cache
+(settings.VIDEO_STORAGE_CACHE_DIR) that evicts the least recently used
+files once it is larger than settings.VIDEO_STORAGE_CACHE_SIZE bytes,
+except those used in the last settings.VIDEO_STORAGE_CACHE_GRACE seconds.
+
+Chunked uploads are written as multipart uploads: the chunks of an upload
+are the parts, in any order. The local backend writes each at its offset
+in one part file; the S3 backend uploads each as a part.
+"""
+import datetime
+import hashlib
+import hmac
+import io
+import json
+import os
+import tempfile
+import time
+from collections import namedtuple
+from urllib.parse import quote
+from xml.etree import ElementTree
+import requests
+from django.conf import settings
+from django.utils.http import parse_http_date
+
+# The fields of os.stat_result that serving.serve_file uses.
+StoredFile = namedtuple("StoredFile", "name st_size st_mtime st_mtime_ns")
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def _stored_file(name, size, mtime):
+    return StoredFile(name, size, mtime, int(mtime * 1e9))
+
+
+def read_range(path, start, end, block_size=BLOCK_SIZE):
+    """
+    Yield the bytes of the local file ``path`` from start to end (inclusive).
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def evict(directory, max_size, keep=None, partial_suffix=None, grace=0):
+    """
+    Remove the least recently used (oldest mtime) files in ``directory``
+    until the rest take at most ``max_size`` bytes. ``keep``, files ending
+    in ``partial_suffix`` (being written) and files used within the last
+    ``grace`` seconds are never removed, so the directory stays over its
+    size until they age.
+    """
+    entries = []
+    total = 0
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            if partial_suffix and entry.name.endswith(partial_suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    cutoff = time.time() - grace
+    for mtime, size, path in sorted(entries):
+        if total <= max_size or mtime > cutoff:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class LocalStorage:
+    """
+    Files under MEDIA_ROOT.
+    """
+    local = True
+    min_part_size = 0
+    max_parts = None
+
+    def path(self, name):
+        return os.path.join(settings.MEDIA_ROOT, name)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def stat(self, name):
+        stat = os.stat(self.path(name))
+        return StoredFile(name, stat.st_size, stat.st_mtime, stat.st_mtime_ns)
+
+    def read_range(self, name, start, end, block_size=BLOCK_SIZE):
+        """
+        Yield the bytes of a file from start to end (inclusive).
+        """
+        return read_range(self.path(name), start, end, block_size)
+
+    def save(self, name, path):
+        """
+        Store the local file at ``path`` as ``name``, consuming it.
+        """
+        target = self.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def move(self, name, new_name):
+        self.save(new_name, self.path(name))
+
+    def delete(self, name):
+        """
+        Remove a file, returning its size, or None if there was none.
+        """
+        path = self.path(name)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return None
+        return size
+
+    def list(self, prefix):
+        """
+        The StoredFile of every file under the directory ``prefix``.
+        """
+        root = self.path(prefix)
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield StoredFile(os.path.relpath(path, settings.MEDIA_ROOT), stat.st_size, stat.st_mtime,
+                                 stat.st_mtime_ns)
+
+    def create_multipart(self, name):
+        """
+        Start a multipart upload to ``name``; returns its upload id.
+        """
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        return ""
+
+    def upload_part(self, name, upload_id, number, offset, data, size):
+        """
+        Write part ``number``: ``size`` bytes read from the file object
+        ``data``, which start ``offset`` bytes into the file.
+        """
+        fd = os.open(f"{self.path(name)}.part", os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            for block in iter(lambda: data.read(BLOCK_SIZE), b""):
+                os.pwrite(fd, block, offset)
+                offset += len(block)
+        finally:
+            os.close(fd)
+
+    def complete_multipart(self, name, upload_id, part_size, size=None):
+        """
+        Assemble the parts of an upload into ``name``: the chain of parts
+        from part 1, each ``part_size`` bytes or a multiple of it (a part
+        holding several chunks), up to ``size`` bytes if given.
+        """
+        part_path = f"{self.path(name)}.part"
+        if size is not None:
+            with open(part_path, "r+b") as part_file:
+                part_file.truncate(size)
+        os.replace(part_path, self.path(name))
+
+    def abort_multipart(self, name, upload_id):
+        try:
+            os.remove(f"{self.path(name)}.part")
+        except FileNotFoundError:
+            pass
+
+
+class S3Storage:
+    """
+    Objects in a bucket of an S3-compatible service, addressed path-style
+    (``<endpoint>/<bucket>/<prefix><name>``) with Signature Version 4.
+    Payloads are sent unsigned (UNSIGNED-PAYLOAD), so bodies are streamed;
+    use an https endpoint.
+    """
+    local = False
+    max_parts = 10000
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region="us-east-1", prefix="",
+                 part_size=32 * 1024 * 1024, min_part_size=5 * 1024 * 1024, max_copy_size=5 * 1024 ** 3,
+                 timeout=60):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        # Files larger than part_size are saved as multipart uploads; every
+        # part but the last must be at least min_part_size.
+        self.part_size = part_size
+        self.min_part_size = min_part_size
+        # Largest object (and part) a single server-side copy may copy.
+        self.max_copy_size = max_copy_size
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _sign(self, method, path, query, headers):
+        amz_date = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        headers.update({"x-amz-date": amz_date, "x-amz-content-sha256": "UNSIGNED-PAYLOAD"})
+        signed = {key.lower(): str(value).strip() for key, value in headers.items()}
+        signed["host"] = self.endpoint_url.split("://", 1)[-1]
+        names = ";".join(sorted(signed))
+        canonical = "\n".join([
+            method, path, query,
+            "".join(f"{key}:{signed[key]}\n" for key in sorted(signed)),
+            names, "UNSIGNED-PAYLOAD",
+        ])
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+        key = f"AWS4{self.secret_key}".encode()
+        for part in (amz_date[:8], self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+        headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, SignedHeaders={names}, Signature={signature}"
+        )
+
+    def _request(self, method, name=None, query=None, headers=None, data=None, stream=False, expected=(200,)):
+        path = quote(f"/{self.bucket}/" + (self.prefix + name if name is not None else ""), safe="/-_.~")
+        query = "&".join(
+            f"{quote(key, safe='-_.~')}={quote(str(value), safe='-_.~')}" for key, value in sorted((query or {}).items())
+        )
+        headers = dict(headers or {})
+        self._sign(method, path, query, headers)
+        response = self.session.request(
+            method, f"{self.endpoint_url}{path}" + (f"?{query}" if query else ""),
+            headers=headers, data=data, stream=stream, timeout=self.timeout,
+        )
+        if response.status_code == 404 and 404 not in expected:
+            response.close()
+            raise FileNotFoundError(f"{self.bucket}/{self.prefix}{name}")
+        if response.status_code not in expected:
+            response.close()
+            raise IOError(f"S3 {method} {self.prefix}{name}: {response.status_code} {response.text[:500]}")
+        return response
+
+    @staticmethod
+    def _xml(response):
+        """
+        The parsed body of a response, with namespaces stripped from tags.
+        """
+        root = ElementTree.fromstring(response.content)
+        for element in root.iter():
+            element.tag = element.tag.rpartition("}")[2]
+        if root.tag == "Error":
+            raise IOError(f"S3 error: {root.findtext('Code')} {root.findtext('Message')}")
+        return root
+
+    def exists(self, name):
+        return self._request("HEAD", name, expected=(200, 404)).status_code == 200
+
+    def stat(self, name):
+        response = self._request("HEAD", name)
+        return _stored_file(
+            name, int(response.headers["Content-Length"]), parse_http_date(response.headers["Last-Modified"]),
+        )
+
+    def read_range(self, name, start, end, block_size=BLOCK_SIZE):
+        """
+        Yield the bytes of an object from start to end (inclusive), read
+        with one ranged GET.
+        """
+        response = self._request("GET", name, headers={"Range": f"bytes={start}-{end}"}, stream=True,
+                                 expected=(200, 206))
+        try:
+            yield from response.iter_content(block_size)
+        finally:
+            response.close()
+
+    def download(self, name, path):
+        response = self._request("GET", name, stream=True)
+        try:
+            with open(path, "wb") as f:
+                for data in response.iter_content(BLOCK_SIZE):
+                    f.write(data)
+        finally:
+            response.close()
+
+    def save(self, name, path):
+        """
+        Upload the local file at ``path`` as ``name``, in parts if it is
+        larger than part_size, and move it into the node-local cache.
+        """
+        size = os.path.getsize(path)
+        if size <= self.part_size:
+            with open(path, "rb") as f:
+                self._request("PUT", name, headers={"Content-Length": str(size)}, data=f)
+        else:
+            upload_id = self.create_multipart(name)
+            try:
+                with open(path, "rb") as f:
+                    for number, offset in enumerate(range(0, size, self.part_size), 1):
+                        length = min(self.part_size, size - offset)
+                        self.upload_part(name, upload_id, number, offset, io.BytesIO(f.read(length)), length)
+                self.complete_multipart(name, upload_id, self.part_size, size)
+            except Exception:
+                self.abort_multipart(name, upload_id)
+                raise
+        cache().put(name, path)
+
+    def move(self, name, new_name):
+        """
+        Rename an object: a server-side copy, then a delete. Objects larger
+        than max_copy_size are copied as a multipart upload of ranges of
+        the source (UploadPartCopy).
+        """
+        source = quote(f"/{self.bucket}/{self.prefix}{name}")
+        size = self.stat(name).st_size
+        if size <= self.max_copy_size:
+            # Errors can come after a 200 status, in the body.
+            self._xml(self._request("PUT", new_name, headers={"x-amz-copy-source": source}))
+        else:
+            part_size = min(max(self.part_size, -(-size // self.max_parts)), self.max_copy_size)
+            upload_id = self.create_multipart(new_name)
+            try:
+                for number, offset in enumerate(range(0, size, part_size), 1):
+                    end = min(offset + part_size, size) - 1
+                    self._xml(self._request(
+                        "PUT", new_name, query={"partNumber": number, "uploadId": upload_id},
+                        headers={"x-amz-copy-source": source, "x-amz-copy-source-range": f"bytes={offset}-{end}"},
+                    ))
+                self.complete_multipart(new_name, upload_id, part_size, size)
+            except Exception:
+                self.abort_multipart(new_name, upload_id)
+                raise
+        self.delete(name)
+        cache().rename(name, new_name)
+
+    def delete(self, name):
+        try:
+            size = self.stat(name).st_size
+        except FileNotFoundError:
+            return None
+        self._request("DELETE", name, expected=(200, 204, 404))
+        cache().discard(name)
+        return size
+
+    def list(self, prefix):
+        query = {"list-type": "2", "prefix": self.prefix + prefix.rstrip("/") + "/"}
+        while True:
+            root = self._xml(self._request("GET", query=query))
+            for item in root.iter("Contents"):
+                modified = datetime.datetime.fromisoformat(item.findtext("LastModified").replace("Z", "+00:00"))
+                yield _stored_file(item.findtext("Key")[len(self.prefix):], int(item.findtext("Size")),
+                                   modified.timestamp())
+            if root.findtext("IsTruncated") != "true":
+                break
+            query["continuation-token"] = root.findtext("NextContinuationToken")
+
+    def create_multipart(self, name):
+        return self._xml(self._request("POST", name, query={"uploads": ""})).findtext("UploadId")
+
+    def upload_part(self, name, upload_id, number, offset, data, size):
+        response = self._request(
+            "PUT", name, query={"partNumber": number, "uploadId": upload_id},
+            headers={"Content-Length": str(size)}, data=data,
+        )
+        return response.headers.get("ETag")
+
+    def _parts(self, name, upload_id):
+        """
+        {part number: (size, ETag)} of the parts uploaded so far.
+        """
+        parts = {}
+        query = {"uploadId": upload_id}
+        while True:
+            root = self._xml(self._request("GET", name, query=query))
+            for part in root.iter("Part"):
+                parts[int(part.findtext("PartNumber"))] = (int(part.findtext("Size")), part.findtext("ETag"))
+            if root.findtext("IsTruncated") != "true":
+                return parts
+            query["part-number-marker"] = root.findtext("NextPartNumberMarker")
+
+    def complete_multipart(self, name, upload_id, part_size, size=None):
+        parts = self._parts(name, upload_id)
+        # A part holding several chunks covers the parts numbered after them.
+        chain = []
+        number = 1
+        while number in parts:
+            chain.append((number, parts[number][1]))
+            number += max(1, -(-parts[number][0] // part_size))
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in chain
+        ) + "</CompleteMultipartUpload>"
+        # Errors can come after a 200 status, in the body.
+        self._xml(self._request("POST", name, query={"uploadId": upload_id}, data=body.encode()))
+
+    def abort_multipart(self, name, upload_id):
+        self._request("DELETE", name, query={"uploadId": upload_id}, expected=(200, 204, 404))
+
+
+class FileCache:
+    """
+    Node-local copies of stored files, evicted least recently used first
+    once they take more than ``max_size`` bytes. Files fetched or hit in
+    the last ``grace`` seconds are kept: a worker on the node may have
+    fetched one and not opened it yet.
+    """
+
+    def __init__(self, directory, max_size, grace=0):
+        self.directory = directory
+        self.max_size = max_size
+        self.grace = grace
+
+    def path(self, name):
+        # Flat, and keeping the extension for ffmpeg.
+        return os.path.join(self.directory, hashlib.sha256(name.encode()).hexdigest() + os.path.splitext(name)[1])
+
+    def get(self, name, download):
+        """
+        The local path of ``name``, calling download(name, path) to fetch it
+        on a miss. Hits are touched, so eviction goes by last use.
+        """
+        path = self.path(name)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.directory, exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=self.directory, suffix=".partial")
+        os.close(fd)
+        try:
+            download(name, partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.evict(keep=path)
+        return path
+
+    def put(self, name, path):
+        """
+        Move a local file holding the content of ``name`` into the cache.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        os.replace(path, self.path(name))
+        self.evict(keep=self.path(name))
+
+    def rename(self, name, new_name):
+        try:
+            os.replace(self.path(name), self.path(new_name))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, keep=None):
+        evict(self.directory, self.max_size, keep, ".partial", self.grace)
+
+
+_backends = {}
+
+
+def get_storage():
+    """
+    The backend configured by settings.VIDEO_STORAGE.
+    """
+    config = settings.VIDEO_STORAGE
+    key = json.dumps(config, sort_keys=True)
+    if key not in _backends:
+        options = {name.lower(): value for name, value in config.items() if name != "BACKEND"}
+        if config["BACKEND"] == "s3":
+            _backends[key] = S3Storage(**options)
+        elif config["BACKEND"] == "local":
+            _backends[key] = LocalStorage()
+        else:
+            raise ValueError(f"Unknown storage backend {config['BACKEND']!r}")
+    return _backends[key]
+
+
+def cache():
+    directory = settings.VIDEO_STORAGE_CACHE_DIR or os.path.join(settings.MEDIA_ROOT, "storage-cache")
+    return FileCache(directory, settings.VIDEO_STORAGE_CACHE_SIZE, settings.VIDEO_STORAGE_CACHE_GRACE)
+
+
+def fetch(name):
+    """
+    A local path holding the stored file ``name``. Absolute paths are files
+    outside the store and are returned as they are.
+    """
+    storage = get_storage()
+    if os.path.isabs(name) or storage.local:
+        return os.path.join(settings.MEDIA_ROOT, name)
+    return cache().get(name, storage.download)
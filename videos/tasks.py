@@ -1,79 +1,755 @@
-from celery import shared_task, current_task
-import moviepy.editor as mp
+from celery import chord, shared_task, current_task
 import os
-import PIL.Image
+import bisect
+import resource
+import shutil
+import tempfile
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+from . import analysis, ffmpeg, graph
+from .models import Job, JobPart, Rendition, Segment, ThumbnailSet, Video, VideoPackage
+from .blobs import collect_garbage, record_artifact
+from .jobs import FrameProgress, JobTask, record_progress
+from .metrics import span
+from .probe import get_media_info
+from .profiles import get_profile, work_dir
+from .storage import fetch
+from .thumbnails import pick_keyframes, poster_time, thumbnail_times, webvtt
 
-if not hasattr(PIL.Image, 'ANTIALIAS'):
-    PIL.Image.ANTIALIAS = PIL.Image.Resampling.LANCZOS
+TRIM_MODES = ("keyframe", "accurate", "reencode")
+# Mode of trims and merges split into segments encoded by separate tasks.
+PARALLEL = "parallel"
 
-@shared_task
-def trim_video_task(file_path, start_time, end_time, output_path):
+
+@shared_task(bind=True, base=JobTask)
+def trim_video_task(self, file_path, start_time, end_time, output_path, mode="keyframe", artifact_key=None,
+                    profile=None, transforms=None):
     """
     Task to trim a video asynchronously.
+
+    ``keyframe`` cuts on GOP boundaries and copies packets, ``accurate`` also
+    copies whole GOPs but re-encodes the partial GOPs at both edges, and
+    ``reencode`` decodes and encodes the whole range, encoding with the
+    named encoding ``profile``; it runs the trim preset of the transform
+    graph, followed by ``transforms`` (graph operations without a source,
+    see graph.trim_spec). With ``artifact_key`` (sources, operation,
+    params) the output is moved into the blob store and recorded so the
+    same trim is not made again. ``file_path`` is the source's storage name
+    (or a local path), read through storage.fetch().
     """
     try:
+        started = time.monotonic()
+        profile = get_profile(profile)
+        file_path = fetch(file_path)
+        _make_output_dirs(output_path)
         if not os.path.exists(file_path):
             return {'status': 'error', 'error': 'File not found.'}
+        if mode not in TRIM_MODES:
+            return {'status': 'error', 'error': f'Unknown trim mode: {mode}.'}
 
-        video = mp.VideoFileClip(file_path)
-
-        if start_time < 0 or end_time > video.duration or start_time >= end_time:
+        media_info = get_media_info(file_path)
+        info = media_info.to_dict()
+        if start_time < 0 or end_time > info["duration"] or start_time >= end_time:
             return {'status': 'error', 'error': 'Invalid start or end time.'}
 
-        trimmed_video = video.subclip(start_time, end_time)
-        trimmed_video.write_videofile(output_path, codec="libx264", audio_codec="aac")
-        
-        duration = trimmed_video.duration
-        size = os.path.getsize(output_path)
+        if mode == "reencode":
+            spec = graph.trim_spec(file_path, start_time, end_time, transforms or ())
+            plan = _run_graph(self, spec, [output_path], profile, "Encoding the trimmed range.")
+            result = {
+                'status': 'success',
+                'output_path': output_path,
+                'mode': mode,
+                'start_time': start_time,
+                'end_time': end_time,
+                'duration': plan.layouts[0].duration,
+                'size': os.path.getsize(output_path),
+            }
+        else:
+            keyframes = media_info.keyframes or [0.0]
+            if mode == "keyframe":
+                start_time, end_time = _snap_to_gops(keyframes, start_time, end_time, info["duration"])
+                progress = FrameProgress(self, end_time - start_time, info["fps"], "Copying the trimmed range.")
+                with ffmpeg.reporting(progress):
+                    ffmpeg.copy_segment(file_path, start_time, end_time, output_path, fps=info["fps"])
+            else:
+                # The pieces are written, then copied once more when stitched.
+                progress = FrameProgress(self, 2 * (end_time - start_time), info["fps"], "Cutting the trimmed range.")
+                with ffmpeg.reporting(progress):
+                    _trim_accurate(file_path, info, keyframes, start_time, end_time, output_path, profile)
 
-        video.close()
-        trimmed_video.close()
+            result = {
+                'status': 'success',
+                'output_path': output_path,
+                'mode': mode,
+                'start_time': start_time,
+                'end_time': end_time,
+                'duration': end_time - start_time,
+                'size': os.path.getsize(output_path),
+            }
+        return _store_artifact(_encode_stats(result, profile, started), artifact_key)
+    except Exception as e:
+        return {'status': 'error', 'error': str(e)}
+
+
+@shared_task(bind=True, base=JobTask)
+def batch_trim_task(self, file_path, ranges, output_paths, artifact_keys=None, profile=None):
+    """
+    Cut several (start, end) ``ranges`` of one file, each re-encoded with
+    frame accuracy to the matching entry of ``output_paths``, in a single
+    decode pass over the source: the batch trim preset of the transform
+    graph (see graph.batch_trim_spec). The result lists the outputs in the
+    order of ``ranges``; with ``artifact_keys`` each output is stored as in
+    trim_video_task.
+    """
+    try:
+        started = time.monotonic()
+        profile = get_profile(profile)
+        _run_graph(self, graph.batch_trim_spec(file_path, ranges), output_paths, profile,
+                   f"Cutting {len(ranges)} ranges.")
 
-        return {'status': 'success', 'output_path': output_path, 'duration': duration, 'size': size}
+        outputs = []
+        for i, (start_time, end_time) in enumerate(ranges):
+            output = {
+                'output_path': output_paths[i],
+                'start_time': start_time,
+                'end_time': end_time,
+                'duration': end_time - start_time,
+                'size': os.path.getsize(output_paths[i]),
+                'bitrate': ffmpeg.probe(output_paths[i])["bitrate"],
+            }
+            outputs.append(_store_artifact(output, artifact_keys[i] if artifact_keys else None))
+        return {
+            'status': 'success', 'mode': 'batch', 'outputs': outputs, 'profile': profile["name"],
+            'encode_time': round(time.monotonic() - started, 3), 'peak_rss': peak_rss(),
+        }
     except Exception as e:
         return {'status': 'error', 'error': str(e)}
 
 
-@shared_task(bind=True)
-def merge_videos_task(self, file_paths, output_path):
+def _run_graph(task, spec, output_paths, profile, message):
+    """
+    Run a transform graph whose inputs are storage names or local paths in
+    one ffmpeg pass, writing its outputs to ``output_paths``, and return its
+    graph.Plan. Outputs without a profile of their own use ``profile``.
+    """
+    parsed = graph.parse(spec)
+    paths = {name: fetch(source) for name, source in parsed.inputs.items()}
+    plan = graph.plan(parsed, {name: get_media_info(path).to_dict() for name, path in paths.items()})
+    _make_output_dirs(*output_paths)
+    outputs = [
+        (video, audio, output_path, get_profile(output["profile"]) if output.get("profile") else profile)
+        for (video, audio), output_path, output in zip(plan.outputs, output_paths, parsed.outputs)
+    ]
+    # ffmpeg reports the output time of its longest output.
+    longest = max(plan.layouts, key=lambda layout: layout.duration)
+    with ffmpeg.reporting(FrameProgress(task, longest.duration, longest.fps, message)):
+        ffmpeg.encode_graph(
+            [(paths[name], seek, duration) for name, seek, duration in plan.inputs], plan.filters, outputs,
+        )
+    return plan
+
+
+@shared_task(bind=True, base=JobTask)
+def graph_task(self, spec, output_paths, artifact_keys=None, profile=None):
+    """
+    Run a transform graph (see videos.graph) in a single ffmpeg pass, its
+    inputs being storage names. The result lists the outputs in the order
+    of the spec's, with their node and name; with ``artifact_keys`` each
+    output is stored as in trim_video_task.
+    """
+    try:
+        started = time.monotonic()
+        profile = get_profile(profile)
+        plan = _run_graph(self, spec, output_paths, profile, f"Running {len(spec.get('nodes', {}))} operations.")
+
+        outputs = []
+        for i, (output, layout) in enumerate(zip(spec["outputs"], plan.layouts)):
+            result = {
+                'output_path': output_paths[i],
+                'node': output["node"],
+                'name': output.get("name"),
+                'duration': layout.duration,
+                'size': os.path.getsize(output_paths[i]),
+                'bitrate': ffmpeg.probe(output_paths[i])["bitrate"],
+            }
+            outputs.append(_store_artifact(result, artifact_keys[i] if artifact_keys else None))
+        return {
+            'status': 'success', 'outputs': outputs, 'profile': profile["name"],
+            'encode_time': round(time.monotonic() - started, 3), 'peak_rss': peak_rss(),
+        }
+    except Exception as e:
+        return {'status': 'error', 'error': str(e)}
+
+
+def _encode_stats(result, profile, started):
+    """
+    Add the encoding profile, the task's wall time and the output's bitrate
+    to a result, so profiles can be compared.
+    """
+    return dict(
+        result, profile=profile["name"], encode_time=round(time.monotonic() - started, 3),
+        bitrate=ffmpeg.probe(result["output_path"])["bitrate"],
+    )
+
+
+def _make_output_dirs(*paths):
+    # Output paths are named by the web process; on another node their
+    # directory may not exist yet.
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+
+def _store_artifact(result, artifact_key):
+    """
+    Move a task's output into the blob store as the artifact for
+    ``artifact_key`` and point the result at the stored file.
+    """
+    if not artifact_key:
+        return result
+    with span("io"):
+        artifact = record_artifact(result["output_path"], *artifact_key, result=result)
+    return dict(result, output_path=fetch(artifact.blob.name), sha256=artifact.blob_id)
+
+
+def _snap_to_gops(keyframes, start_time, end_time, duration):
+    """
+    Widen a range to the keyframe at or before ``start_time`` and the keyframe
+    at or after ``end_time`` (or the end of the file).
+    """
+    start = keyframes[max(bisect.bisect_right(keyframes, start_time) - 1, 0)]
+    index = bisect.bisect_left(keyframes, end_time)
+    end = keyframes[index] if index < len(keyframes) else duration
+    return start, end
+
+
+def _trim_accurate(file_path, info, keyframes, start_time, end_time, output_path, profile=None):
+    """
+    Copy the whole GOPs inside the range and re-encode only the partial GOPs
+    at the edges, to the source's stream layout, then stitch the pieces
+    together without another encode. The edges are encoded with libx264 and
+    AAC, so other sources, and edges that still come out unlike the copied
+    GOPs (see ffmpeg.stream_signature), are encoded in full.
+    """
+    first = bisect.bisect_left(keyframes, start_time)
+    last = bisect.bisect_right(keyframes, end_time) - 1
+    inner_start = keyframes[first] if first < len(keyframes) else end_time
+    inner_end = keyframes[last] if last >= 0 else start_time
+
+    if inner_start >= inner_end or not _encodable(info):
+        # No complete GOP inside the range (or no codec to splice into).
+        ffmpeg.encode_segment(file_path, start_time, end_time, output_path, profile=profile)
+        return
+
+    with tempfile.TemporaryDirectory(dir=work_dir(profile or {}, output_path)) as parts_dir:
+        pieces = []
+        if start_time < inner_start:
+            pieces.append(os.path.join(parts_dir, "head.nut"))
+            ffmpeg.encode_segment(
+                file_path, start_time, inner_start, pieces[-1], intermediate=True, profile=profile, target=info,
+            )
+        pieces.append(os.path.join(parts_dir, "middle.nut"))
+        ffmpeg.copy_segment(file_path, inner_start, inner_end, pieces[-1], fps=info["fps"], intermediate=True)
+        if inner_end < end_time:
+            pieces.append(os.path.join(parts_dir, "tail.nut"))
+            ffmpeg.encode_segment(
+                file_path, inner_end, end_time, pieces[-1], intermediate=True, profile=profile, target=info,
+            )
+        if len({ffmpeg.stream_signature(ffmpeg.probe(piece)) for piece in pieces}) > 1:
+            ffmpeg.encode_segment(file_path, start_time, end_time, output_path, profile=profile)
+            return
+        ffmpeg.concat_copy(pieces, output_path, os.path.join(parts_dir, "pieces.txt"))
+
+
+# Layout used when no input can serve as the merge target.
+DEFAULT_MERGE_TARGET = {
+    "video_codec": "h264", "video_profile": "High", "width": 1280, "height": 720,
+    "pix_fmt": "yuv420p", "fps": 30, "timebase": 15360,
+    "audio_codec": "aac", "audio_sample_rate": 44100, "audio_channels": 2,
+}
+
+
+@shared_task(bind=True, base=JobTask)
+def merge_videos_task(self, file_paths, output_path, artifact_key=None, profile=None, transforms=None):
     """
     Task to merge multiple videos asynchronously, with status updates.
+
+    Inputs are probed first. When they all share codec, resolution, frame
+    rate and timebase they are concatenated by remuxing packets. Otherwise
+    only the inputs that differ from the most common layout are re-encoded
+    to match it, once each, and the result is remuxed the same way; when
+    most inputs differ and they decode alike, all of them are streamed
+    through a single encoder instead. Either way one input is read at a
+    time, so memory use does not grow with the number of inputs; the
+    result reports the peak RSS of the worker and of ffmpeg. Encoding uses
+    the named encoding ``profile``. With ``transforms`` (graph operations
+    without a source) the merge preset of the transform graph runs instead,
+    decoding every input and encoding the transformed result in one pass
+    (see graph.merge_spec). With ``artifact_key`` the output is stored as
+    in trim_video_task. ``file_paths`` are storage names or local paths.
     """
     try:
+        started = time.monotonic()
+        profile = get_profile(profile)
+        file_paths = [fetch(path) for path in file_paths]
+        _make_output_dirs(output_path)
         self.update_state(state="STARTED", meta={"message": "Merging videos has started."})
         current_task.update_state(state="STARTED", meta={"message": "Task started"})
+        if transforms:
+            _run_graph(self, graph.merge_spec(file_paths, transforms), [output_path], profile, "Merging videos.")
+            return _merge_done(self, {
+                "status": "success", "output_path": output_path, "engine": "graph", "normalized": len(set(file_paths)),
+            }, artifact_key, profile, started)
 
-        clips = []
-        for i, path in enumerate(file_paths):
-            clip = mp.VideoFileClip(path)
-            clip = clip.resize(height=720)  # Optional: Normalize resolution
-            clip = clip.set_fps(30)         # Optional: Normalize FPS
-            clips.append(clip)
-
-            # Update task progress
-            self.update_state(
-                state="PROGRESS",
-                meta={
-                    "message": f"Processing clip {i+1} of {len(file_paths)}.",
-                    "current": i + 1,
-                    "total": len(file_paths),
-                }
-            )
+        infos = {path: get_media_info(path).to_dict() for path in set(file_paths)}
+        target = _merge_target([infos[path] for path in file_paths])
+        target_signature = ffmpeg.stream_signature(target)
+
+        # Each mismatched input is encoded once, then every part is remuxed;
+        # frames are counted at the target rate.
+        mismatched = {path for path in file_paths if ffmpeg.stream_signature(infos[path]) != target_signature}
+        if _encode_in_one_pass(file_paths, infos, mismatched):
+            return _merge_encode(self, file_paths, infos, target, output_path, artifact_key, profile, started)
+        seconds = sum(infos[path]["duration"] or 0 for path in list(mismatched) + file_paths)
+        progress = FrameProgress(self, seconds, target["fps"], "Merging videos.")
+
+        with tempfile.TemporaryDirectory(dir=work_dir(profile, output_path)) as temp_dir, \
+                ffmpeg.reporting(progress):
+            normalized = {}
+            parts = []
+            for i, path in enumerate(file_paths):
+                if ffmpeg.stream_signature(infos[path]) == target_signature:
+                    parts.append(path)
+                else:
+                    if path not in normalized:
+                        normalized[path] = os.path.join(temp_dir, f"normalized_{len(normalized)}.mp4")
+                        ffmpeg.normalize(path, infos[path], target, normalized[path], profile)
+                    parts.append(normalized[path])
 
-        # Merge the clips
-        final_clip = mp.concatenate_videoclips(clips, method="compose")
-        final_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
+                # Update task progress
+                progress.message = f"Processing clip {i+1} of {len(file_paths)}."
+                self.update_state(
+                    state="PROGRESS",
+                    meta={
+                        "message": progress.message,
+                        "current": i + 1,
+                        "total": len(file_paths),
+                    }
+                )
 
-        # Clean up resources
-        for clip in clips:
-            clip.close()
-        final_clip.close()
+            progress.message = "Joining the clips."
 
-        # Update task status to SUCCESS
-        self.update_state(state="SUCCESS", meta={"output_path": output_path})
-        current_task.update_state(state="SUCCESS", meta={"output_path": output_path})
+            # Merge the clips
+            ffmpeg.concat_copy(parts, output_path, os.path.join(temp_dir, "parts.txt"))
 
-        return {"status": "success", "output_path": output_path}
+        return _merge_done(self, {
+            "status": "success", "output_path": output_path, "engine": "remux", "normalized": len(normalized),
+        }, artifact_key, profile, started)
     except Exception as e:
         self.update_state(state="FAILURE", meta={"error": str(e)})
-        raise
\ No newline at end of file
+        raise
+
+
+def _encode_in_one_pass(file_paths, infos, mismatched):
+    """
+    Whether to merge by streaming every input through one encoder: when
+    more than half of the clips would need re-encoding anyway, and the
+    inputs can be decoded one after the other as a single input.
+    """
+    mismatched_clips = sum(path in mismatched for path in file_paths)
+    decode_layouts = {tuple(infos[path][key] for key in ffmpeg.DECODE_KEYS) for path in file_paths}
+    return mismatched_clips * 2 > len(file_paths) and len(decode_layouts) == 1
+
+
+def _merge_encode(task, file_paths, infos, target, output_path, artifact_key, profile, started):
+    seconds = sum(infos[path]["duration"] or 0 for path in file_paths)
+    progress = FrameProgress(task, seconds, target["fps"], "Encoding the merged video.")
+    with tempfile.TemporaryDirectory(dir=work_dir(profile, output_path)) as temp_dir, \
+            ffmpeg.reporting(progress):
+        ffmpeg.concat_encode(file_paths, target, output_path, os.path.join(temp_dir, "inputs.txt"), profile)
+    return _merge_done(task, {
+        "status": "success", "output_path": output_path, "engine": "encode", "normalized": len(set(file_paths)),
+    }, artifact_key, profile, started)
+
+
+def _merge_done(task, result, artifact_key, profile, started):
+    result = _encode_stats(dict(result, peak_rss=peak_rss()), profile, started)
+    result = _store_artifact(result, artifact_key)
+
+    # Update task status to SUCCESS
+    task.update_state(state="SUCCESS", meta={"output_path": result["output_path"]})
+    current_task.update_state(state="SUCCESS", meta={"output_path": result["output_path"]})
+
+    return result
+
+
+def peak_rss():
+    """
+    Peak resident set size in bytes of this worker process, over its
+    lifetime so far, and of the largest ffmpeg process the current task has
+    run (see ffmpeg.measuring()).
+    """
+    return {
+        "worker": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * ffmpeg.RSS_SCALE,
+        "ffmpeg": ffmpeg.peak_rss(),
+    }
+
+
+def _encodable(info):
+    """
+    Whether files can be encoded to the stream layout of ``info`` (libx264
+    and AAC), to be joined with its packets.
+    """
+    return info["video_codec"] == "h264" and info["audio_codec"] in (None, "aac")
+
+
+def _merge_target(infos):
+    """
+    Pick the stream layout the merged file will use: the most common layout
+    among inputs we can encode to, so the fewest inputs need re-encoding.
+    """
+    candidates = [info for info in infos if _encodable(info)]
+    if not candidates:
+        return DEFAULT_MERGE_TARGET
+    signatures = [ffmpeg.stream_signature(info) for info in candidates]
+    best = max(signatures, key=signatures.count)
+    return candidates[signatures.index(best)]
+
+
+@shared_task(bind=True, base=JobTask)
+def transcode_task(self, spans, output_path, artifact_key=None, profile=None):
+    """
+    Coordinator of a parallel trim or merge. ``spans`` are (storage name or
+    local path, start, end) ranges to join in order; an end of None is the
+    end of the file. Each range is cut at keyframes into segments of about
+    settings.VIDEO_TRANSCODE_SEGMENT_SECONDS, recorded as JobParts, and the
+    task is replaced by a chord: one encode_part_task per segment, then
+    stitch_parts_task joining them without re-encoding the video. Parts
+    are encoded with the named encoding ``profile`` and written to its
+    ``temp_dir``, which all workers must share (default under MEDIA_ROOT).
+
+    Parts already encoded by an earlier run of the same job are not
+    encoded again, so after a crash the job resumes where it stopped.
+    """
+    job_id = self.request.id
+    temp_dir = get_profile(profile)["temp_dir"] or os.path.join(settings.MEDIA_ROOT, "videos", "parts")
+    parts = list(JobPart.objects.filter(job_id=job_id))
+    infos = {path: get_media_info(fetch(path)) for path, _, _ in spans}
+    for path, start, end in spans:
+        if start < 0 or (end is not None and (end > infos[path].duration or start >= end)):
+            raise ValueError("Invalid start or end time.")
+    target = _merge_target([infos[path].to_dict() for path, _, _ in spans])
+
+    if not parts:
+        parts_dir = os.path.join(temp_dir, str(job_id))
+        os.makedirs(parts_dir, exist_ok=True)
+        for path, start, end in spans:
+            info = infos[path]
+            end = info.duration if end is None else end
+            bounds = _split_at_keyframes(info.keyframes or [0.0], start, end, settings.VIDEO_TRANSCODE_SEGMENT_SECONDS)
+            for part_start, part_end in zip(bounds, bounds[1:]):
+                index = len(parts)
+                parts.append(JobPart(
+                    job_id=job_id, index=index, source=path, start=part_start, end=part_end,
+                    path=os.path.join(parts_dir, f"part_{index:05d}.nut"),
+                ))
+        JobPart.objects.bulk_create(parts)
+        parts = list(JobPart.objects.filter(job_id=job_id))
+
+    self.update_state(state="PROGRESS", meta={
+        "message": "Encoding segments.",
+        "current": sum(part.status == JobPart.DONE for part in parts),
+        "total": len(parts),
+    })
+    # Parts and the stitch go to the queue, at the priority, the job was routed to.
+    delivery = self.request.delivery_info or {}
+    routing = {"queue": delivery.get("routing_key"), "priority": delivery.get("priority")}
+    routing = {key: value for key, value in routing.items() if value is not None}
+    stitch = stitch_parts_task.s(job_id, target, output_path, artifact_key, profile).set(**routing)
+    pending = [
+        encode_part_task.si(part.id, target, profile).set(**routing) for part in parts
+        if part.status != JobPart.DONE or not os.path.exists(part.path)
+    ]
+    if not pending:
+        return self.replace(stitch.clone(args=([],)))
+    if self.request.is_eager:
+        # No broker to run a chord on: encode the parts here, as replace()
+        # itself does with eager tasks.
+        return self.replace(stitch.clone(args=([sig.apply().get() for sig in pending],)))
+    return self.replace(chord(pending, stitch))
+
+
+def _split_at_keyframes(keyframes, start, end, length):
+    """
+    Boundaries cutting [start, end] into segments of at least ``length``
+    seconds (the last may be shorter), at keyframes inside the range.
+    """
+    bounds = [start]
+    for keyframe in keyframes:
+        if start < keyframe < end and keyframe - bounds[-1] >= length:
+            bounds.append(keyframe)
+    return bounds + [end]
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def encode_part_task(self, part_id, target, profile=None):
+    """
+    Encode one JobPart. Acknowledged only once done, so a part whose worker
+    died is delivered again; a part already done is skipped.
+    """
+    part = JobPart.objects.select_related("job").get(id=part_id)
+    if part.status == JobPart.DONE and os.path.exists(part.path):
+        return part.index
+    try:
+        source_path = fetch(part.source)
+        source = get_media_info(source_path).to_dict()
+        partial = f"{part.path}.partial"
+        ffmpeg.encode_part(source_path, part.start, part.end, source, target, partial, get_profile(profile))
+        os.replace(partial, part.path)
+    except Exception as e:
+        error = f"Segment {part.index}: {e}"
+        Job.objects.filter(id=part.job_id).update(
+            status=Job.FAILURE, error=error, finished_at=now(), version=F("version") + 1,
+        )
+        raise RuntimeError(error) from e
+    JobPart.objects.filter(id=part_id).update(status=JobPart.DONE)
+
+    parts = JobPart.objects.filter(job_id=part.job_id)
+    record_progress(part.job_id, {
+        "message": "Encoding segments.",
+        "current": parts.filter(status=JobPart.DONE).count(),
+        "total": parts.count(),
+    })
+    return part.index
+
+
+@shared_task(bind=True, base=JobTask)
+def stitch_parts_task(self, indexes, job_id, target, output_path, artifact_key=None, profile=None):
+    """
+    Join the encoded parts of a job into ``output_path`` and remove them.
+    Runs with the job id as its task id, so finishing it finishes the job.
+    The reported encode time runs from the start of the coordinator.
+    """
+    profile = get_profile(profile)
+    job_started = Job.objects.get(id=job_id).started_at or now()
+    started = time.monotonic() - (now() - job_started).total_seconds()
+    parts = list(JobPart.objects.filter(job_id=job_id))
+    paths = [part.path for part in parts]
+    self.update_state(state="PROGRESS", meta={"message": "Joining the segments.", "current": len(paths), "total": len(paths)})
+    parts_dir = os.path.dirname(paths[0])
+    _make_output_dirs(output_path)
+    ffmpeg.stitch_parts(
+        paths, [part.end - part.start for part in parts], target, output_path,
+        os.path.join(parts_dir, "parts.txt"), profile,
+    )
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    return _store_artifact(_encode_stats({
+        "status": "success", "output_path": output_path, "mode": PARALLEL, "segments": len(paths),
+        "duration": get_media_info(output_path).duration,
+    }, profile, started), artifact_key)
+
+
+@shared_task(bind=True)
+def package_video_task(self, video_id):
+    """
+    Task to transcode a video into the bitrate ladder and package it as
+    segmented HLS and DASH, in a single decode pass.
+    """
+    video = Video.objects.select_related("media_info").get(id=video_id)
+    directory = f"videos/packages/{video.id}"
+    segment_duration = settings.VIDEO_ABR_SEGMENT_DURATION
+    package, _ = VideoPackage.objects.update_or_create(
+        video=video,
+        defaults={
+            "status": VideoPackage.PROCESSING,
+            "directory": directory,
+            "segment_duration": segment_duration,
+            "error": "",
+        },
+    )
+    output_dir = os.path.join(settings.MEDIA_ROOT, directory)
+    try:
+        source = fetch(video.file.name)
+        info = video.media_info or get_media_info(source, video.blob_id)
+        ladder = _abr_ladder(info, settings.VIDEO_ABR_LADDER)
+        audio_bitrate = settings.VIDEO_ABR_AUDIO_BITRATE if info.audio_codec else None
+
+        self.update_state(state="PROGRESS", meta={"message": f"Encoding {len(ladder)} renditions."})
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+        ffmpeg.package_abr(source, ladder, audio_bitrate, segment_duration, output_dir)
+
+        streams = [dict(rung, kind=Rendition.VIDEO) for rung in ladder]
+        if audio_bitrate:
+            streams.append({"name": "audio", "kind": Rendition.AUDIO, "bitrate": audio_bitrate})
+        with transaction.atomic():
+            package.renditions.all().delete()
+            renditions = Rendition.objects.bulk_create([
+                Rendition(
+                    package=package,
+                    name=stream["name"],
+                    kind=stream["kind"],
+                    width=stream.get("width"),
+                    height=stream.get("height"),
+                    bitrate=stream["bitrate"],
+                    playlist=f"media_{index}.m3u8",
+                    init_segment=f"init-{index}.m4s",
+                )
+                for index, stream in enumerate(streams)
+            ])
+            Segment.objects.bulk_create([
+                segment for rendition in renditions for segment in _playlist_segments(rendition, output_dir)
+            ])
+            package.status = VideoPackage.READY
+            package.save()
+
+        return {
+            "status": "success",
+            "video_id": str(video.id),
+            "renditions": [stream["name"] for stream in streams],
+        }
+    except Exception as e:
+        package.status = VideoPackage.FAILED
+        package.error = str(e)
+        package.save()
+        return {"status": "error", "error": str(e)}
+
+
+@shared_task(bind=True)
+def thumbnail_video_task(self, video_id):
+    """
+    Task to extract a poster frame and seek-preview thumbnails of a video,
+    tiled into sprite sheets with a WebVTT track. Only keyframes are decoded,
+    in a single pass; each thumbnail shows the last keyframe at or before
+    its time.
+    """
+    video = Video.objects.select_related("media_info").get(id=video_id)
+    directory = f"videos/thumbnails/{video.id}"
+    thumbnails, _ = ThumbnailSet.objects.update_or_create(
+        video=video,
+        defaults={
+            "status": ThumbnailSet.PROCESSING,
+            "directory": directory,
+            "interval": settings.VIDEO_THUMBNAIL_INTERVAL,
+            "columns": settings.VIDEO_SPRITE_COLUMNS,
+            "rows": settings.VIDEO_SPRITE_ROWS,
+            "error": "",
+        },
+    )
+    output_dir = os.path.join(settings.MEDIA_ROOT, directory)
+    try:
+        source = fetch(video.file.name)
+        info = video.media_info or get_media_info(source, video.blob_id)
+        thumbnails.tile_width = settings.VIDEO_THUMBNAIL_WIDTH
+        thumbnails.tile_height = round(thumbnails.tile_width * info.height / info.width / 2) * 2
+        times = thumbnail_times(info.duration, thumbnails.interval)
+
+        self.update_state(state="PROGRESS", meta={"message": f"Extracting {len(times)} thumbnails."})
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+        with tempfile.TemporaryDirectory() as work_dir:
+            keyframes = ffmpeg.keyframe_images(
+                source, thumbnails.tile_width, thumbnails.tile_height, work_dir,
+            )
+            if not keyframes:
+                raise IOError("No keyframes could be decoded.")
+            for index, image in enumerate(pick_keyframes(keyframes, times)):
+                shutil.copyfile(image, os.path.join(work_dir, f"thumb-{index + 1:05d}.jpg"))
+            ffmpeg.tile_images(
+                os.path.join(work_dir, "thumb-%05d.jpg"), thumbnails.columns, thumbnails.rows,
+                os.path.join(output_dir, "sprite-%03d.jpg"),
+            )
+        ffmpeg.extract_frame(
+            source, poster_time(info.duration), settings.VIDEO_POSTER_WIDTH,
+            os.path.join(output_dir, thumbnails.poster),
+        )
+        with open(os.path.join(output_dir, thumbnails.vtt), "w") as track:
+            track.write(webvtt(thumbnails, info.duration))
+
+        thumbnails.count = len(times)
+        thumbnails.sprite_count = -(-len(times) // (thumbnails.columns * thumbnails.rows))
+        thumbnails.status = ThumbnailSet.READY
+        thumbnails.save()
+        return {
+            "status": "success",
+            "video_id": str(video.id),
+            "thumbnails": thumbnails.count,
+            "sprites": thumbnails.sprite_count,
+        }
+    except Exception as e:
+        thumbnails.status = ThumbnailSet.FAILED
+        thumbnails.error = str(e)
+        thumbnails.save()
+        return {"status": "error", "error": str(e)}
+
+
+@shared_task(bind=True)
+def analyze_video_task(self, video_id):
+    """
+    Task to find the scene cuts, black frames and silence of a video, unless
+    its content was analyzed before.
+    """
+    video = Video.objects.select_related("media_info").get(id=video_id)
+    try:
+        source = fetch(video.file.name)
+        info = video.media_info or get_media_info(source, video.blob_id)
+        self.update_state(state="PROGRESS", meta={"message": "Analyzing scenes and silence."})
+        result = analysis.analyze_file(source, info)
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+    return {
+        "status": "success",
+        "video_id": str(video.id),
+        "analysis_time": result.analysis_time,
+        "events": len(analysis.events(result)),
+    }
+
+
+def _abr_ladder(info, ladder):
+    """
+    Rungs of the ladder no taller than the source (at least the smallest one),
+    with widths keeping the source aspect ratio.
+    """
+    rungs = sorted(ladder, key=lambda rung: rung["height"], reverse=True)
+    fitting = [rung for rung in rungs if rung["height"] <= info.height] or rungs[-1:]
+    return [
+        dict(rung, width=round(info.width * rung["height"] / info.height / 2) * 2)
+        for rung in fitting
+    ]
+
+
+def _playlist_segments(rendition, output_dir):
+    """
+    Segment rows for the media playlist of a rendition.
+    """
+    segments = []
+    start_time = 0.0
+    duration = None
+    with open(os.path.join(output_dir, rendition.playlist)) as playlist:
+        for line in playlist:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",")[0])
+            elif line and not line.startswith("#") and duration is not None:
+                segments.append(Segment(
+                    rendition=rendition,
+                    sequence=len(segments) + 1,
+                    uri=line,
+                    start_time=start_time,
+                    duration=duration,
+                    size=os.path.getsize(os.path.join(output_dir, line)),
+                ))
+                start_time += duration
+                duration = None
+    return segments
+
+
+@shared_task
+def collect_blobs_task():
+    """
+    Task to remove unreferenced blobs and stray files from the blob store.
+    """
+    removed, freed = collect_garbage()
+    return {"status": "success", "removed": removed, "freed": freed}
@@ -0,0 +1,45 @@
+import pytest
+from django.core.cache import cache
+from videos.ffmpeg import run_ffmpeg
+from videos.tests.s3_standin import S3StandIn
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Cached listing pages must not leak between tests."""
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def no_packaging_on_upload(settings):
+    """Uploads in tests must not enqueue packaging on the broker."""
+    settings.VIDEO_PACKAGE_ON_UPLOAD = False
+    settings.VIDEO_THUMBNAILS_ON_UPLOAD = False
+    settings.VIDEO_ANALYZE_ON_UPLOAD = False
+
+
+@pytest.fixture
+def make_clip(tmp_path):
+    """Factory for small synthetic clips generated locally with ffmpeg."""
+    def _make_clip(name="clip.mp4", duration=6, size="320x180", fps=24, gop=48, audio=True):
+        path = str(tmp_path / name)
+        args = ["-f", "lavfi", "-i", f"testsrc=size={size}:rate={fps}"]
+        if audio:
+            args += ["-f", "lavfi", "-i", "sine=frequency=440"]
+        args += ["-t", str(duration), "-c:v", "libx264", "-g", str(gop), "-pix_fmt", "yuv420p"]
+        args += ["-c:a", "aac"] if audio else ["-an"]
+        run_ffmpeg(args + [path])
+        return path
+    return _make_clip
+
+
+@pytest.fixture
+def s3_storage(settings, tmp_path):
+    """Store blobs in a local S3 stand-in, cached under tmp_path."""
+    with S3StandIn(min_part_size=1024) as standin:
+        settings.VIDEO_STORAGE = {
+            "BACKEND": "s3", "ENDPOINT_URL": standin.url, "BUCKET": "videos", "ACCESS_KEY": standin.access_key,
+            "SECRET_KEY": "test-secret", "PART_SIZE": 16 * 1024, "MIN_PART_SIZE": 1024,
+        }
+        settings.VIDEO_STORAGE_CACHE_DIR = str(tmp_path / "storage-cache")
+        yield standin
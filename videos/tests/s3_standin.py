@@ -0,0 +1,184 @@
+"""
+A local stand-in for an S3-compatible service, enough for the S3 storage
+backend: objects with ranged GETs, server-side copies (of whole objects or
+of ranges into parts), listing and multipart uploads, kept in memory.
+Requests must carry a SigV4 Authorization header for the expected access
+key.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+from xml.etree import ElementTree
+
+NS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class S3StandIn:
+    def __init__(self, access_key="test-key", min_part_size=5 * 1024 * 1024):
+        self.access_key = access_key
+        self.min_part_size = min_part_size
+        self.objects = {}  # (bucket, key): (bytes, mtime)
+        self.uploads = {}  # upload id: (bucket, key, {part number: bytes})
+        self.requests = []  # (method, key, query, headers)
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _error(self, status, code):
+                self._reply(status, f"<Error><Code>{code}</Code><Message>{code}</Message></Error>".encode())
+
+            def _xml(self, root, items):
+                element = ElementTree.Element(root, xmlns=NS)
+                for tag, value in items:
+                    if isinstance(value, list):
+                        child = ElementTree.SubElement(element, tag)
+                        for sub_tag, sub_value in value:
+                            ElementTree.SubElement(child, sub_tag).text = str(sub_value)
+                    else:
+                        ElementTree.SubElement(element, tag).text = str(value)
+                self._reply(200, ElementTree.tostring(element))
+
+            def _route(self):
+                url = urlsplit(self.path)
+                bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+                query = dict(parse_qsl(url.query, keep_blank_values=True))
+                authorization = self.headers.get("Authorization", "")
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if not authorization.startswith(f"AWS4-HMAC-SHA256 Credential={standin.access_key}/"):
+                    return self._error(403, "AccessDenied")
+                with standin.lock:
+                    standin.requests.append((self.command, key, query, dict(self.headers)))
+                    return getattr(self, f"_{self.command.lower()}")(bucket, key, query, body)
+
+            do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _route
+
+            def _head(self, bucket, key, query, body):
+                self._get(bucket, key, query, body)
+
+            def _get(self, bucket, key, query, body):
+                if not key and query.get("list-type") == "2":
+                    prefix = query.get("prefix", "")
+                    keys = sorted(k for b, k in standin.objects if b == bucket and k.startswith(prefix))
+                    contents = [
+                        ("Contents", [
+                            ("Key", k), ("Size", len(standin.objects[bucket, k][0])),
+                            ("LastModified", time.strftime("%Y-%m-%dT%H:%M:%S.000Z",
+                                                           time.gmtime(standin.objects[bucket, k][1]))),
+                        ])
+                        for k in keys
+                    ]
+                    return self._xml("ListBucketResult", contents + [("IsTruncated", "false")])
+                if "uploadId" in query:
+                    upload = standin.uploads.get(query["uploadId"])
+                    if upload is None:
+                        return self._error(404, "NoSuchUpload")
+                    parts = [
+                        ("Part", [("PartNumber", number), ("Size", len(data)),
+                                  ("ETag", f'"{hashlib.md5(data).hexdigest()}"')])
+                        for number, data in sorted(upload[2].items())
+                    ]
+                    return self._xml("ListPartsResult", parts + [("IsTruncated", "false")])
+                if (bucket, key) not in standin.objects:
+                    return self._error(404, "NoSuchKey")
+                data, mtime = standin.objects[bucket, key]
+                headers = {"Last-Modified": formatdate(mtime, usegmt=True), "ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+                range_header = self.headers.get("Range")
+                if range_header and self.command == "GET":
+                    first, _, last = range_header.partition("=")[2].partition("-")
+                    start, end = int(first), min(int(last), len(data) - 1)
+                    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                    return self._reply(206, data[start:end + 1], headers)
+                if self.command == "HEAD":
+                    self.send_response(200)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Length", str(len(data)))
+                    return self.end_headers()
+                self._reply(200, data, headers)
+
+            def _put(self, bucket, key, query, body):
+                if "uploadId" in query:
+                    upload = standin.uploads.get(query["uploadId"])
+                    if upload is None:
+                        return self._error(404, "NoSuchUpload")
+                    source = self.headers.get("x-amz-copy-source")
+                    if source:
+                        # UploadPartCopy: the part is a range of an object.
+                        source_bucket, _, source_key = unquote(source).lstrip("/").partition("/")
+                        if (source_bucket, source_key) not in standin.objects:
+                            return self._error(404, "NoSuchKey")
+                        first, _, last = self.headers["x-amz-copy-source-range"].partition("=")[2].partition("-")
+                        body = standin.objects[source_bucket, source_key][0][int(first):int(last) + 1]
+                    upload[2][int(query["partNumber"])] = body
+                    etag = f'"{hashlib.md5(body).hexdigest()}"'
+                    if source:
+                        return self._xml("CopyPartResult", [("ETag", etag)])
+                    return self._reply(200, headers={"ETag": etag})
+                source = self.headers.get("x-amz-copy-source")
+                if source:
+                    source_bucket, _, source_key = unquote(source).lstrip("/").partition("/")
+                    if (source_bucket, source_key) not in standin.objects:
+                        return self._error(404, "NoSuchKey")
+                    body = standin.objects[source_bucket, source_key][0]
+                standin.objects[bucket, key] = (body, time.time())
+                if source:
+                    return self._xml("CopyObjectResult", [("ETag", f'"{hashlib.md5(body).hexdigest()}"')])
+                self._reply(200)
+
+            def _post(self, bucket, key, query, body):
+                if "uploads" in query:
+                    upload_id = uuid.uuid4().hex
+                    standin.uploads[upload_id] = (bucket, key, {})
+                    return self._xml("InitiateMultipartUploadResult", [("UploadId", upload_id)])
+                upload = standin.uploads.get(query.get("uploadId"))
+                if upload is None:
+                    return self._error(404, "NoSuchUpload")
+                root = ElementTree.fromstring(body)
+                numbers = [int(part.findtext("PartNumber")) for part in root.iter("Part")]
+                if numbers != sorted(numbers) or any(number not in upload[2] for number in numbers):
+                    return self._error(400, "InvalidPart")
+                if any(len(upload[2][number]) < standin.min_part_size for number in numbers[:-1]):
+                    return self._error(400, "EntityTooSmall")
+                standin.objects[bucket, key] = (b"".join(upload[2][number] for number in numbers), time.time())
+                del standin.uploads[query["uploadId"]]
+                self._xml("CompleteMultipartUploadResult", [("Key", key)])
+
+            def _delete(self, bucket, key, query, body):
+                if "uploadId" in query:
+                    standin.uploads.pop(query["uploadId"], None)
+                else:
+                    standin.objects.pop((bucket, key), None)
+                self._reply(204)
+
+        return Handler
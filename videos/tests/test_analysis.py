@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+import numpy as np
+import pytest
+from unittest.mock import patch
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos import analysis
+from videos.ffmpeg import run_ffmpeg
+from videos.models import Analysis, Video
+from videos.probe import get_media_info
+from videos.tasks import analyze_video_task, trim_video_task
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+def shots_clip(path):
+    """Two seconds of red with a tone, one of black and silence, two of blue with a tone."""
+    run_ffmpeg([
+        "-f", "lavfi", "-i", "color=red:size=160x90:rate=24:duration=2",
+        "-f", "lavfi", "-i", "color=black:size=160x90:rate=24:duration=1",
+        "-f", "lavfi", "-i", "color=blue:size=160x90:rate=24:duration=2",
+        "-f", "lavfi", "-i", "sine=frequency=440:duration=2",
+        "-f", "lavfi", "-i", "anullsrc=sample_rate=44100:channel_layout=mono:duration=1",
+        "-f", "lavfi", "-i", "sine=frequency=440:duration=2",
+        "-filter_complex", "[0:v][3:a][1:v][4:a][2:v][5:a]concat=n=3:v=1:a=1[v][a]",
+        "-map", "[v]", "-map", "[a]", "-c:v", "libx264", "-g", "24", "-pix_fmt", "yuv420p", "-c:a", "aac", path,
+    ])
+    return path
+
+
+@contextmanager
+def analyze_eagerly():
+    """Run the analysis in-process when a view sends it."""
+    with patch.object(analyze_video_task, "update_state"), patch.object(
+        analyze_video_task, "delay", side_effect=lambda video_id: analyze_video_task.apply((video_id,)),
+    ):
+        yield
+
+
+@pytest.mark.django_db
+def test_analysis_finds_cuts_black_and_silence_once(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    path = shots_clip(str(tmp_path / "shots.mp4"))
+    video = Video.objects.create(name="shots.mp4", duration=5, size=1, file=path, media_info=get_media_info(path))
+    client = APIClient()
+    setup_user(client)
+
+    assert client.get(f"/api/videos/{video.id}/analysis/").status_code == 404
+    with analyze_eagerly():
+        assert client.post(f"/api/videos/{video.id}/analysis/").status_code == 202
+
+    data = client.get(f"/api/videos/{video.id}/analysis/").data
+    assert data["scenes"] == pytest.approx([2.0, 3.0], abs=0.11)
+    assert data["black"] == [pytest.approx([2.0, 3.0], abs=0.11)]
+    assert data["silence"] == [pytest.approx([2.0, 3.0], abs=0.11)]
+    assert data["analysis_time"] < data["duration"]
+    # Two cuts, a black and a silent stretch, 13 bytes each.
+    assert len(Analysis.objects.get().events) == 4 * 13
+
+    # A copy of the same content is answered from the stored analysis.
+    copy = Video.objects.create(name="copy.mp4", duration=5, size=1, file=path, media_info=video.media_info)
+    with patch.object(analysis, "analyze") as analyze:
+        response = client.post(f"/api/videos/{copy.id}/analysis/")
+    assert response.status_code == 200 and response.data["cached"]
+    analyze.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_trim_points_snap_to_boundaries_and_keyframes(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    path = shots_clip(str(tmp_path / "shots.mp4"))
+    video = Video.objects.create(name="shots.mp4", duration=5, size=1, file=path, media_info=get_media_info(path))
+    client = APIClient()
+    setup_user(client)
+
+    def trim(**body):
+        with patch.object(trim_video_task, "apply_async"):
+            return client.post(f"/api/videos/{video.id}/trim/", body, format="json")
+
+    assert trim(start_time=1.7, end_time=4.5, snap="boundary").status_code == 409
+    with analyze_eagerly():
+        client.post(f"/api/videos/{video.id}/analysis/")
+
+    response = trim(start_time=1.7, end_time=4.5, snap="boundary", snap_window=0.5)
+    assert response.status_code == 202
+    assert (response.data["start_time"], response.data["end_time"]) == (pytest.approx(2.0, abs=0.11), 4.5)
+    response = trim(start_time=1.7, end_time=4.5, snap="keyframe")
+    assert (response.data["start_time"], response.data["end_time"]) == (pytest.approx(2.0), pytest.approx(4.0))
+    assert trim(start_time=1, end_time=2, snap="scene").status_code == 400
+    for window in ("wide", -1, "inf"):
+        assert trim(start_time=1, end_time=2, snap="keyframe", snap_window=window).status_code == 400
+
+
+def test_silence_runs_span_chunks():
+    window = round(analysis.AUDIO_RATE * analysis.AUDIO_WINDOW)
+    tone = (np.sin(np.arange(analysis.AUDIO_RATE) / 3) * 8000).astype("<i2")
+    samples = np.concatenate((tone, np.zeros(analysis.AUDIO_RATE, "<i2"), tone)).tobytes()
+    # Chunks that split windows still give whole-window levels.
+    chunks = [samples[i:i + 2 * window + 6] for i in range(0, len(samples), 2 * window + 6)]
+
+    events = analysis.detect_audio(chunks)
+
+    assert events["kind"].tolist() == [analysis.SILENCE]
+    assert (events["start"][0], events["end"][0]) == (pytest.approx(1.0), pytest.approx(2.0))
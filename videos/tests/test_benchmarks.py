@@ -0,0 +1,50 @@
+import pytest
+from unittest.mock import patch
+from django.test import override_settings
+from videos import benchmarks
+from videos.tasks import analyze_video_task, package_video_task, thumbnail_video_task
+
+
+@pytest.mark.django_db
+def test_benchmark_scenarios_report_timings(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    fixtures = {"tiny": benchmarks.make_fixture(str(tmp_path / "fixtures"), "tiny", 160, 90, 2)}
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+
+    results = benchmarks.bench_serve(fixtures, 2, str(work_dir))
+    results.update(benchmarks.bench_trim(fixtures, 1, str(work_dir)))
+
+    full = results["serve/full/tiny"]
+    assert len(full["runs"]) == 2 and full["min"] <= full["median"]
+    assert full["throughput"] > 0
+    assert set(results) >= {"trim/keyframe/tiny", "trim/accurate/tiny", "trim/reencode/tiny"}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_upload_scenarios_send_nothing_to_the_broker(settings, tmp_path):
+    # As configured by default, with every upload job on; committed uploads
+    # would enqueue them.
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    settings.VIDEO_PACKAGE_ON_UPLOAD = settings.VIDEO_THUMBNAILS_ON_UPLOAD = settings.VIDEO_ANALYZE_ON_UPLOAD = True
+    fixtures = {"tiny": benchmarks.make_fixture(str(tmp_path / "fixtures"), "tiny", 160, 90, 2)}
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    tasks = (analyze_video_task, package_video_task, thumbnail_video_task)
+
+    with override_settings(**benchmarks.OFFLINE_SETTINGS), \
+            patch.object(tasks[0], "delay") as analyze, patch.object(tasks[1], "delay") as package, \
+            patch.object(tasks[2], "delay") as thumbnails:
+        results = benchmarks.bench_chunked_upload(fixtures, 1, str(work_dir))
+
+    assert len(results["chunked_upload/tiny"]["runs"]) == 1
+    for delay in (analyze, package, thumbnails):
+        delay.assert_not_called()
+
+
+def test_compare_flags_slower_scenarios():
+    baseline = {"scenarios": {"trim/a": {"median": 1.0}, "trim/b": {"median": 1.0}, "gone": {"median": 1.0}}}
+    current = {"scenarios": {"trim/a": {"median": 1.05}, "trim/b": {"median": 1.5}, "new": {"median": 1.0}}}
+
+    rows = {name: regressed for name, _, _, _, regressed in benchmarks.compare(baseline, current, threshold=0.1)}
+    assert rows == {"trim/a": False, "trim/b": True}
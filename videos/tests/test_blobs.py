@@ -0,0 +1,103 @@
+import os
+import time
+import pytest
+from unittest.mock import patch
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos.blobs import collect_garbage, incoming_path, ingest
+from videos.models import Artifact, Blob, Video
+from videos.tasks import merge_videos_task, trim_video_task
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+def stored_video(path, name="clip.mp4"):
+    blob = ingest(path)
+    return Video.objects.create(name=name, duration=4, size=blob.size, file=blob.name, blob=blob)
+
+
+@pytest.mark.django_db
+def test_repeated_trim_is_answered_from_the_artifact(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    video = stored_video(make_clip(duration=4))
+    client = APIClient()
+    setup_user(client)
+    request = {"start_time": 1, "end_time": 3, "mode": "keyframe"}
+
+    with patch.object(trim_video_task, "apply_async") as apply_async:
+        response = client.post(f"/api/videos/{video.id}/trim/", request, format="json")
+    assert response.status_code == 202
+    result = trim_video_task(*apply_async.call_args.args[0])
+    assert result["status"] == "success", result
+    artifact = Artifact.objects.get()
+    assert result["sha256"] == artifact.blob_id
+    assert result["output_path"] == os.path.join(settings.MEDIA_ROOT, artifact.blob.name)
+    assert artifact.blob.refcount == 1
+
+    with patch.object(trim_video_task, "apply_async") as apply_async:
+        response = client.post(f"/api/videos/{video.id}/trim/", request, format="json")
+    apply_async.assert_not_called()
+    assert response.status_code == 200
+    assert response.data["cached"] is True
+    assert response.data["output_path"] == result["output_path"]
+    assert response.data["start_time"] == result["start_time"]
+
+    # Other parameters are a different artifact.
+    with patch.object(trim_video_task, "apply_async") as apply_async:
+        response = client.post(f"/api/videos/{video.id}/trim/", dict(request, end_time=2), format="json")
+    assert response.status_code == 202
+
+
+@pytest.mark.django_db
+def test_merge_artifact_is_keyed_by_source_order(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    first = stored_video(make_clip("a.mp4", duration=2))
+    second = stored_video(make_clip("b.mp4", duration=3))
+    client = APIClient()
+    setup_user(client)
+
+    with patch.object(merge_videos_task, "apply_async") as apply_async:
+        client.post("/api/videos/merge/", {"video_ids": [str(first.id), str(second.id)]}, format="json")
+    file_paths, output_path, artifact_key, profile = apply_async.call_args.args[0]
+    assert file_paths == [first.file.name, second.file.name]
+    with patch.object(merge_videos_task, "update_state"), patch("videos.tasks.current_task"):
+        merge_videos_task(file_paths, output_path, artifact_key, profile)
+
+    response = client.post("/api/videos/merge/", {"video_ids": [str(first.id), str(second.id)]}, format="json")
+    assert response.status_code == 200 and response.data["cached"] is True
+    with patch.object(merge_videos_task, "apply_async") as apply_async:
+        response = client.post("/api/videos/merge/", {"video_ids": [str(second.id), str(first.id)]}, format="json")
+    assert response.status_code == 202
+
+
+@pytest.mark.django_db
+def test_garbage_collection(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    video = stored_video(make_clip(duration=4))
+    blob_path = video.file.path
+    result = trim_video_task(video.file.path, 1, 3, incoming_path(".mp4"), "keyframe", [[video.blob_id], "trim", {}])
+    derived = Blob.objects.get(sha256=result["sha256"])
+    stray = incoming_path(".mp4")
+    os.utime(stray, (time.time() - 7200, time.time() - 7200))
+
+    # Referenced blobs survive; the abandoned upload does not.
+    assert collect_garbage(grace=3600)[0] == 1
+    assert os.path.exists(blob_path) and not os.path.exists(stray)
+
+    video.delete()
+    assert Blob.objects.get(sha256=video.blob_id).refcount == 0
+    assert collect_garbage(grace=3600) == (0, 0)  # still within the grace period
+
+    # The source goes, then the trim made from it, then the trim's blob.
+    removed, freed = collect_garbage(grace=0)
+    assert removed == 2 and freed > 0
+    assert not Blob.objects.exists() and not Artifact.objects.exists()
+    assert not os.path.exists(blob_path) and not os.path.exists(result["output_path"])
+    assert derived.refcount == 1
@@ -0,0 +1,115 @@
+import os
+import subprocess
+import sys
+import pytest
+from rest_framework.test import APIClient
+from django.conf import settings as django_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.authtoken.models import Token
+from videos.models import ChunkedUpload, Video
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    from django.contrib.auth.models import User
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+def send_chunk(client, data, chunk_number, total_chunks, size, **extra):
+    chunk = data[(chunk_number - 1) * size:chunk_number * size]
+    return client.post("/api/videos/chunked_upload/", {
+        "chunk_number": chunk_number,
+        "total_chunks": total_chunks,
+        "file_id": "upload-1",
+        "file_name": "clip.mp4",
+        "chunk": SimpleUploadedFile("chunk", chunk),
+        **extra,
+    })
+
+
+@pytest.mark.django_db
+def test_chunks_out_of_order_with_resume(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    (tmp_path / "media" / "videos" / "uploads").mkdir(parents=True)
+    client = APIClient()
+    setup_user(client)
+
+    with open(make_clip(duration=3), "rb") as f:
+        data = f.read()
+    chunk_size = 8 * 1024
+    total_chunks = (len(data) + chunk_size - 1) // chunk_size
+    assert total_chunks > 3
+
+    # The last chunk first, so the chunk size has to be declared.
+    response = send_chunk(client, data, total_chunks, total_chunks, chunk_size)
+    assert response.status_code == 400
+    response = send_chunk(client, data, total_chunks, total_chunks, chunk_size,
+                          chunk_size=chunk_size, total_size=len(data))
+    assert response.status_code == 200, response.data
+    for chunk_number in range(total_chunks - 1, 2, -1):
+        response = send_chunk(client, data, chunk_number, total_chunks, chunk_size)
+        assert response.status_code == 200, response.data
+
+    response = client.get("/api/videos/chunked_upload/upload-1/status/")
+    assert response.status_code == 200
+    assert response.data["missing_chunks"] == [1, 2]
+    assert response.data["status"] == ChunkedUpload.UPLOADING
+
+    for chunk_number in (2, 1):
+        response = send_chunk(client, data, chunk_number, total_chunks, chunk_size)
+    assert response.status_code == 201, response.data
+
+    video = Video.objects.get()
+    assert video.size == len(data)
+    assert video.duration == 3
+    with open(video.file.path, "rb") as f:
+        assert f.read() == data
+
+    # A retried chunk after completion does not create another video.
+    response = send_chunk(client, data, 1, total_chunks, chunk_size)
+    assert response.status_code == 201
+    assert Video.objects.count() == 1
+
+
+# Run in a process of its own, against a SQLite file in WAL mode: the test
+# database is in memory, where writers never wait on each other.
+CONCURRENT_CHUNKS = """
+import django, threading
+django.setup()
+from django.core.management import call_command
+from django.db import connection
+from videos.models import ChunkedUpload
+
+call_command("migrate", verbosity=0)
+upload = ChunkedUpload.objects.create(file_id="upload-1", file_name="clip.mp4", total_chunks=64, chunk_size=1)
+errors = []
+
+def record(chunk_number):
+    try:
+        upload.record_chunks([chunk_number])
+    except Exception as e:
+        errors.append(e)
+    finally:
+        connection.close()
+
+threads = [threading.Thread(target=record, args=(number,)) for number in range(1, 65)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+upload = ChunkedUpload.objects.get(pk=upload.pk)
+print(len(errors), upload.received_count(), upload.claim_completion())
+"""
+
+
+def test_concurrent_chunks_on_sqlite(tmp_path):
+    env = dict(os.environ, DATABASE_ENGINE="sqlite", DATABASE_NAME=str(tmp_path / "db.sqlite3"))
+    result = subprocess.run([sys.executable, "-c", CONCURRENT_CHUNKS], env=env, cwd=django_settings.BASE_DIR,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    # No chunk fails with "database is locked" or is lost, and the full
+    # upload is claimed.
+    assert result.stdout.split() == ["0", "64", "True"]
@@ -1,5 +1,8 @@
 import pytest
 import os
+import time
+import uuid
+from unittest.mock import patch
 from rest_framework.test import APIClient
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
@@ -8,6 +11,9 @@ from django.utils.timezone import now
 from videos.models import Video
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from videos.utils import generate_expirable_link
 
 def setup_user(client):
     """Setup a test user and authenticate the client."""
@@ -82,4 +88,73 @@ def test_serve_video_with_valid_token():
     assert response.status_code == 200
     assert response["Content-Type"].startswith("video/")
     assert response.has_header("Content-Disposition")
-    print(f"Response headers: {response}")
\ No newline at end of file
+    print(f"Response headers: {response}")
+
+def served_link(settings, tmp_path, name="clip.mp4"):
+    settings.MEDIA_ROOT = str(tmp_path)
+    (tmp_path / name).write_bytes(b"video bytes")
+    return Video.objects.create(name=name, duration=1, size=11, file=name)
+
+
+def get(client, link):
+    return client.get(link[link.index("/api/"):])
+
+
+@pytest.mark.django_db
+def test_links_are_stateless_and_honour_their_expiry(settings, tmp_path):
+    video = served_link(settings, tmp_path)
+    client = APIClient()
+    setup_user(client)
+    link = generate_expirable_link(video, 2 * 3600)
+    assert b"".join(get(client, link).streaming_content) == b"video bytes"
+
+    # Past the hour the old view allowed, and without reading the video.
+    with patch("videos.links.time.time", return_value=time.time() + 3700), CaptureQueriesContext(connection) as queries:
+        assert get(client, link).status_code == 200
+    assert not any("videos_video" in query["sql"] for query in queries.captured_queries)
+    with patch("videos.links.time.time", return_value=time.time() + 2 * 3600 + 10):
+        assert get(client, link).status_code == 404
+
+
+@pytest.mark.django_db
+def test_signing_keys_rotate_and_links_can_be_revoked(settings, tmp_path):
+    video = served_link(settings, tmp_path)
+    client = APIClient()
+    setup_user(client)
+    settings.VIDEO_LINK_SIGNING_KEYS = ["old-key"]
+    link = generate_expirable_link(video, 60)
+
+    settings.VIDEO_LINK_SIGNING_KEYS = ["new-key", "old-key"]
+    assert get(client, link).status_code == 200
+    settings.VIDEO_LINK_SIGNING_KEYS = ["new-key"]
+    assert get(client, link).status_code == 404
+
+    link = generate_expirable_link(video, 60)
+    assert client.post(f"/api/videos/{video.id}/share/revoke/").status_code == 200
+    assert get(client, link).status_code == 404
+    assert get(client, generate_expirable_link(video, 60)).status_code == 200
+
+
+@pytest.mark.django_db
+def test_batch_links(settings, tmp_path):
+    first = served_link(settings, tmp_path, "a.mp4")
+    second = served_link(settings, tmp_path, "b.mp4")
+    missing = str(uuid.uuid4())
+    client = APIClient()
+    setup_user(client)
+
+    response = client.post(
+        "/api/videos/share/", {"video_ids": [str(first.id), str(second.id), missing], "expiry_time": 600}, format="json",
+    )
+
+    assert response.status_code == 200
+    assert set(response.data["links"]) == {str(first.id), str(second.id)}
+    assert response.data["missing"] == [missing]
+    assert get(client, response.data["links"][str(second.id)])["Content-Disposition"] == 'inline; filename="b.mp4"'
+
+    settings.VIDEO_LINK_BATCH_SIZE = 1
+    assert client.post("/api/videos/share/", {"video_ids": [missing, missing]}, format="json").status_code == 400
+    assert client.post("/api/videos/share/", {"video_ids": ["x"]}, format="json").status_code == 400
+    assert client.post(
+        "/api/videos/share/", {"video_ids": [missing], "expiry_time": 0}, format="json",
+    ).status_code == 400
@@ -0,0 +1,130 @@
+import pytest
+from unittest.mock import patch
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos import ffmpeg, graph
+from videos.blobs import ingest
+from videos.models import Job, Video
+from videos.probe import get_media_info
+from videos.tasks import graph_task, merge_videos_task, trim_video_task
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+def run_eagerly(task):
+    """Run a task in-process when a view sends it."""
+    def apply_async(args, task_id, **options):
+        return task.apply(args, task_id=task_id)
+    return patch.object(task, "apply_async", side_effect=apply_async)
+
+
+def stored_video(path, name):
+    media_info = get_media_info(path)
+    blob = ingest(path)
+    return Video.objects.create(name=name, duration=1, size=blob.size, file=blob.name, blob=blob,
+                                media_info=media_info)
+
+
+@pytest.mark.django_db
+def test_graph_runs_a_chain_and_its_outputs_in_one_pass(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    video = stored_video(make_clip("clip.mp4", duration=6), "clip.mp4")
+    logo = stored_video(make_clip("logo.mp4", duration=1, size="64x64", audio=False), "logo.mp4")
+    client = APIClient()
+    setup_user(client)
+    spec = {
+        "inputs": {"main": str(video.id), "logo": str(logo.id)},
+        "nodes": {
+            "cut": {"op": "trim", "source": "main", "start": 1, "end": 4},
+            "small": {"op": "scale", "source": "cut", "width": 160},
+            "marked": {"op": "watermark", "source": "small", "image": "logo", "width": 32, "opacity": 0.5},
+        },
+        "outputs": [{"node": "marked", "name": "preview.mp4"}, {"node": "cut", "audio": False}],
+    }
+
+    with patch.object(ffmpeg, "run_ffmpeg", wraps=ffmpeg.run_ffmpeg) as run_ffmpeg, run_eagerly(graph_task):
+        response = client.post("/api/videos/graph/", spec, format="json")
+    assert response.status_code == 202, response.data
+    assert run_ffmpeg.call_count == 1
+
+    data = client.get(f"/api/videos/tasks/{response.data['task_id']}/status/").data
+    assert data["status"] == Job.SUCCESS and data["kind"] == "graph"
+    names = {output["id"]: output["name"] for output in data["outputs"]}
+    preview, cut = data["result"]["outputs"]
+    assert (names[preview["video"]], names[cut["video"]]) == ("preview.mp4", "clip_graph_cut.mp4")
+    preview_info, cut_info = ffmpeg.probe(preview["output_path"]), ffmpeg.probe(cut["output_path"])
+    assert (preview_info["width"], preview_info["height"]) == (160, 90)
+    assert preview_info["duration"] == pytest.approx(3, abs=0.1) and preview_info["audio_codec"] == "aac"
+    assert cut_info["width"] == 320 and cut_info["audio_codec"] is None
+
+    # The same outputs, under other names, come from the stored artifacts.
+    spec["outputs"][0]["name"] = "again.mp4"
+    response = client.post("/api/videos/graph/", spec, format="json")
+    assert response.status_code == 200 and response.data["cached"]
+
+    # An ffmpeg failure fails the job with its message.
+    spec["nodes"]["cut"]["end"] = 5
+    with patch.object(ffmpeg, "run_ffmpeg", side_effect=IOError("ffmpeg failed")), run_eagerly(graph_task):
+        response = client.post("/api/videos/graph/", spec, format="json")
+    job = Job.objects.get(id=response.data["task_id"])
+    assert (job.status, job.error) == (Job.FAILURE, "ffmpeg failed")
+
+
+@pytest.mark.django_db
+def test_trim_and_merge_transforms_run_as_presets(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    first = stored_video(make_clip("a.mp4", duration=2), "a.mp4")
+    second = stored_video(make_clip("b.mp4", duration=3, size="640x360", audio=False), "b.mp4")
+    client = APIClient()
+    setup_user(client)
+    transforms = [{"op": "scale", "height": 180}, {"op": "watermark", "image": str(second.id), "width": 32}]
+
+    request = {"start_time": 0.5, "end_time": 1.5, "mode": "keyframe", "transforms": transforms}
+    assert client.post(f"/api/videos/{first.id}/trim/", request, format="json").status_code == 400
+    del request["mode"]
+    with patch.object(ffmpeg, "run_ffmpeg", wraps=ffmpeg.run_ffmpeg) as run_ffmpeg, run_eagerly(trim_video_task):
+        response = client.post(f"/api/videos/{first.id}/trim/", request, format="json")
+    assert response.status_code == 202 and run_ffmpeg.call_count == 1
+    job = Job.objects.get(id=response.data["task_id"])
+    assert job.status == Job.SUCCESS and job.params["transforms"][1]["image"] == second.blob_id
+    info = ffmpeg.probe(job.result["output_path"])
+    assert (info["height"], info["duration"]) == (180, pytest.approx(1, abs=0.1))
+
+    request = {"video_ids": [str(second.id), str(first.id)], "transforms": transforms[:1]}
+    with patch.object(ffmpeg, "run_ffmpeg", wraps=ffmpeg.run_ffmpeg) as run_ffmpeg, run_eagerly(merge_videos_task):
+        response = client.post("/api/videos/merge/", request, format="json")
+    assert response.status_code == 202 and run_ffmpeg.call_count == 1
+    job = Job.objects.get(id=response.data["task_id"])
+    assert job.status == Job.SUCCESS and job.result["engine"] == "graph"
+    info = ffmpeg.probe(job.result["output_path"])
+    # Letterboxed to the first clip's 16:9, with silence under the clip that had no audio.
+    assert (info["width"], info["height"], info["audio_codec"]) == (320, 180, "aac")
+    assert info["duration"] == pytest.approx(5, abs=0.1)
+
+
+def test_malformed_graphs_are_rejected():
+    def error(nodes, outputs=({"node": "b"},)):
+        with pytest.raises(graph.GraphError) as raised:
+            graph.parse({"inputs": {"in": "video"}, "nodes": nodes, "outputs": list(outputs)})
+        return str(raised.value)
+
+    assert "cycle" in error({"a": {"op": "scale", "source": "b", "width": 2},
+                             "b": {"op": "scale", "source": "a", "width": 2}})
+    assert "Not used" in error({"a": {"op": "fps", "source": "in", "fps": 10},
+                                "b": {"op": "fps", "source": "in", "fps": 12}})
+    assert "not an input" in error({"b": {"op": "fps", "source": "missing", "fps": 10}})
+    assert "op of node" in error({"b": {"op": "blur", "source": "in"}})
+    assert "end of node" in error({"b": {"op": "trim", "source": "in", "start": 3, "end": 2}})
+
+    parsed = graph.parse({"inputs": {"in": "video"}, "nodes": {"b": {"op": "trim", "source": "in", "end": 9}},
+                          "outputs": [{"node": "b"}]})
+    info = {"width": 320, "height": 180, "fps": 24, "duration": 6.0, "audio_codec": None, "audio_sample_rate": None}
+    with pytest.raises(graph.GraphError):
+        graph.plan(parsed, {"in": info})
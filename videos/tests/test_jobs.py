@@ -0,0 +1,272 @@
+import json
+import pytest
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos.blobs import ingest
+from videos.jobs import finish_job
+from videos.models import Blob, Job, JobPart, Video
+from videos.probe import get_media_info
+from videos import ffmpeg
+from videos.tasks import batch_trim_task, transcode_task, trim_video_task
+from videos.views import TaskEventsView, task_events_async, task_status_async
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+def run_eagerly(task):
+    """Run a task in-process when a view sends it."""
+    def apply_async(args, task_id, **options):
+        return task.apply(args, task_id=task_id)
+    return patch.object(task, "apply_async", side_effect=apply_async)
+
+
+@pytest.mark.django_db
+def test_trim_job_progress_and_output(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    source = make_clip(duration=6, fps=24)
+    blob = ingest(source)
+    video = Video.objects.create(name="clip.mp4", duration=6, size=blob.size, file=blob.name, blob=blob)
+    video.media_info = get_media_info(video.file.path)
+    video.save()
+    client = APIClient()
+    setup_user(client)
+
+    with run_eagerly(trim_video_task):
+        response = client.post(f"/api/videos/{video.id}/trim/", {"start_time": 2, "end_time": 4}, format="json")
+    task_id = response.data["task_id"]
+
+    response = client.get(f"/api/videos/tasks/{task_id}/status/")
+    assert response.status_code == 200
+    data = response.data
+    assert data["status"] == Job.SUCCESS
+    assert data["kind"] == "trim"
+    assert data["sources"] == [video.id]
+    assert data["total_frames"] == 48 and data["frame"] > 0
+    assert data["percent"] == 100.0
+
+    # The output is registered as a video.
+    output = Video.objects.get(id=data["output"]["id"])
+    assert output.name == "clip_trim_2-4.mp4"
+    assert output.blob_id == data["result"]["sha256"]
+    assert output.duration == 2
+
+    # Re-submitting is answered from the stored output, with the same video.
+    response = client.post(f"/api/videos/{video.id}/trim/", {"start_time": 2, "end_time": 4}, format="json")
+    assert response.status_code == 200
+    assert response.data["video"]["id"] == str(output.id)
+
+
+@pytest.mark.django_db
+def test_batch_trim_cuts_every_range_in_one_job(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    blob = ingest(make_clip(duration=6, fps=24))
+    video = Video.objects.create(name="clip.mp4", duration=6, size=blob.size, file=blob.name, blob=blob)
+    client = APIClient()
+    setup_user(client)
+    ranges = [[3, 5], [0.5, 2], [1, 4]]
+
+    with patch.object(ffmpeg, "run_ffmpeg", wraps=ffmpeg.run_ffmpeg) as run_ffmpeg:
+        with run_eagerly(batch_trim_task):
+            response = client.post(f"/api/videos/{video.id}/trim/batch/", {"ranges": ranges}, format="json")
+    assert response.status_code == 202
+    # One ffmpeg run decodes the source for all the ranges.
+    assert run_ffmpeg.call_count == 1
+
+    data = client.get(f"/api/videos/tasks/{response.data['task_id']}/status/").data
+    assert data["status"] == Job.SUCCESS and data["kind"] == "batch_trim"
+    names = {output["id"]: output["name"] for output in data["outputs"]}
+    outputs = data["result"]["outputs"]
+    assert [names[output["video"]] for output in outputs] == ["clip_trim_3-5.mp4", "clip_trim_0.5-2.mp4", "clip_trim_1-4.mp4"]
+    for (start_time, end_time), output in zip(ranges, outputs):
+        assert ffmpeg.probe(output["output_path"])["duration"] == pytest.approx(end_time - start_time, abs=0.05)
+
+    # Each range is stored like a single re-encoding trim of it.
+    response = client.post(f"/api/videos/{video.id}/trim/", {"start_time": 1, "end_time": 4, "mode": "reencode"},
+                           format="json")
+    assert response.status_code == 200 and response.data["video"]["id"] == outputs[2]["video"]
+    response = client.post(f"/api/videos/{video.id}/trim/batch/", {"ranges": ranges[:2]}, format="json")
+    assert response.status_code == 200 and response.data["cached"]
+
+    assert client.post(f"/api/videos/{video.id}/trim/batch/", {"ranges": [[2, 1]]}, format="json").status_code == 400
+    assert client.post(f"/api/videos/{video.id}/trim/batch/", {"ranges": [["nan", 1]]}, format="json").status_code == 400
+    assert client.post(f"/api/videos/{video.id}/trim/batch/", {"ranges": 3}, format="json").status_code == 400
+
+    # An ffmpeg failure is the task's error result, like a single trim's.
+    with patch.object(ffmpeg, "run_ffmpeg", side_effect=IOError("ffmpeg failed")):
+        result = batch_trim_task(blob.name, [[0, 1]], [str(tmp_path / "out.mp4")])
+    assert result == {"status": "error", "error": "ffmpeg failed"}
+
+
+@pytest.mark.django_db
+def test_job_outputs_are_registered_together(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    first, second = ingest(make_clip("a.mp4", duration=2)), ingest(make_clip("b.mp4", duration=3))
+    job = Job.objects.create(kind="graph", output_name="clip_graph.mp4")
+    outputs = [
+        {"node": node, "output_path": str(tmp_path / blob.name), "sha256": blob.sha256}
+        for node, blob in (("a", first), ("b", second), ("again", first))
+    ]
+
+    finish_job(job.id, {"status": "success", "outputs": outputs})
+    job.refresh_from_db()
+    videos = [Video.objects.get(id=output["video"]) for output in job.result["outputs"]]
+    assert [video.name for video in videos] == ["clip_graph_a.mp4", "clip_graph_b.mp4", "clip_graph_a.mp4"]
+    assert videos[0] == videos[2] and job.outputs.count() == 2
+    # Inserted in bulk, the Videos still hold their blobs.
+    assert Blob.objects.get(sha256=first.sha256).refcount == 1
+    assert Blob.objects.get(sha256=second.sha256).refcount == 1
+
+    finish_job(job.id, {"status": "error", "error": "delivered again"})
+    job.refresh_from_db()
+    assert job.status == Job.SUCCESS and Video.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_failed_job_and_waiting(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    video = Video.objects.create(name="clip.mp4", duration=6, size=1, file=make_clip(duration=6))
+    client = APIClient()
+    setup_user(client)
+
+    with run_eagerly(trim_video_task):
+        response = client.post(f"/api/videos/{video.id}/trim/", {"start_time": 4, "end_time": 60}, format="json")
+    job = Job.objects.get(id=response.data["task_id"])
+    assert job.status == Job.FAILURE
+    assert job.error == "Invalid start or end time."
+    assert job.output is None
+
+    # A finished job is returned at once, even when waiting.
+    response = client.get(f"/api/videos/tasks/{job.id}/status/", {"wait": 30, "version": job.version})
+    assert response.data["status"] == Job.FAILURE
+
+    # An unchanged job is returned when the wait runs out.
+    queued = Job.objects.create(kind="merge", output_name="merged.mp4")
+    response = client.get(f"/api/videos/tasks/{queued.id}/status/", {"wait": 0.3, "version": queued.version})
+    assert response.data["status"] == Job.QUEUED
+
+    response = client.get(f"/api/videos/tasks/{job.id}/events/")
+    assert response["Content-Type"] == "text/event-stream"
+    event = b"".join(response.streaming_content).decode()
+    assert event.startswith(f"id: {job.version}\nevent: done\ndata: ")
+    assert json.loads(event.split("data: ", 1)[1])["error"] == "Invalid start or end time."
+
+    assert client.get("/api/videos/tasks/00000000-0000-0000-0000-000000000000/status/").status_code == 404
+
+
+async def read_async(view, url, task_id, **headers):
+    response = await view(AsyncRequestFactory().get(url, headers=headers), task_id=task_id)
+    if not response.streaming:
+        return response, response.content.decode()
+    return response, b"".join([chunk async for chunk in response.streaming_content]).decode()
+
+
+@pytest.mark.django_db
+def test_task_waits_are_bounded(settings, monkeypatch):
+    client = APIClient()
+    user = setup_user(client)
+    queued = Job.objects.create(kind="merge", output_name="merged.mp4")
+    url = f"/api/videos/tasks/{queued.id}/events/"
+
+    # A wait that could never run out is refused.
+    for wait in ("nan", "inf", "-1"):
+        response = client.get(f"/api/videos/tasks/{queued.id}/status/?wait={wait}&version={queued.version}")
+        assert response.status_code == 400
+
+    # A stream outlasting its limit tells the client to reconnect, and a
+    # reconnect carrying the last event id only sends what changed since.
+    monkeypatch.setattr(TaskEventsView, "MAX_DURATION", 0.3)
+    events = b"".join(client.get(url).streaming_content).decode()
+    assert events.startswith(f"id: {queued.version}\nevent: progress\n")
+    assert events.endswith("event: reconnect\ndata: {}\n\n")
+    events = b"".join(client.get(url, HTTP_LAST_EVENT_ID=str(queued.version)).streaming_content).decode()
+    assert events.startswith("retry: ")
+
+    # A job deleted while it is watched ends the stream.
+    monkeypatch.setattr(TaskEventsView, "MAX_DURATION", 30)
+    stream = client.get(url).streaming_content
+    assert next(stream).startswith(b"id: ")
+    queued.delete()
+    assert list(stream) == []
+
+    # Under ASGI the same wait on the event loop.
+    job = Job.objects.create(kind="merge", output_name="merged.mp4")
+    auth = f"Token {user.auth_token.key}"
+    monkeypatch.setattr(TaskEventsView, "ASYNC_MAX_DURATION", 0.3)
+    url = f"/api/videos/tasks/{job.id}/"
+    response, _ = async_to_sync(read_async)(task_status_async, url + "status/", job.id)
+    assert response.status_code == 401
+    response, body = async_to_sync(read_async)(
+        task_status_async, url + "status/?wait=0.3&version=0", job.id, Authorization=auth,
+    )
+    assert response.status_code == 200 and json.loads(body)["status"] == Job.QUEUED
+    response, _ = async_to_sync(read_async)(
+        task_status_async, url + "status/?wait=nan&version=0", job.id, Authorization=auth,
+    )
+    assert response.status_code == 400
+    response, events = async_to_sync(read_async)(task_events_async, url + "events/", job.id, Authorization=auth)
+    assert response.is_async and events.endswith("event: reconnect\ndata: {}\n\n")
+    Job.objects.filter(id=job.id).update(status=Job.SUCCESS, version=1)
+    response, events = async_to_sync(read_async)(task_events_async, url + "events/", job.id, Authorization=auth)
+    assert events.startswith("id: 1\nevent: done\n")
+
+
+@pytest.mark.django_db
+def test_parallel_trim_is_split_encoded_and_stitched(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.VIDEO_TRANSCODE_SEGMENT_SECONDS = 2
+    video = Video.objects.create(name="clip.mp4", duration=6, size=1, file=make_clip(duration=6, gop=48))
+    client = APIClient()
+    setup_user(client)
+
+    with run_eagerly(transcode_task):
+        response = client.post(
+            f"/api/videos/{video.id}/trim/", {"start_time": 0.5, "end_time": 5.5, "mode": "parallel"}, format="json",
+        )
+    job = Job.objects.get(id=response.data["task_id"])
+    assert job.status == Job.SUCCESS, job.error
+    # Cut at keyframes (every 2s), into segments of at least 2s.
+    assert [(part.start, part.end) for part in job.parts.all()] == [(0.5, 4.0), (4.0, 5.5)]
+    assert job.result["segments"] == 2
+    info = ffmpeg.probe(job.result["output_path"])
+    assert abs(info["duration"] - 5.0) < 0.1
+    assert info["audio_codec"] == "aac"
+    assert job.output.name == "clip_trim_0.5-5.5.mp4"
+
+
+@pytest.mark.django_db
+def test_parallel_job_resumes_from_encoded_parts(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.VIDEO_TRANSCODE_SEGMENT_SECONDS = 2
+    source = make_clip(duration=6, gop=48)
+    job = Job.objects.create(kind="trim", output_name="clip_trim.mp4")
+    args = ([(source, 0, 6)], str(tmp_path / "out.mp4"))
+    encode_part = ffmpeg.encode_part
+
+    def crash_on_last_part(file_path, start_time, end_time, *args):
+        if start_time == 4.0:
+            raise IOError("worker lost")
+        return encode_part(file_path, start_time, end_time, *args)
+
+    with patch.object(ffmpeg, "encode_part", side_effect=crash_on_last_part):
+        transcode_task.apply(args, task_id=str(job.id))
+    job.refresh_from_db()
+    assert job.status == Job.FAILURE
+    assert job.error == "Segment 2: worker lost"
+    assert [part.status for part in job.parts.all()] == [JobPart.DONE, JobPart.DONE, JobPart.PENDING]
+
+    with patch.object(ffmpeg, "encode_part", side_effect=encode_part) as encoded:
+        transcode_task.apply(args, task_id=str(job.id))
+    job.refresh_from_db()
+    assert job.status == Job.SUCCESS
+    assert encoded.call_count == 1
+    assert abs(ffmpeg.probe(job.result["output_path"])["duration"] - 6.0) < 0.1
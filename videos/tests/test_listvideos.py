@@ -2,6 +2,8 @@ import pytest
 from rest_framework.test import APIClient
 from videos.models import Video
 from rest_framework.authtoken.models import Token
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 
 def setup_user(client):
@@ -42,6 +44,56 @@ def test_list_videos():
 
     # Assertions
     assert response.status_code == 200, f"Unexpected response: {response.data}"
-    assert len(response.data) == 2
-    assert response.data[0]["name"] == "video1.mp4"
-    assert response.data[1]["name"] == "video2.mp4"
+    assert len(response.data["results"]) == 2
+    assert response.data["results"][0]["name"] == "video1.mp4"
+    assert response.data["results"][1]["name"] == "video2.mp4"
+    assert response.data["next_cursor"] is None
+
+
+@pytest.mark.django_db
+def test_list_videos_cursor_pagination_and_filters():
+    client = APIClient()
+    setup_user(client)
+
+    for i in range(5):
+        Video.objects.create(name=f"clip{i}.mp4", duration=10 * i, size=100 * i, file=f"videos/uploads/clip{i}.mp4")
+    Video.objects.create(name="other.mp4", duration=5, size=5, file="videos/uploads/other.mp4")
+
+    names = []
+    cursor = ""
+    while True:
+        response = client.get("/api/videos/list/", {"limit": 2, "name_prefix": "clip", "cursor": cursor})
+        assert response.status_code == 200
+        names += [video["name"] for video in response.data["results"]]
+        cursor = response.data["next_cursor"]
+        if not cursor:
+            break
+    assert names == [f"clip{i}.mp4" for i in range(5)]
+
+    response = client.get("/api/videos/list/", {"min_duration": 20, "max_size": 300, "fields": "id,name"})
+    assert [video["name"] for video in response.data["results"]] == ["clip2.mp4", "clip3.mp4"]
+    assert set(response.data["results"][0]) == {"id", "name"}
+
+    assert client.get("/api/videos/list/", {"fields": "secret"}).status_code == 400
+    assert client.get("/api/videos/list/", {"cursor": "garbage"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_list_videos_etag_is_invalidated_by_changes():
+    client = APIClient()
+    setup_user(client)
+    video = Video.objects.create(name="video1.mp4", duration=10, size=500, file="videos/uploads/video1.mp4")
+
+    response = client.get("/api/videos/list/")
+    etag = response["ETag"]
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get("/api/videos/list/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert not [q for q in queries.captured_queries if "videos_video" in q["sql"]]
+
+    video.name = "renamed.mp4"
+    video.save()
+    response = client.get("/api/videos/list/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.data["results"][0]["name"] == "renamed.mp4"
@@ -1,8 +1,13 @@
 import pytest
 import os
+import subprocess
+import sys
+from unittest.mock import patch
 from rest_framework.test import APIClient
 from videos.models import Video
 from rest_framework.authtoken.models import Token
+from videos.ffmpeg import probe
+from videos.tasks import merge_videos_task
 
 
 def setup_user(client):
@@ -46,4 +51,54 @@ def test_merge_videos_functional():
 
     # Assert the API response
     assert response.status_code == 202, f"Unexpected response: {response.data}"
-    assert "task_id" in response.data
\ No newline at end of file
+    assert "task_id" in response.data
+
+@pytest.mark.django_db
+def test_merge_compatible_inputs_are_remuxed(make_clip, tmp_path):
+    first = make_clip("first.mp4", duration=2)
+    second = make_clip("second.mp4", duration=3)
+    output_path = str(tmp_path / "merged.mp4")
+
+    with patch.object(merge_videos_task, "update_state"):
+        result = merge_videos_task([first, second, first], output_path)
+
+    assert result["normalized"] == 0
+    assert abs(probe(output_path)["duration"] - 7.0) < 0.25
+
+
+@pytest.mark.django_db
+def test_merge_normalizes_only_mismatched_inputs(make_clip, tmp_path):
+    first = make_clip("first.mp4", duration=2)
+    second = make_clip("second.mp4", duration=2)
+    odd = make_clip("odd.mp4", duration=2, size="160x120", fps=30, audio=False)
+    output_path = str(tmp_path / "merged.mp4")
+
+    with patch.object(merge_videos_task, "update_state"):
+        result = merge_videos_task([first, odd, second, odd], output_path)
+
+    info = probe(output_path)
+    assert result["normalized"] == 1
+    assert (info["width"], info["height"]) == (320, 180)
+    assert info["audio_codec"] == "aac"
+    assert abs(info["duration"] - 8.0) < 0.25
+
+
+@pytest.mark.django_db
+def test_merge_streams_mostly_mismatched_inputs_through_one_encoder(make_clip, tmp_path):
+    first = make_clip("first.mp4", duration=2)
+    small = make_clip("small.mp4", duration=2, size="160x120")
+    large = make_clip("large.mp4", duration=2, size="640x360")
+    output_path = str(tmp_path / "merged.mp4")
+    # An earlier child of the worker, far larger than ffmpeg, does not count.
+    subprocess.run([sys.executable, "-c", "data = b'x' * (512 * 1024 * 1024)"], check=True)
+
+    with patch.object(merge_videos_task, "update_state"):
+        result = merge_videos_task([first, small, large], output_path)
+
+    info = probe(output_path)
+    assert result["engine"] == "encode"
+    assert (info["width"], info["height"]) == (320, 180)
+    assert info["audio_codec"] == "aac"
+    assert abs(info["duration"] - 6.0) < 0.25
+    assert result["peak_rss"]["worker"] > 0
+    assert 0 < result["peak_rss"]["ffmpeg"] < 512 * 1024 * 1024
@@ -0,0 +1,91 @@
+import os
+import time
+import pytest
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos.blobs import ingest
+from videos.models import Video
+from videos.tasks import collect_blobs_task, trim_video_task
+from videos.tests.test_jobs import run_eagerly
+from videos.utils import generate_expirable_link
+
+
+def setup_user(client, is_staff=False):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass", is_staff=is_staff)
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+def scrape(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    return response.content.decode().splitlines()
+
+
+@pytest.mark.django_db
+def test_metrics_count_served_bytes_and_view_stages(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    os.makedirs(tmp_path / "videos")
+    data = b"x" * 5000
+    with open(tmp_path / "videos" / "clip.mp4", "wb") as f:
+        f.write(data)
+    video = Video.objects.create(name="clip.mp4", duration=1, size=len(data), file="videos/clip.mp4")
+    link = generate_expirable_link(video, 60)
+    client = APIClient()
+    setup_user(client)
+
+    assert b"".join(client.get(link[link.index("/api/"):]).streaming_content) == data
+    client.get(link[link.index("/api/"):], HTTP_RANGE="bytes=0-99")
+
+    lines = scrape(client)
+    assert 'video_bytes_out_total{operation="serve_video"} 5100' in lines
+    for stage, count in (("auth", 2), ("db", 2), ("request", 2), ("file_open", 3)):
+        assert f'video_stage_seconds_count{{operation="serve_video",stage="{stage}"}} {count}' in lines
+    assert "# TYPE video_stage_seconds histogram" in lines
+
+    settings.VIDEO_METRICS_TOKEN = "secret"
+    assert client.get("/metrics").status_code == 403
+    assert APIClient().get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code == 200
+
+
+@pytest.mark.django_db
+def test_task_stages_and_cprofile_capture(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.VIDEO_CPROFILE_DIR = str(tmp_path / "profiles")
+    blob = ingest(make_clip(duration=4))
+    video = Video.objects.create(name="clip.mp4", duration=4, size=blob.size, file=blob.name, blob=blob)
+    client = APIClient()
+    user = setup_user(client)
+    trim = {"start_time": 1, "end_time": 3, "cprofile": True}
+
+    assert client.post(f"/api/videos/{video.id}/trim/", trim, format="json").status_code == 403
+
+    user.is_staff = True
+    user.save()
+    with run_eagerly(trim_video_task):
+        response = client.post(f"/api/videos/{video.id}/trim/", trim, format="json")
+    assert response.status_code == 202
+    assert os.listdir(settings.VIDEO_CPROFILE_DIR) == [f"trim_video_task-{response.data['task_id']}.prof"]
+
+    lines = scrape(client)
+    # The source is probed, then the output when it is registered.
+    for stage, count in (("probe", 2), ("remux", 1), ("io", 1)):
+        assert f'video_stage_seconds_count{{operation="trim_video_task",stage="{stage}"}} {count}' in lines
+    assert 'video_task_seconds_count{task="videos.tasks.trim_video_task",state="SUCCESS"} 1' in lines
+
+
+@pytest.mark.django_db
+def test_queue_wait_is_measured_from_the_send_time(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+
+    collect_blobs_task.apply(headers={"sent_at": time.time() - 3})
+
+    lines = scrape(APIClient())
+    labels = 'task="videos.tasks.collect_blobs_task"'
+    assert f"video_queue_wait_seconds_count{{{labels}}} 1" in lines
+    assert f'video_queue_wait_seconds_bucket{{{labels},le="2.5"}} 0' in lines
+    assert f'video_queue_wait_seconds_bucket{{{labels},le="5"}} 1' in lines
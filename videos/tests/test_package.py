@@ -0,0 +1,58 @@
+import pytest
+from unittest.mock import patch
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos.models import Rendition, Video, VideoPackage
+from videos.tasks import package_video_task
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+@pytest.mark.django_db
+def test_package_and_stream_video(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.VIDEO_ABR_SEGMENT_DURATION = 2
+    settings.VIDEO_ABR_LADDER = [
+        {"name": "360p", "height": 360, "bitrate": 800000},
+        {"name": "180p", "height": 180, "bitrate": 300000},
+        {"name": "120p", "height": 120, "bitrate": 150000},
+    ]
+    source = make_clip(duration=5)
+    video = Video.objects.create(name="clip.mp4", duration=5, size=1, file=source)
+
+    with patch.object(package_video_task, "update_state"):
+        result = package_video_task(str(video.id))
+
+    assert result["status"] == "success", result
+    assert result["renditions"] == ["180p", "120p", "audio"]
+    package = VideoPackage.objects.get(video=video)
+    assert package.status == VideoPackage.READY
+    rendition = package.renditions.get(name="120p")
+    assert (rendition.width, rendition.height) == (214, 120)
+    assert [segment.duration for segment in rendition.segments.all()][:2] == [2.0, 2.0]
+    assert package.renditions.get(kind=Rendition.AUDIO).segments.exists()
+
+    client = APIClient()
+    setup_user(client)
+    response = client.post(f"/api/videos/{video.id}/share/", {"expiry_time": 60})
+    hls = response.data["hls"]
+    assert response.data["dash"].endswith("/manifest.mpd")
+
+    # Players fetch playlists and segments with the signed path alone.
+    player = APIClient()
+    base = hls[hls.index("/api/"):hls.rindex("/")]
+    response = player.get(f"{base}/master.m3u8")
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/vnd.apple.mpegurl"
+    assert b"media_0.m3u8" in b"".join(response.streaming_content)
+    response = player.get(f"{base}/{rendition.segments.first().uri}", HTTP_RANGE="bytes=0-99")
+    assert response.status_code == 206
+    assert player.get(f"{base}/../../../clip.mp4").status_code == 404
+    assert player.get(f"/api/videos/stream/forged/master.m3u8").status_code == 404
@@ -0,0 +1,71 @@
+import os
+import shutil
+import pytest
+from unittest.mock import patch
+from videos import ffmpeg
+from videos.models import MediaInfo
+from videos.blobs import file_sha256
+from videos.probe import HASH_SAMPLE_SIZE, content_hash, get_media_info, mp4_keyframe_times
+
+
+@pytest.mark.django_db
+def test_media_info_is_probed_once(make_clip):
+    path = make_clip(duration=4, gop=24)
+
+    with patch("videos.probe.ffmpeg.probe", wraps=ffmpeg.probe) as probe:
+        first = get_media_info(path)
+        second = get_media_info(path)
+
+    assert probe.call_count == 1
+    assert first.pk == second.pk
+    assert (first.width, first.height, first.fps) == (320, 180, 24.0)
+    assert first.video_codec == "h264"
+    assert first.audio_codec == "aac"
+    assert first.keyframes == [0.0, 1.0, 2.0, 3.0]
+
+
+@pytest.mark.django_db
+def test_copied_blob_reuses_metadata(make_clip, tmp_path):
+    path = make_clip(duration=2)
+    get_media_info(path, file_sha256(path))
+    copy_path = str(tmp_path / "copy.mp4")
+    shutil.copyfile(path, copy_path)
+    os.utime(copy_path, (1, 1))
+
+    with patch("videos.probe.ffmpeg.probe") as probe:
+        info = get_media_info(copy_path, file_sha256(copy_path))
+
+    probe.assert_not_called()
+    assert info.mtime == 1
+    assert MediaInfo.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_sampled_hash_alone_does_not_share_metadata(make_clip, tmp_path):
+    # Same size, first and last megabyte: only the middle differs.
+    path = str(tmp_path / "a.bin")
+    other_path = str(tmp_path / "b.bin")
+    middle = 3 * HASH_SAMPLE_SIZE
+    with open(make_clip(duration=1), "rb") as f:
+        clip = f.read()
+    data = bytearray(clip + b"\0" * middle)
+    with open(path, "wb") as f:
+        f.write(data)
+    data[len(clip) + HASH_SAMPLE_SIZE] = 1
+    with open(other_path, "wb") as f:
+        f.write(data)
+    os.utime(other_path, (1, 1))
+    assert content_hash(path) == content_hash(other_path)
+
+    first = get_media_info(path, file_sha256(path))
+    with patch("videos.probe.ffmpeg.probe", wraps=ffmpeg.probe) as probe:
+        second = get_media_info(other_path, file_sha256(other_path))
+
+    assert probe.call_count == 1
+    assert first.content_key() != second.content_key()
+
+
+def test_mp4_keyframes_match_decoded_keyframes(make_clip):
+    path = make_clip(duration=5, gop=30)
+
+    assert mp4_keyframe_times(path) == ffmpeg.keyframe_times(path)
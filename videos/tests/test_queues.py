@@ -0,0 +1,97 @@
+from datetime import timedelta
+import pytest
+from unittest.mock import patch
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from videos.models import Job, MediaInfo, Video
+from videos.routing import route
+from videos.tasks import merge_videos_task, trim_video_task
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+def probed_video(name, width, height, duration, fps=30):
+    media_info = MediaInfo.objects.create(
+        content_hash=name, mtime=0, size=1, duration=duration, video_codec="h264", video_profile="High",
+        width=width, height=height, fps=fps, timebase=15360, pix_fmt="yuv420p",
+        audio_codec="aac", audio_sample_rate=44100, audio_channels=2,
+    )
+    return Video.objects.create(name=name, duration=duration, size=1, file=f"videos/{name}", media_info=media_info)
+
+
+@pytest.mark.django_db
+def test_jobs_are_routed_by_estimated_cost(settings):
+    settings.VIDEO_HEAVY_JOB_COST = 2000
+    video = probed_video("long.mp4", 1920, 1080, 600)
+    small = probed_video("small.mp4", 640, 360, 10)
+    client = APIClient()
+    setup_user(client)
+
+    def trim(mode):
+        with patch.object(trim_video_task, "apply_async") as apply_async:
+            response = client.post(
+                f"/api/videos/{video.id}/trim/", {"start_time": 0, "end_time": 300, "mode": mode}, format="json",
+            )
+        assert response.status_code == 202
+        return Job.objects.get(id=response.data["task_id"]), apply_async.call_args.kwargs
+
+    # Five minutes of 1080p30 encoded is heavy; copying it is not.
+    job, options = trim("reencode")
+    assert job.cost == pytest.approx(1920 * 1080 * 30 * 300 / 1e6)
+    assert (job.queue, options["queue"], options["priority"]) == ("heavy", "heavy", 9)
+    job, options = trim("keyframe")
+    assert (job.queue, options["queue"]) == ("light", "light")
+    assert options["priority"] < 9
+
+    # A merge encodes only the inputs that differ from the target layout.
+    with patch.object(merge_videos_task, "apply_async") as apply_async:
+        response = client.post("/api/videos/merge/", {"video_ids": [str(small.id), str(small.id)]}, format="json")
+    job = Job.objects.get(id=response.data["task_id"])
+    assert job.queue == "light" and job.cost == pytest.approx(2 * 640 * 360 * 30 * 10 / 1e6 * 0.02)
+    assert client.get(f"/api/videos/tasks/{job.id}/status/").data["queue"] == "light"
+
+
+def test_light_jobs_are_more_urgent_on_the_broker(settings):
+    settings.VIDEO_HEAVY_JOB_COST = 2000
+    light, heavy = route(10), route(20000)
+    # Redis serves the lowest priority first.
+    assert light["priority"] < heavy["priority"] == 9
+
+    settings.CELERY_BROKER_URL = "amqp://guest@localhost//"
+    light, heavy = route(10), route(20000)
+    # RabbitMQ serves the highest first.
+    assert light["priority"] > heavy["priority"] == 0
+
+
+@pytest.mark.django_db
+def test_queue_stats_report_depth_and_wait():
+    current = now()
+    for created, started, status in ((60, 50, Job.SUCCESS), (30, 10, Job.RUNNING), (20, None, Job.QUEUED)):
+        job = Job.objects.create(kind="trim", queue="light", status=status, output_name="out.mp4")
+        started_at = current - timedelta(seconds=started) if started is not None else None
+        Job.objects.filter(id=job.id).update(created_at=current - timedelta(seconds=created), started_at=started_at)
+    Job.objects.create(kind="merge", queue="heavy", output_name="out.mp4")
+    client = APIClient()
+    setup_user(client)
+
+    response = client.get("/api/videos/queues/")
+
+    assert response.status_code == 200
+    queues = {queue["name"]: queue for queue in response.data["queues"]}
+    assert set(queues) == {"light", "heavy", "background"}
+    light = queues["light"]
+    assert (light["queued"], light["running"]) == (1, 1)
+    assert light["oldest_wait"] >= 20
+    assert light["wait"]["samples"] == 2
+    assert light["wait"]["p50"] == pytest.approx(20, abs=1) and light["wait"]["max"] == pytest.approx(20, abs=1)
+    assert queues["heavy"]["queued"] == 1 and queues["heavy"]["wait"]["samples"] == 0
+
+    assert client.get("/api/videos/queues/?window=x").status_code == 400
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos.models import Video
+from videos.serving import STREAM_BLOCK_SIZE
+from videos.utils import generate_expirable_link
+from videos.views import serve_video_async
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+@pytest.fixture
+def served_video(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    os.makedirs(tmp_path / "videos" / "uploads")
+    data = bytes(range(256)) * 40
+    with open(tmp_path / "videos" / "uploads" / "clip.mp4", "wb") as f:
+        f.write(data)
+    video = Video.objects.create(name="clip.mp4", duration=1, size=len(data), file="videos/uploads/clip.mp4")
+    link = generate_expirable_link(video, 60)
+    return link[link.index("/api/"):], data
+
+
+def body(response):
+    return b"".join(response.streaming_content)
+
+
+@pytest.mark.django_db
+def test_serve_single_range(served_video):
+    client = APIClient()
+    setup_user(client)
+    url, data = served_video
+
+    response = client.get(url, HTTP_RANGE="bytes=100-199")
+
+    assert response.status_code == 206
+    assert response["Content-Range"] == f"bytes 100-199/{len(data)}"
+    assert response["Content-Length"] == "100"
+    assert body(response) == data[100:200]
+
+    response = client.get(url, HTTP_RANGE="bytes=-10")
+    assert body(response) == data[-10:]
+
+    response = client.get(url, HTTP_RANGE=f"bytes={len(data)}-")
+    assert response.status_code == 416
+    assert response["Content-Range"] == f"bytes */{len(data)}"
+
+
+@pytest.mark.django_db
+def test_serve_multiple_ranges(served_video):
+    client = APIClient()
+    setup_user(client)
+    url, data = served_video
+
+    response = client.get(url, HTTP_RANGE="bytes=0-9,50-59,55-64")
+
+    assert response.status_code == 206
+    assert response["Content-Type"].startswith("multipart/byteranges; boundary=")
+    content = body(response)
+    assert int(response["Content-Length"]) == len(content)
+    assert f"Content-Range: bytes 0-9/{len(data)}".encode() in content
+    assert f"Content-Range: bytes 50-64/{len(data)}".encode() in content
+    assert data[50:65] in content
+
+
+@pytest.mark.django_db
+def test_serve_conditional_requests(served_video):
+    client = APIClient()
+    setup_user(client)
+    url, data = served_video
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response["Accept-Ranges"] == "bytes"
+    etag = response["ETag"]
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+    assert response.status_code == 304
+
+    # A stale If-Range means the client gets the whole, current file.
+    response = client.get(url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_serve_hands_off_to_front_end(served_video, settings):
+    client = APIClient()
+    setup_user(client)
+    url, data = served_video
+
+    settings.VIDEO_SERVE_ACCEL = "x-accel-redirect"
+    response = client.get(url)
+    assert response["X-Accel-Redirect"] == "/protected-media/videos/uploads/clip.mp4"
+    assert response.content == b""
+
+    settings.VIDEO_SERVE_ACCEL = "x-sendfile"
+    response = client.get(url)
+    assert response["X-Sendfile"].endswith(os.path.join("videos", "uploads", "clip.mp4"))
+
+
+async def download_async(url, **headers):
+    response = await serve_video_async(AsyncRequestFactory().get(url, headers=headers))
+    chunks = [chunk async for chunk in response.streaming_content] if response.streaming else [response.content]
+    return response, chunks
+
+
+@pytest.mark.django_db
+def test_async_serve_streams_blocks_and_ranges(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    data = os.urandom(3 * STREAM_BLOCK_SIZE + 100)
+    with open(tmp_path / "clip.mp4", "wb") as f:
+        f.write(data)
+    video = Video.objects.create(name="clip.mp4", duration=1, size=len(data), file="clip.mp4")
+    link = generate_expirable_link(video, 60)
+    url = link[link.index("/api/"):]
+    user = User.objects.create_user(username="testuser", password="testpass")
+    auth = f"Token {Token.objects.create(user=user).key}"
+
+    response, chunks = async_to_sync(download_async)(url)
+    assert response.status_code == 401
+
+    response, chunks = async_to_sync(download_async)(url, Authorization=auth)
+    assert response.status_code == 200 and response.is_async
+    assert [len(chunk) for chunk in chunks] == [STREAM_BLOCK_SIZE] * 3 + [100]
+    assert b"".join(chunks) == data
+
+    response, chunks = async_to_sync(download_async)(url, Authorization=auth, Range="bytes=10-19,-5")
+    assert response.status_code == 206
+    assert data[10:20] in b"".join(chunks) and data[-5:] in b"".join(chunks)
+
+    # Many downloads share one event loop.
+    async def many():
+        return await asyncio.gather(*(
+            download_async(url, Authorization=auth, Range=f"bytes={i}-{i + 999}") for i in range(50)
+        ))
+    assert all(b"".join(chunks) == data[i:i + 1000] for i, (_, chunks) in enumerate(async_to_sync(many)()))
@@ -0,0 +1,159 @@
+import os
+import shutil
+import pytest
+from rest_framework.test import APIClient
+from django.conf import settings as django_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos.blobs import collect_garbage, incoming_path, ingest
+from videos.models import Blob, Video
+from videos.storage import FileCache, get_storage
+from videos.tasks import trim_video_task
+from videos.utils import generate_expirable_link
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+def send_chunk(client, data, chunk_number, total_chunks, size, **extra):
+    chunk = data[(chunk_number - 1) * size:chunk_number * size]
+    return client.post("/api/videos/chunked_upload/", {
+        "chunk_number": chunk_number,
+        "total_chunks": total_chunks,
+        "file_id": "upload-1",
+        "file_name": "clip.mp4",
+        "chunk": SimpleUploadedFile("chunk", chunk),
+        **extra,
+    })
+
+
+def requests_for(standin, method, key):
+    return [query for request_method, request_key, query, _ in standin.requests
+            if request_method == method and request_key == key]
+
+
+@pytest.mark.django_db
+def test_chunked_upload_is_a_multipart_upload_served_by_ranges(make_clip, s3_storage, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    client = APIClient()
+    setup_user(client)
+    with open(make_clip(duration=3), "rb") as f:
+        data = f.read()
+
+    response = send_chunk(client, data, 1, 2, 512, chunk_size=512)
+    assert response.status_code == 400  # parts below the service minimum
+
+    chunk_size = 8 * 1024
+    total_chunks = -(-len(data) // chunk_size)
+    response = send_chunk(client, data, total_chunks, total_chunks, chunk_size,
+                          chunk_size=chunk_size, total_size=len(data))
+    assert response.status_code == 200, response.data
+    for chunk_number in range(total_chunks - 1, 0, -1):
+        response = send_chunk(client, data, chunk_number, total_chunks, chunk_size)
+    assert response.status_code == 201, response.data
+
+    # Every chunk went up as the part of the same number, and the
+    # assembled upload was renamed to its blob.
+    video = Video.objects.get()
+    parts = requests_for(s3_storage, "PUT", "video_chunks/upload-1")
+    assert sorted(int(query["partNumber"]) for query in parts) == list(range(1, total_chunks + 1))
+    assert not s3_storage.uploads
+    assert [key for _, key in s3_storage.objects] == [video.file.name]
+    assert s3_storage.objects["videos", video.file.name][0] == data
+    assert not os.path.exists(os.path.join(settings.MEDIA_ROOT, video.file.name))
+
+    link = generate_expirable_link(video, 60)
+    response = client.get(link[link.index("/api/"):], HTTP_RANGE="bytes=100-199")
+    assert response.status_code == 206
+    assert b"".join(response.streaming_content) == data[100:200]
+    assert response["Content-Range"] == f"bytes 100-199/{len(data)}"
+    assert requests_for(s3_storage, "GET", video.file.name)
+    assert b"".join(client.get(link[link.index("/api/"):]).streaming_content) == data
+
+
+def test_large_objects_are_moved_by_copying_ranges_into_parts(s3_storage, settings, tmp_path):
+    settings.VIDEO_STORAGE = {**settings.VIDEO_STORAGE, "MAX_COPY_SIZE": 20 * 1024}
+    storage = get_storage()
+    data = os.urandom(50 * 1024)
+    for name in ("small", "large"):
+        path = tmp_path / name
+        path.write_bytes(data[:10 * 1024] if name == "small" else data)
+        storage.save(f"incoming/{name}", str(path))
+        storage.move(f"incoming/{name}", f"blobs/{name}")
+
+    assert s3_storage.objects["videos", "blobs/small"][0] == data[:10 * 1024]
+    assert s3_storage.objects["videos", "blobs/large"][0] == data
+    assert sorted(key for _, key in s3_storage.objects) == ["blobs/large", "blobs/small"]
+    ranges = [headers["x-amz-copy-source-range"] for method, key, query, headers in s3_storage.requests
+              if method == "PUT" and key == "blobs/large" and "uploadId" in query]
+    assert ranges == ["bytes=0-16383", "bytes=16384-32767", "bytes=32768-49151", "bytes=49152-51199"]
+    assert not s3_storage.uploads
+
+
+@pytest.mark.django_db
+def test_workers_read_sources_through_the_node_cache(make_clip, s3_storage, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    path = make_clip(duration=4)
+    with open(path, "rb") as f:
+        data = f.read()
+    blob = ingest(path)
+    video = Video.objects.create(name="clip.mp4", duration=4, size=blob.size, file=blob.name, blob=blob)
+    assert s3_storage.objects["videos", blob.name][0] == data
+    assert requests_for(s3_storage, "POST", blob.name)  # larger than PART_SIZE, so saved in parts
+
+    # Another node: nothing cached yet, so the first task downloads the source once.
+    shutil.rmtree(django_settings.VIDEO_STORAGE_CACHE_DIR)
+    for start in (0, 1):
+        result = trim_video_task(blob.name, start, start + 2, incoming_path(".mp4"), "keyframe",
+                                 [[blob.sha256], "trim", {"start": start}])
+        assert result["status"] == "success", result
+    assert requests_for(s3_storage, "GET", blob.name).count({}) == 1
+    assert Blob.objects.count() == 3
+    assert len(s3_storage.objects) == 3
+
+    video.delete()
+    removed, freed = collect_garbage(grace=0)
+    assert removed == 3 and freed > 0
+    assert not s3_storage.objects
+
+
+def test_cache_evicts_the_least_recently_used(tmp_path):
+    file_cache = FileCache(str(tmp_path / "cache"), max_size=250)
+
+    def download(name, path):
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+
+    first = file_cache.get("a.mp4", download)
+    second = file_cache.get("b.mp4", download)
+    os.utime(first, (0, 0))
+    os.utime(second, (1, 1))
+    assert file_cache.get("a.mp4", download) == first  # a hit, now the most recent
+    third = file_cache.get("c.mp4", download)
+
+    assert os.path.exists(first) and os.path.exists(third)
+    assert not os.path.exists(second)
+
+
+def test_cache_keeps_files_used_within_the_grace_period(tmp_path):
+    file_cache = FileCache(str(tmp_path / "cache"), max_size=150, grace=60)
+
+    def download(name, path):
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+
+    # Another worker fetched "a.mp4" a moment ago and has yet to open it.
+    first = file_cache.get("a.mp4", download)
+    second = file_cache.get("b.mp4", download)
+    assert os.path.exists(first) and os.path.exists(second)
+
+    # Once it is older than the grace period, it goes.
+    os.utime(first, (0, 0))
+    file_cache.evict()
+    assert not os.path.exists(first) and os.path.exists(second)
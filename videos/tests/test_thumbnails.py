@@ -0,0 +1,87 @@
+import os
+import pytest
+from unittest.mock import patch
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos.models import ThumbnailSet, Video
+from videos.probe import get_media_info
+from videos.tasks import thumbnail_video_task
+from videos.thumbnails import cache_dir
+
+
+def setup_user(client):
+    """Setup a test user and authenticate the client."""
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return user
+
+
+@pytest.mark.django_db
+def test_sprite_sheets_and_webvtt(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.VIDEO_THUMBNAIL_INTERVAL = 1
+    settings.VIDEO_THUMBNAIL_WIDTH = 64
+    settings.VIDEO_SPRITE_COLUMNS = 2
+    settings.VIDEO_SPRITE_ROWS = 2
+    source = make_clip(duration=5, gop=24)
+    video = Video.objects.create(name="clip.mp4", duration=5, size=1, file=source, media_info=get_media_info(source))
+
+    with patch.object(thumbnail_video_task, "update_state"):
+        result = thumbnail_video_task(str(video.id))
+
+    assert result == {"status": "success", "video_id": str(video.id), "thumbnails": 5, "sprites": 2}
+    thumbnails = ThumbnailSet.objects.get(video=video)
+    assert (thumbnails.tile_width, thumbnails.tile_height) == (64, 36)
+    directory = tmp_path / thumbnails.directory
+    assert sorted(os.listdir(directory)) == ["poster.jpg", "sprite-001.jpg", "sprite-002.jpg", "thumbnails.vtt"]
+    track = (directory / "thumbnails.vtt").read_text().split("\n\n")
+    assert track[0] == "WEBVTT"
+    assert track[4] == "00:00:03.000 --> 00:00:04.000\nsprite-001.jpg#xywh=64,36,64,36"
+    assert track[5].startswith("00:00:04.000 --> 00:00:05.0")
+    assert track[5].strip().endswith("sprite-002.jpg#xywh=0,0,64,36")
+
+    client = APIClient()
+    setup_user(client)
+    response = client.post(f"/api/videos/{video.id}/share/", {"expiry_time": 60})
+    link = response.data["thumbnails"]
+    player = APIClient()
+    response = player.get(link[link.index("/api/"):])
+    assert response.status_code == 200
+    assert b"".join(response.streaming_content).startswith(b"WEBVTT")
+    sprite = player.get(link[link.index("/api/"):].replace("thumbnails.vtt", "sprite-002.jpg"))
+    assert sprite.status_code == 200
+    assert sprite["Content-Type"] == "image/jpeg"
+
+
+@pytest.mark.django_db
+def test_frames_generated_on_demand_with_lru_eviction(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    source = make_clip(duration=5)
+    video = Video.objects.create(name="clip.mp4", duration=5, size=1, file=source, media_info=get_media_info(source))
+    client = APIClient()
+    setup_user(client)
+    url = f"/api/videos/{video.id}/thumbnail/"
+
+    response = client.get(url, {"t": 1.02, "width": 80})
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/jpeg"
+    first = os.listdir(cache_dir())
+    assert first == [f"{video.id}-1000-80.jpg"]
+
+    # A hit is served from the cache and becomes the most recently used.
+    with patch("videos.thumbnails.ffmpeg.extract_frame") as extract:
+        assert client.get(url, {"t": 0.98, "width": 80}).status_code == 200
+    extract.assert_not_called()
+    size = os.path.getsize(os.path.join(cache_dir(), first[0]))
+    os.utime(os.path.join(cache_dir(), first[0]), (1, 1))
+
+    settings.VIDEO_THUMBNAIL_CACHE_SIZE = size * 2 + size // 2
+    for t in (2, 3):
+        assert client.get(url, {"t": t, "width": 80}).status_code == 200
+    assert sorted(os.listdir(cache_dir())) == [f"{video.id}-2000-80.jpg", f"{video.id}-3000-80.jpg"]
+
+    assert client.get(url).status_code == 200
+    assert client.get(url, {"t": 9}).status_code == 400
+    assert client.get(url, {"width": 5000}).status_code == 400
@@ -1,7 +1,12 @@
+import os
 import pytest
+from unittest.mock import patch
 from rest_framework.test import APIClient
 from videos.models import Video
 from rest_framework.authtoken.models import Token
+from videos import ffmpeg
+from videos.ffmpeg import probe
+from videos.tasks import trim_video_task
 
 
 def setup_user(client):
@@ -43,3 +48,110 @@ def test_trim_video_functional():
     # Verify that the task ID is returned
     task_id = response.data["task_id"]
     print(f"Task ID: {task_id}")
+
+
+@pytest.mark.django_db
+def test_trim_video_mode_is_forwarded():
+    client = APIClient()
+    setup_user(client)
+
+    video = Video.objects.create(
+        name="test_video1.mp4",
+        duration=20,
+        size=31404195,
+        file="videos/tests/assets/test_video1.mp4"
+    )
+
+    with patch("videos.views.trim_video_task.apply_async") as apply_async:
+        response = client.post(
+            f"/api/videos/{video.id}/trim/",
+            {"start_time": 5, "end_time": 10, "mode": "accurate", "profile": "archive"},
+            format="json"
+        )
+
+    assert response.status_code == 202, f"Unexpected response: {response.data}"
+    args = apply_async.call_args.args[0]
+    assert args[1:3] == (5.0, 10.0)
+    assert args[4] == "accurate"
+    assert args[6] == "archive"
+    assert apply_async.call_args.kwargs["task_id"] == str(response.data["task_id"])
+
+    for payload in ({"mode": "bogus"}, {"profile": "bogus"}, {"start_time": "five"}, {"end_time": None},
+                    {"end_time": "nan"}):
+        response = client.post(
+            f"/api/videos/{video.id}/trim/",
+            dict(dict(start_time=5, end_time=10), **payload),
+            format="json"
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_trim_keyframe_mode_cuts_on_gop_boundaries(make_clip, tmp_path):
+    source = make_clip(duration=6, gop=24)
+    output_path = str(tmp_path / "out.mp4")
+
+    result = trim_video_task(source, 1.5, 3.5, output_path)
+
+    assert result["status"] == "success", result
+    assert (result["start_time"], result["end_time"]) == (1.0, 4.0)
+    assert abs(probe(output_path)["duration"] - 3.0) < 0.25
+
+
+@pytest.mark.django_db
+def test_trim_accurate_mode_is_frame_accurate(make_clip, tmp_path):
+    source = make_clip(duration=6, gop=24)
+    output_path = str(tmp_path / "out.mp4")
+
+    result = trim_video_task(source, 1.5, 3.5, output_path, mode="accurate")
+
+    assert result["status"] == "success", result
+    assert abs(probe(output_path)["duration"] - 2.0) < 0.25
+
+
+@pytest.mark.django_db
+def test_trim_accurate_mode_splices_only_matching_streams(make_clip, tmp_path):
+    def source(name, audio_codec):
+        path = str(tmp_path / name)
+        ffmpeg.run_ffmpeg([
+            "-f", "lavfi", "-i", "testsrc=size=320x180:rate=25", "-f", "lavfi", "-i", "sine=sample_rate=48000",
+            "-t", "6", "-c:v", "libx264", "-g", "25", "-profile:v", "main", "-pix_fmt", "yuv420p",
+            "-c:a", audio_codec, path,
+        ])
+        return path
+
+    # The edges are encoded to the source's profile and audio layout, so
+    # they splice with the copied GOPs.
+    aac_source = source("aac.mp4", "aac")
+    output_path = str(tmp_path / "aac_out.mp4")
+    with patch.object(ffmpeg, "run_ffmpeg", wraps=ffmpeg.run_ffmpeg) as run_ffmpeg:
+        assert trim_video_task(aac_source, 1.5, 3.5, output_path, mode="accurate")["status"] == "success"
+    assert run_ffmpeg.call_count == 4  # head, middle, tail, join
+    output = probe(output_path)
+    assert (output["video_profile"], output["audio_sample_rate"], output["audio_channels"]) == ("Main", 48000, 1)
+    assert abs(output["duration"] - 2.0) < 0.25
+
+    # Audio that is not AAC cannot be spliced with AAC edges.
+    ac3_source = source("ac3.mp4", "ac3")
+    output_path = str(tmp_path / "ac3_out.mp4")
+    with patch.object(ffmpeg, "run_ffmpeg", wraps=ffmpeg.run_ffmpeg) as run_ffmpeg:
+        assert trim_video_task(ac3_source, 1.5, 3.5, output_path, mode="accurate")["status"] == "success"
+    assert run_ffmpeg.call_count == 1
+    assert probe(output_path)["audio_codec"] == "aac"
+
+
+@pytest.mark.django_db
+def test_trim_encoding_profiles_record_time_and_bitrate(make_clip, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    source = make_clip(duration=4)
+    for profile, options in (("fast-preview", b"crf=30.0"), ("archive", b"crf=18.0")):
+        output_path = str(tmp_path / f"{profile}.mp4")
+        result = trim_video_task(source, 1, 3, output_path, "reencode", profile=profile)
+        assert result["status"] == "success", result
+        assert result["profile"] == profile
+        assert result["encode_time"] > 0 and result["bitrate"] > 0
+        # x264 writes its settings into the stream.
+        with open(output_path, "rb") as output:
+            assert options in output.read()
+    # No temporary files are left in the working directory.
+    assert sorted(os.listdir(tmp_path)) == ["archive.mp4", "clip.mp4", "fast-preview.mp4"]
@@ -1,9 +1,16 @@
+import hashlib
 import pytest
 import os
+from unittest.mock import patch
 from rest_framework.test import APIClient
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.models import User
+from django.core.files.uploadhandler import StopUpload
 from rest_framework.authtoken.models import Token
+from videos.ffmpeg import run_ffmpeg
+from videos.models import Video
+from videos.upload_handlers import VideoUploadHandler
+from videos.views import VideoUploadView
 
 @pytest.mark.django_db
 def test_video_upload_with_token():
@@ -27,3 +34,100 @@ def test_video_upload_with_token():
 
     assert response.status_code == 201
     assert "id" in response.data
+
+
+def setup_user(client):
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+
+def store_files(tmp_path):
+    store = tmp_path / "blobs"
+    return sorted(str(path.relative_to(tmp_path)) for path in store.rglob("*") if path.is_file())
+
+
+@pytest.mark.django_db
+def test_upload_is_written_straight_to_the_blob_store(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    client = APIClient()
+    setup_user(client)
+    path = make_clip(duration=6)
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    for _ in range(2):
+        with open(path, "rb") as f:
+            response = client.post("/api/videos/upload/", {"file": f})
+        assert response.status_code == 201
+
+    # Identical content is stored once and referenced by both videos.
+    first, second = Video.objects.all()
+    assert first.file.name == second.file.name == f"blobs/{digest[:2]}/{digest[2:4]}/{digest}.mp4"
+    assert store_files(tmp_path) == [first.file.name]
+    assert first.blob.refcount == 2
+    assert first.name == "clip.mp4"
+    assert first.media_info.duration == pytest.approx(6, abs=0.25)
+
+
+@pytest.mark.django_db
+def test_upload_rejected_while_streaming(make_clip, settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = str(tmp_path)
+    client = APIClient()
+    setup_user(client)
+    path = make_clip(duration=6)
+
+    with open(path, "rb") as f:
+        response = client.post("/api/videos/upload/?max_size=1000", {"file": f})
+    assert response.status_code == 400
+    assert response.data == "File exceeds maximum size."
+
+    # Without limits in the query string, the defaults are enforced while
+    # streaming too.
+    monkeypatch.setitem(VideoUploadView.DEFAULT_LIMITS, "max_size", 1000)
+    with open(path, "rb") as f, patch("videos.views.validate_video") as validate_video:
+        response = client.post("/api/videos/upload/", {"file": f})
+    assert response.status_code == 400 and response.data == "File exceeds maximum size."
+    validate_video.assert_not_called()
+    monkeypatch.undo()
+
+    # Limits that are not finite positive numbers are refused, in the query
+    # string before the body is read and in the form after it.
+    for query, form in (("?max_size=nan", {}), ("?max_duration=-1", {}), ("", {"max_size": "nan"}),
+                        ("", {"min_duration": "inf"})):
+        with open(path, "rb") as f:
+            response = client.post(f"/api/videos/upload/{query}", dict(form, file=f))
+        assert response.status_code == 400 and response.data == "Invalid upload limits."
+
+    not_video = SimpleUploadedFile("notes.mp4", b"plain text, not a video" * 100)
+    response = client.post("/api/videos/upload/", {"file": not_video})
+    assert response.status_code == 400
+    assert response.data == "File is not a readable video."
+
+    assert not Video.objects.exists()
+    assert store_files(tmp_path) == []
+
+    # A limit in exponent notation is the same number in both checks.
+    with open(path, "rb") as f:
+        response = client.post("/api/videos/upload/?max_size=1e7", {"file": f, "max_size": "1e7"})
+    assert response.status_code == 201, response.data
+
+
+@pytest.mark.django_db
+def test_duration_rejected_from_the_header(make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    source = make_clip(duration=6)
+    faststart = str(tmp_path / "faststart.mp4")
+    run_ffmpeg(["-i", source, "-c", "copy", "-movflags", "+faststart", faststart])
+    with open(faststart, "rb") as f:
+        data = f.read()
+
+    handler = VideoUploadHandler()
+    handler.max_duration = 4
+    handler.new_file("file", "faststart.mp4", "video/mp4", len(data))
+    with pytest.raises(StopUpload):
+        for start in range(0, len(data), handler.chunk_size):
+            handler.receive_data_chunk(data[start:start + handler.chunk_size], start)
+    assert start == 0
+    assert handler.error == "Video duration out of bounds."
+    assert store_files(tmp_path) == []
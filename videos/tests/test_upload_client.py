@@ -0,0 +1,49 @@
+import importlib.util
+import os
+import pytest
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from videos.models import Video
+
+SCRIPT = os.path.join(django_settings.BASE_DIR, "scripts", "upload_large_files.py")
+
+
+def load_client():
+    spec = importlib.util.spec_from_file_location("upload_large_files", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.django_db(transaction=True)
+def test_client_uploads_concurrently_and_resumes(live_server, make_clip, settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    (tmp_path / "media" / "videos" / "uploads").mkdir(parents=True)
+    user = User.objects.create_user(username="testuser", password="testpass")
+    token = Token.objects.create(user=user)
+    path = make_clip(duration=4)
+    client = load_client()
+    url = f"{live_server.url}/api/videos/chunked_upload/"
+
+    uploader = client.ChunkedUploader(url, token.key, concurrency=4, block_size=4096, initial_blocks=2, log=lambda message: None)
+    file_id = client.default_file_id(path)
+    total_chunks = (os.path.getsize(path) + 4095) // 4096
+
+    # Send a few chunks by hand, as if an earlier run was interrupted.
+    fd = os.open(path, os.O_RDONLY)
+    fields = {"total_chunks": total_chunks, "file_id": file_id, "file_name": "clip.mp4",
+              "chunk_size": 4096, "total_size": os.path.getsize(path)}
+    for first in (1, 5):
+        uploader._send(fd, fields, first, 2, os.path.getsize(path))
+    os.close(fd)
+    missing, _ = uploader.missing_chunks(file_id, total_chunks)
+    assert 1 not in missing and 6 not in missing and 3 in missing
+
+    result = uploader.upload(path)
+
+    assert result["video"]["size"] == os.path.getsize(path)
+    assert len(uploader.latencies) < total_chunks
+    video = Video.objects.get()
+    with open(video.file.path, "rb") as uploaded, open(path, "rb") as original:
+        assert uploaded.read() == original.read()
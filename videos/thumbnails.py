@@ -0,0 +1,96 @@
+import bisect
+import math
+import os
+import tempfile
+from django.conf import settings
+from . import ffmpeg
+from .storage import evict, fetch
+
+# Poster frames are taken this far into the video.
+POSTER_POSITION = 0.1
+# On-demand frame times are rounded to this many seconds, so nearby requests
+# share a cache entry.
+FRAME_TIME_STEP = 0.1
+MIN_FRAME_WIDTH = 16
+MAX_FRAME_WIDTH = 1920
+
+
+def thumbnail_times(duration, interval):
+    """
+    Start times of the thumbnails of a video, one every ``interval`` seconds.
+    """
+    return [i * interval for i in range(max(1, math.ceil(duration / interval)))]
+
+
+def pick_keyframes(keyframes, times):
+    """
+    For each time, the image of the last keyframe at or before it (or the
+    first keyframe). ``keyframes`` are (time, path) pairs in order.
+    """
+    key_times = [time for time, _ in keyframes]
+    return [keyframes[max(bisect.bisect_right(key_times, time + 1e-3) - 1, 0)][1] for time in times]
+
+
+def poster_time(duration):
+    return (duration or 0) * POSTER_POSITION
+
+
+def _timestamp(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
+
+
+def webvtt(thumbnails, duration):
+    """
+    WebVTT thumbnail track: one cue per thumbnail pointing at its tile with a
+    ``#xywh=`` media fragment.
+    """
+    per_sheet = thumbnails.columns * thumbnails.rows
+    lines = ["WEBVTT", ""]
+    for index, start in enumerate(thumbnail_times(duration, thumbnails.interval)):
+        end = min(start + thumbnails.interval, duration)
+        sheet, tile = divmod(index, per_sheet)
+        row, column = divmod(tile, thumbnails.columns)
+        lines += [
+            f"{_timestamp(start)} --> {_timestamp(end)}",
+            f"sprite-{sheet + 1:03d}.jpg#xywh={column * thumbnails.tile_width},{row * thumbnails.tile_height},"
+            f"{thumbnails.tile_width},{thumbnails.tile_height}",
+            "",
+        ]
+    return "\n".join(lines)
+
+
+def cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, "videos", "thumbnails", "cache")
+
+
+def cached_frame(video, time, width):
+    """
+    Path of a JPEG of the frame of ``video`` at ``time``, ``width`` pixels
+    wide, extracting it on first request. Entries are touched on every hit
+    and the least recently used are evicted once the cache is larger than
+    settings.VIDEO_THUMBNAIL_CACHE_SIZE bytes.
+    """
+    time = round(time / FRAME_TIME_STEP) * FRAME_TIME_STEP
+    directory = cache_dir()
+    path = os.path.join(directory, f"{video.id}-{round(time * 1000)}-{width}.jpg")
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(directory, exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=directory, suffix=".part")
+    os.close(fd)
+    try:
+        ffmpeg.extract_frame(fetch(video.file.name), time, width, partial)
+        if not os.path.getsize(partial):
+            raise IOError(f"No frame at {time:.1f}s")
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    evict(directory, settings.VIDEO_THUMBNAIL_CACHE_SIZE, keep=path, partial_suffix=".part")
+    return path
@@ -0,0 +1,122 @@
+import hashlib
+import os
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from . import metrics
+from .blobs import incoming_path
+from .probe import mp4_header_duration, sniff_container
+
+# Bytes buffered from the start of an upload before its header is checked.
+SNIFF_SIZE = 64 * 1024
+
+
+class StoredUploadedFile(UploadedFile):
+    """
+    An upload already written to the blob store's incoming directory, with
+    the SHA-256 of its bytes, ready for blobs.ingest().
+    """
+
+    def __init__(self, file, sha256, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            pass
+
+
+class VideoUploadHandler(FileUploadHandler):
+    """
+    Stream the ``file`` field of an upload straight into the blob store,
+    hashing it on the way. The upload is rejected as soon as it is larger
+    than ``max_size`` or its first bytes are not a video container (or, for
+    MP4s with the moov box up front, the duration is out of bounds).
+    Rejection stops reading the request body; the reason is left in
+    ``error``.
+    """
+
+    chunk_size = SNIFF_SIZE
+
+    def __init__(self, request=None, field_name="file"):
+        super().__init__(request)
+        self.field_name = field_name
+        self.max_size = settings.VIDEO_UPLOAD_MAX_SIZE
+        self.min_duration = None
+        self.max_duration = None
+        self.error = None
+        self.file = None
+        self.active = False
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.active = field_name == self.field_name and self.file is None
+        if not self.active:
+            return
+        self.header = b""
+        self.received = 0
+        self.digest = hashlib.sha256()
+        self.file = open(incoming_path(os.path.splitext(self.file_name)[1].lower()), "wb")
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.reject("File exceeds maximum size.")
+        if self.header is not None:
+            self.header += raw_data
+            if len(self.header) >= SNIFF_SIZE:
+                self.check_header()
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        if self.header is not None:
+            self.check_header()
+        self.file.flush()
+        self.file.close()
+        metrics.inc("video_bytes_in_total", (metrics.current_operation(),), file_size)
+        return StoredUploadedFile(
+            open(self.file.name, "rb"), self.digest.hexdigest(), self.file_name,
+            self.content_type, file_size, self.charset, self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if self.active:
+            self.discard()
+
+    def check_header(self):
+        header, self.header = self.header, None
+        if not sniff_container(header):
+            self.reject("File is not a readable video.")
+        duration = mp4_header_duration(header)
+        if duration is None:
+            # The moov box is at the end; the duration is checked after the upload.
+            return
+        if (self.min_duration is not None and duration < self.min_duration) or (
+            self.max_duration is not None and duration > self.max_duration
+        ):
+            self.reject("Video duration out of bounds.")
+
+    def reject(self, error):
+        self.error = error
+        self.active = False
+        self.discard()
+        raise StopUpload(connection_reset=True)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except FileNotFoundError:
+            pass
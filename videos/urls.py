@@ -1,12 +1,29 @@
+from django.conf import settings
 from django.urls import path
-from .views import VideoUploadView, VideoTrimView, VideoGetView, VideoMergeView, GenerateExpirableLinkView, VideoChunkedUploadView, ServeVideoView
+from .views import VideoUploadView, VideoTrimView, VideoBatchTrimView, VideoGetView, VideoMergeView, VideoGraphView, GenerateExpirableLinkView, BatchExpirableLinkView, RevokeLinksView, VideoChunkedUploadView, ServeVideoView, StreamVideoView, StreamThumbnailsView, VideoPackageView, VideoThumbnailsView, VideoAnalysisView, VideoFrameView, TaskStatusView, TaskEventsView, QueueStatsView, serve_video_async, task_events_async, task_status_async
 
 urlpatterns = [
     path("list/", VideoGetView.as_view(), name="get-videos"),
     path("upload/", VideoUploadView.as_view(), name="video-upload"),
     path('chunked_upload/', VideoChunkedUploadView.as_view(), name='chunked_upload'),
+    path('chunked_upload/<str:file_id>/status/', VideoChunkedUploadView.as_view(), name='chunked_upload_status'),
     path("<uuid:video_id>/trim/", VideoTrimView.as_view(), name="video-trim"),
+    path("<uuid:video_id>/trim/batch/", VideoBatchTrimView.as_view(), name="video-trim-batch"),
     path("merge/", VideoMergeView.as_view(), name="video-merge"),
+    path("graph/", VideoGraphView.as_view(), name="video-graph"),
+    path("tasks/<uuid:task_id>/status/", task_status_async if settings.VIDEO_ASYNC_SERVE else TaskStatusView.as_view(),
+         name="task-status"),
+    path("tasks/<uuid:task_id>/events/", task_events_async if settings.VIDEO_ASYNC_SERVE else TaskEventsView.as_view(),
+         name="task-events"),
+    path("queues/", QueueStatsView.as_view(), name="queue-stats"),
     path("<uuid:video_id>/share/", GenerateExpirableLinkView.as_view(), name="video-share"),
-    path('serve/', ServeVideoView.as_view(), name='serve_video'),
+    path("<uuid:video_id>/share/revoke/", RevokeLinksView.as_view(), name="video-share-revoke"),
+    path("share/", BatchExpirableLinkView.as_view(), name="video-share-batch"),
+    path('serve/', serve_video_async if settings.VIDEO_ASYNC_SERVE else ServeVideoView.as_view(), name='serve_video'),
+    path("<uuid:video_id>/package/", VideoPackageView.as_view(), name="video-package"),
+    path("<uuid:video_id>/thumbnails/", VideoThumbnailsView.as_view(), name="video-thumbnails"),
+    path("<uuid:video_id>/analysis/", VideoAnalysisView.as_view(), name="video-analysis"),
+    path("<uuid:video_id>/thumbnail/", VideoFrameView.as_view(), name="video-frame"),
+    path('stream/<str:token>/thumbnails/<path:asset>', StreamThumbnailsView.as_view(), name='stream_thumbnails'),
+    path('stream/<str:token>/<path:asset>', StreamVideoView.as_view(), name='stream_video'),
 ]
@@ -1,29 +1,74 @@
-from moviepy.editor import VideoFileClip
+import math
+import os
+import tempfile
 from django.conf import settings
-from django.core.signing import TimestampSigner
-from django.utils.timezone import now
+from . import links
+from .probe import get_media_info
+
+def upload_limit(name, value):
+    """
+    An upload limit (``max_size`` in bytes, ``min_duration`` or
+    ``max_duration`` in seconds) as a float, raising ValueError unless it is
+    a finite number above zero (or zero, for min_duration).
+    """
+    limit = float(value)
+    if not (0 <= limit < math.inf and (limit > 0 or name == "min_duration")):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    return limit
 
-signer = TimestampSigner()
 
 def validate_video(file, max_size, min_duration, max_duration):
-    if int(file.size) > int(max_size):
+    max_size = upload_limit("max_size", max_size)
+    min_duration = upload_limit("min_duration", min_duration)
+    max_duration = upload_limit("max_duration", max_duration)
+    if file.size > max_size:
         return {"success": False, "error": "File exceeds maximum size."}
 
-    video = VideoFileClip(file.temporary_file_path())
-    duration = video.duration
+    try:
+        if hasattr(file, "temporary_file_path"):
+            media_info = get_media_info(file.temporary_file_path(), getattr(file, "sha256", None))
+        else:
+            # Small uploads are kept in memory; give ffmpeg a file to read.
+            with tempfile.NamedTemporaryFile(suffix=os.path.splitext(file.name)[1]) as spooled:
+                for chunk in file.chunks():
+                    spooled.write(chunk)
+                spooled.flush()
+                media_info = get_media_info(spooled.name, getattr(file, "sha256", None))
+    except IOError:
+        return {"success": False, "error": "File is not a readable video."}
+    duration = media_info.duration
 
-    if duration < min_duration or duration > max_duration:
+    if duration is None or duration < min_duration or duration > max_duration:
         return {"success": False, "error": "Video duration out of bounds."}
 
-    return {"success": True, "duration": duration}
+    return {"success": True, "duration": duration, "media_info": media_info}
 
 
 
-def generate_expirable_link(video_id, expire_in_seconds):
+def generate_expirable_link(video, expire_in_seconds):
     """
-    Generate an expiring link for a video.
+    Generate an expiring link for a video. The token carries the file's
+    location, so serving it needs no lookup.
     """
-    # Sign the video ID with expiration
-    expire_in_seconds = int(expire_in_seconds)
-    token = signer.sign_object({'video_id': str(video_id), 'expires_at': now().timestamp() + expire_in_seconds})
+    token = links.sign(video.id, expire_in_seconds, file=video.file.name, name=video.name)
     return f"{settings.SITE_URL}/api/videos/serve/?token={token}"
+
+
+def generate_stream_links(package, expire_in_seconds):
+    """
+    Generate expiring HLS and DASH links for a packaged video. The token is a
+    path segment, so the relative URIs inside the playlists inherit it.
+    """
+    token = links.sign(package.video_id, expire_in_seconds)
+    base = f"{settings.SITE_URL}/api/videos/stream/{token}"
+    return {"hls": f"{base}/{package.hls_playlist}", "dash": f"{base}/{package.dash_manifest}"}
+
+
+def generate_thumbnail_links(thumbnails, expire_in_seconds):
+    """
+    Generate expiring links to the poster frame and the WebVTT thumbnail
+    track of a video; the sprite URIs in the track are relative to it.
+    """
+    token = links.sign(thumbnails.video_id, expire_in_seconds)
+    base = f"{settings.SITE_URL}/api/videos/stream/{token}/thumbnails"
+    return {"poster": f"{base}/{thumbnails.poster}", "thumbnails": f"{base}/{thumbnails.vtt}"}
@@ -1,54 +1,193 @@
+import asyncio
+import hashlib
+import json
+import math
 import os
+import time
 import uuid
 from datetime import datetime
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
-from .models import Video
-from .serializers import VideoSerializer
-from .utils import validate_video, generate_expirable_link
-from .tasks import trim_video_task, merge_videos_task
-from django.http import FileResponse, Http404
-from django.core.signing import BadSignature, SignatureExpired
-from django.core.signing import TimestampSigner
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from . import analysis, graph, links, metrics
+from .authentication import aauthenticate
+from .models import ChunkedUpload, Job, ThumbnailSet, Video, VideoPackage
+from .serializers import JobSerializer, VideoSerializer
+from .utils import upload_limit, validate_video, generate_expirable_link, generate_stream_links, generate_thumbnail_links
+from .probe import get_media_info
+from .profiles import profile_names
+from .routing import graph_cost, merge_cost, queue_stats, trim_cost
+from .serving import aserve_stored, serve_file, serve_stored
+from .storage import fetch, get_storage
+from .upload_handlers import VideoUploadHandler
+from .blobs import find_artifact, incoming_path, ingest, ingest_stored
+from .jobs import enqueue
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor, keyset_page
+from .signals import list_version
+from .tasks import (
+    trim_video_task, batch_trim_task, merge_videos_task, graph_task, package_video_task, thumbnail_video_task,
+    transcode_task, analyze_video_task, TRIM_MODES, PARALLEL,
+)
+from .thumbnails import MAX_FRAME_WIDTH, MIN_FRAME_WIDTH, cached_frame, poster_time
+from django.http import (
+    Http404, HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse,
+)
+from django.utils.http import parse_etags
 from django.utils.timezone import now
 
 
-signer = TimestampSigner()
-# Directory for storing temporary chunks
-CHUNKS_DIR = os.path.join(settings.MEDIA_ROOT, 'video_chunks')
-os.makedirs(CHUNKS_DIR, exist_ok=True)
-
 class VideoGetView(APIView):
     permission_classes = [IsAuthenticated]
 
+    # Query parameter -> (lookup, type)
+    FILTERS = {
+        "name_prefix": ("name__startswith", str),
+        "min_duration": ("duration__gte", int),
+        "max_duration": ("duration__lte", int),
+        "min_size": ("size__gte", int),
+        "max_size": ("size__lte", int),
+    }
+    CACHE_TIMEOUT = 300
+
     def get(self, request):
-        videos = Video.objects.all()
-        serializer = VideoSerializer(videos, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        """
+        One page of videos in (uploaded_at, id) order.
+
+        Query parameters: ``cursor`` (from ``next_cursor``), ``limit``,
+        ``order`` (``asc``/``desc``), ``fields`` (comma separated), and the
+        filters in FILTERS. Pages are cached until a Video changes and carry
+        an ETag, so unchanged pages are answered with 304.
+        """
+        params = request.query_params
+        try:
+            limit = int(params.get("limit", DEFAULT_PAGE_SIZE))
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+            filters = {
+                lookup: cast(params[name])
+                for name, (lookup, cast) in self.FILTERS.items() if name in params
+            }
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        fields = [field for field in params.get("fields", "").split(",") if field] or None
+        if fields and set(fields) - set(VideoSerializer.Meta.fields):
+            return Response({"error": "Unknown field requested."}, status=status.HTTP_400_BAD_REQUEST)
+
+        query = json.dumps(sorted(params.items()))
+        cache_key = f"videos:list:page:{hashlib.sha1((list_version() + query).encode()).hexdigest()}"
+        cached = cache.get(cache_key)
+        if cached is None:
+            videos = Video.objects.filter(**filters)
+            if fields is None or "media_info" in fields:
+                videos = videos.select_related("media_info")
+            try:
+                page, next_cursor = keyset_page(
+                    videos, params.get("cursor"), limit, descending=params.get("order") == "desc",
+                )
+            except InvalidCursor as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            body = json.dumps({
+                "results": VideoSerializer(page, many=True, fields=fields).data,
+                "next_cursor": next_cursor,
+            }, cls=DjangoJSONEncoder)
+            cached = ('"%s"' % hashlib.sha1(body.encode()).hexdigest(), json.loads(body))
+            cache.set(cache_key, cached, self.CACHE_TIMEOUT)
+
+        etag, payload = cached
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(payload, status=status.HTTP_200_OK)
+        response["ETag"] = etag
+        return response
     
 
+def _discard_upload(file):
+    """
+    Close an upload and remove it from the blob store's incoming directory.
+    """
+    file.close()
+    try:
+        os.remove(file.temporary_file_path())
+    except FileNotFoundError:
+        pass
+
+
 class VideoUploadView(APIView):
     permission_classes = [IsAuthenticated]
 
+    # Limits of an upload that does not set its own: bytes, seconds, seconds.
+    DEFAULT_LIMITS = {"max_size": 5 * 1024 * 1024, "min_duration": 5, "max_duration": 25}
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Upload handlers have to be in place before anything reads the body.
+        request.upload_handlers.insert(0, VideoUploadHandler(request))
+        return super().initialize_request(request, *args, **kwargs)
+
     def post(self, request, *args, **kwargs):
+        """
+        Upload a video. The file is streamed straight into storage and the
+        upload is cut off as soon as it breaks a limit passed in the query
+        string (``max_size``, ``min_duration``, ``max_duration``), or a
+        default one (DEFAULT_LIMITS). The same limits sent as form fields
+        are checked once the body has been read, so they can only tighten
+        those.
+        """
+        handler = next(h for h in request.upload_handlers if isinstance(h, VideoUploadHandler))
+        try:
+            limits = {
+                name: upload_limit(name, request.query_params.get(name, default))
+                for name, default in self.DEFAULT_LIMITS.items()
+            }
+        except (TypeError, ValueError):
+            return Response("Invalid upload limits.", status=status.HTTP_400_BAD_REQUEST)
+        for name, limit in limits.items():
+            setattr(handler, name, limit)
+        handler.max_size = min(handler.max_size, settings.VIDEO_UPLOAD_MAX_SIZE)
+
         file = request.FILES.get("file")
-        max_size = request.data.get("max_size", 5 * 1024 * 1024)
-        min_duration = request.data.get("min_duration", 5)
-        max_duration = request.data.get("max_duration", 25)
+        if handler.error:
+            return Response(handler.error, status=status.HTTP_400_BAD_REQUEST)
+        if file is None:
+            return Response("No file uploaded.", status=status.HTTP_400_BAD_REQUEST)
 
-        validation_result = validate_video(file, max_size, min_duration, max_duration)
+        try:
+            limits = {name: upload_limit(name, request.data.get(name) or limit) for name, limit in limits.items()}
+        except (TypeError, ValueError):
+            _discard_upload(file)
+            return Response("Invalid upload limits.", status=status.HTTP_400_BAD_REQUEST)
+        try:
+            validation_result = validate_video(file, limits["max_size"], limits["min_duration"], limits["max_duration"])
+            if validation_result["success"]:
+                file.close()
+                # A rename into the store, or nothing at all if the content
+                # is already there.
+                blob = ingest(file.temporary_file_path(), file.sha256)
+        except Exception:
+            _discard_upload(file)
+            raise
         if not validation_result["success"]:
+            _discard_upload(file)
             return Response(validation_result["error"], status=status.HTTP_400_BAD_REQUEST)
 
         video = Video.objects.create(
-            file=file,
+            file=blob.name,
+            blob=blob,
             name=file.name,
             duration=validation_result["duration"],
             size=file.size,
+            media_info=validation_result["media_info"],
         )
+        schedule_packaging(video)
+        schedule_thumbnails(video)
+        schedule_analysis(video)
         return Response(VideoSerializer(video).data, status=status.HTTP_201_CREATED)
 
 class VideoChunkedUploadView(APIView):
@@ -57,121 +196,718 @@ class VideoChunkedUploadView(APIView):
     def post(self, request, *args, **kwargs):
         """
         Endpoint to handle chunked file uploads
+
+        Each chunk is a part of one multipart upload to storage (written at
+        its byte offset into a part file, with the local backend), so chunks
+        may be sent in any order and concurrently. The upload completes when
+        every chunk has been received.
         """
         try:
             # Extract request data
             chunk_number = int(request.data.get('chunk_number'))
             total_chunks = int(request.data.get('total_chunks'))
             file_id = request.data.get('file_id', str(uuid.uuid4()))
-            file_name = request.data.get('file_name')
+            file_name = os.path.basename(request.data.get('file_name'))
             chunk = request.FILES['chunk']
+            chunk_size = request.data.get('chunk_size')
+            total_size = request.data.get('total_size')
+
+            if not 1 <= chunk_number <= total_chunks:
+                return Response({'error': 'chunk_number out of range.'}, status=status.HTTP_400_BAD_REQUEST)
+            if chunk_size is None and (chunk_number < total_chunks or total_chunks == 1):
+                # Every chunk but the last has the full chunk size.
+                chunk_size = chunk.size
+            if chunk_size is None and not ChunkedUpload.objects.filter(file_id=file_id).exists():
+                return Response({'error': 'chunk_size is required when the last chunk is sent first.'}, status=status.HTTP_400_BAD_REQUEST)
+            # Chunks are the parts of a multipart upload, within the limits
+            # of the storage service.
+            storage = get_storage()
+            if total_chunks > 1 and chunk_size is not None and int(chunk_size) < storage.min_part_size:
+                return Response({'error': f'chunk_size must be at least {storage.min_part_size} bytes.'}, status=status.HTTP_400_BAD_REQUEST)
+            if storage.max_parts and total_chunks > storage.max_parts:
+                return Response({'error': f'total_chunks must be at most {storage.max_parts}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            upload, _ = ChunkedUpload.objects.get_or_create(
+                file_id=file_id,
+                defaults={
+                    'file_name': file_name,
+                    'total_chunks': total_chunks,
+                    'chunk_size': int(chunk_size or 0),
+                    'total_size': int(total_size) if total_size else None,
+                },
+            )
+            if upload.status == ChunkedUpload.COMPLETE:
+                return self._completed(upload)
 
-            file_dir = os.path.join(CHUNKS_DIR, file_id)
-            os.makedirs(file_dir, exist_ok=True)
-
-            # Save the chunk to the session directory
-            chunk_path = os.path.join(file_dir, f'chunk_{chunk_number}')
-            with open(chunk_path, 'wb') as f:
-                for chunk_data in chunk.chunks():
-                    f.write(chunk_data)
-
-            # Check if all chunks are uploaded
-            if chunk_number == total_chunks:
-                final_file_path = os.path.join(settings.MEDIA_ROOT, file_name)
-                with open(final_file_path, 'wb') as final_file:
-                    for i in range(1, total_chunks + 1):
-                        chunk_file_path = os.path.join(file_dir, f'chunk_{i}')
-                        with open(chunk_file_path, 'rb') as chunk_file:
-                            final_file.write(chunk_file.read())
-
-                # Create a Video object after reassembly
-                video_size = os.path.getsize(final_file_path) 
-                video = Video.objects.create(
-                    file=f"videos/uploads/{file_name}",
-                    name=file_name,
-                    duration=0,
-                    size=video_size,
+            # A request may carry several consecutive chunks; all but the
+            # upload's final chunk must be full.
+            covered = max(1, -(-chunk.size // upload.chunk_size)) if upload.chunk_size else 1
+            last_covered = chunk_number + covered - 1
+            if last_covered > upload.total_chunks or (
+                last_covered < upload.total_chunks and chunk.size != covered * upload.chunk_size
+            ):
+                return Response({'error': 'Chunk size does not match the upload.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Upload the chunk as the part of the same number
+            name = self._stored_name(upload)
+            with metrics.span("io"):
+                upload_id = self._multipart_id(upload, storage, name)
+                storage.upload_part(
+                    name, upload_id, chunk_number, (chunk_number - 1) * upload.chunk_size, chunk, chunk.size,
                 )
+            metrics.inc("video_bytes_in_total", (metrics.current_operation(),), chunk.size)
 
-                # Clean up chunk files and directory
-                for i in range(1, total_chunks + 1):
-                    os.remove(os.path.join(file_dir, f'chunk_{i}'))
-                os.rmdir(file_dir)
+            upload = upload.record_chunks(range(chunk_number, last_covered + 1))
+            if upload.claim_completion():
+                try:
+                    self._complete(upload, storage, name)
+                except Exception:
+                    # Let the next chunk request retry the completion.
+                    ChunkedUpload.objects.filter(pk=upload.pk).update(status=ChunkedUpload.UPLOADING)
+                    raise
 
-                return Response({
-                    'message': 'File uploaded successfully!',
-                    'video': VideoSerializer(video).data,
-                }, status=status.HTTP_201_CREATED)
+            if upload.status == ChunkedUpload.COMPLETE:
+                return self._completed(upload)
 
-            return Response({'message': 'Chunk uploaded successfully!'}, status=status.HTTP_200_OK)
+            return Response({
+                'message': 'Chunk uploaded successfully!',
+                'received_chunks': upload.received_count(),
+                'total_chunks': upload.total_chunks,
+            }, status=status.HTTP_200_OK)
 
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    def get(self, request, file_id):
+        """
+        Report which chunks of an upload are still missing so a client can resume.
+        """
+        try:
+            upload = ChunkedUpload.objects.get(file_id=file_id)
+        except ChunkedUpload.DoesNotExist:
+            return Response({'error': 'Upload not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'file_id': upload.file_id,
+            'file_name': upload.file_name,
+            'status': upload.status,
+            'total_chunks': upload.total_chunks,
+            'chunk_size': upload.chunk_size,
+            'received_chunks': upload.received_count(),
+            'missing_chunks': upload.missing_chunks(),
+            'video': VideoSerializer(upload.video).data if upload.video else None,
+        }, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def _stored_name(upload):
+        return f'video_chunks/{upload.file_id}'
+
+    @staticmethod
+    def _multipart_id(upload, storage, name):
+        """
+        The id of the multipart upload the chunks go to, started by the
+        first chunk. Concurrent first chunks agree on one and abort the rest.
+        """
+        if upload.upload_id:
+            return upload.upload_id
+        upload_id = storage.create_multipart(name)
+        if ChunkedUpload.objects.filter(pk=upload.pk, upload_id='').update(upload_id=upload_id):
+            upload.upload_id = upload_id
+        else:
+            storage.abort_multipart(name, upload_id)
+            upload.upload_id = ChunkedUpload.objects.values_list('upload_id', flat=True).get(pk=upload.pk)
+        return upload.upload_id
+
+    @staticmethod
+    def _complete(upload, storage, name):
+        # The parts already hold the whole video; join them and move the
+        # file into the store. Chunks arrive out of order, so it is hashed
+        # here in one read.
+        storage.complete_multipart(name, upload.upload_id, upload.chunk_size, upload.total_size)
+        blob = ingest_stored(name, os.path.splitext(upload.file_name)[1].lower())
+
+        # Create a Video object after reassembly. The transaction covers only
+        # the rows, so no write lock is held while the parts are joined and
+        # probed.
+        media_info = get_media_info(fetch(blob.name), blob.sha256)
+        with transaction.atomic():
+            upload.video = Video.objects.create(
+                file=blob.name,
+                blob=blob,
+                name=upload.file_name,
+                duration=round(media_info.duration or 0),
+                size=blob.size,
+                media_info=media_info,
+            )
+            upload.status = ChunkedUpload.COMPLETE
+            upload.save(update_fields=['video', 'status', 'updated_at'])
+        schedule_packaging(upload.video)
+        schedule_thumbnails(upload.video)
+        schedule_analysis(upload.video)
+
+    @staticmethod
+    def _completed(upload):
+        return Response({
+            'message': 'File uploaded successfully!',
+            'video': VideoSerializer(upload.video).data,
+        }, status=status.HTTP_201_CREATED)
+
+
+def _artifact_response(artifact):
+    """
+    Answer a trim or merge request from a stored artifact, without a task.
+    """
+    video = Video.objects.filter(blob=artifact.blob).order_by("uploaded_at").first()
+    return Response(dict(
+        artifact.result,
+        output_path=os.path.join(settings.MEDIA_ROOT, artifact.blob.name),
+        sha256=artifact.blob_id,
+        cached=True,
+        video=VideoSerializer(video).data if video else None,
+    ), status=status.HTTP_200_OK)
+
+
+def _profile_error():
+    return Response(
+        {"error": f"profile must be one of {', '.join(profile_names())}."}, status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def _cprofile_error():
+    return Response({"error": "cprofile is only available to staff."}, status=status.HTTP_403_FORBIDDEN)
+
+
+SNAP_TARGETS = ("keyframe", "boundary")
+
+
+def _snap_options(request):
+    """
+    The ``snap`` target and ``snap_window`` of a trim request, or an error
+    Response.
+    """
+    snap = request.data.get("snap")
+    if snap is not None and snap not in SNAP_TARGETS:
+        return None, Response(
+            {"error": f"snap must be one of {', '.join(SNAP_TARGETS)}."}, status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        window = float(request.data.get("snap_window", settings.VIDEO_TRIM_SNAP_WINDOW))
+        if not 0 <= window < math.inf:
+            raise ValueError
+    except (TypeError, ValueError):
+        return None, Response(
+            {"error": "snap_window must be a non-negative number."}, status=status.HTTP_400_BAD_REQUEST,
+        )
+    return (snap, window), None
+
+
+def _snapper(video, snap, window):
+    """
+    A function moving a time of the video to the nearest keyframe or
+    analysis boundary (scene cut, edge of a black or silent stretch) within
+    ``window`` seconds, or an error Response if the video has not been
+    analyzed.
+    """
+    if snap is None:
+        return (lambda seconds: seconds), None
+    info = video.media_info or get_media_info(fetch(video.file.name), video.blob_id)
+    if snap == "keyframe":
+        candidates = info.keyframes or [0.0]
+    else:
+        found = analysis.get_analysis(info)
+        if found is None:
+            return None, Response(
+                {"error": f"Video has not been analyzed; POST /api/videos/{video.id}/analysis/ first."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        candidates = analysis.boundaries(found)
+    return (lambda seconds: analysis.snap(seconds, candidates, window)), None
+
+
+def _transforms(request):
+    """
+    The ``transforms`` of a trim or merge request: graph operations without
+    a source (see videos.graph) applied to its result, a watermark's
+    ``image`` being a Video id. Returns the transforms and the image Videos
+    by id, or an error Response.
+    """
+    transforms = request.data.get("transforms") or []
+    if not isinstance(transforms, list) or not all(isinstance(transform, dict) for transform in transforms):
+        return None, Response({"error": "transforms must be a list of operations."}, status=status.HTTP_400_BAD_REQUEST)
+    image_ids = {str(transform.get("image")) for transform in transforms if transform.get("op") == "watermark"}
+    try:
+        found = Video.objects.select_related("media_info").in_bulk(map(uuid.UUID, image_ids))
+    except ValueError:
+        return None, Response({"error": "A watermark image must be a video id."}, status=status.HTTP_400_BAD_REQUEST)
+    if len(found) < len(image_ids):
+        return None, Response({"error": "Watermark image not found."}, status=status.HTTP_404_NOT_FOUND)
+    return (transforms, {str(video_id): video for video_id, video in found.items()}), None
+
+
+def _with_images(transforms, values):
+    """
+    ``transforms`` with each watermark's image id replaced by values[id].
+    """
+    return [
+        dict(transform, image=values[str(transform["image"])]) if transform.get("op") == "watermark" else transform
+        for transform in transforms
+    ]
+
+
+def _check_graph(spec, videos):
+    """
+    Check a transform graph whose inputs are ids of ``videos`` (by id).
+    Returns the graph.Graph and its graph.Plan (None if a source was never
+    probed), or an error Response.
+    """
+    try:
+        parsed = graph.parse(spec)
+        sources = {name: videos[video_id] for name, video_id in parsed.inputs.items()}
+        if not all(video.media_info for video in sources.values()):
+            return (parsed, None), None
+        infos = {name: video.media_info.to_dict() for name, video in sources.items()}
+        return (parsed, graph.plan(parsed, infos)), None
+    except graph.GraphError as e:
+        return None, Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 
 class VideoTrimView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, video_id):
-        start_time = int(request.data.get("start_time", 0))
-        end_time = int(request.data.get("end_time", 0))
-        
+        """
+        Trim a video. A trim with the same source, times, mode and (for
+        modes that encode) encoding profile as an earlier one is answered
+        from its stored output. With ``snap`` ("keyframe" or "boundary"),
+        the times first move to the nearest keyframe or analysis boundary
+        within ``snap_window`` seconds. ``transforms`` (see _transforms)
+        are applied in the same encoding pass, and imply mode "reencode".
+        Staff can send ``cprofile`` to run the task under cProfile (see
+        metrics.capture_profile).
+        """
         try:
-            video = Video.objects.get(id=video_id)
-            trimmed_video = f'trimmed_{video.name}_{start_time}_to_{end_time}.mp4'
-            output_path = os.path.join(settings.MEDIA_ROOT, trimmed_video)
+            start_time = float(request.data.get("start_time", 0))
+            end_time = float(request.data.get("end_time", 0))
+            if not (math.isfinite(start_time) and math.isfinite(end_time)):
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response({"error": "start_time and end_time must be numbers."}, status=status.HTTP_400_BAD_REQUEST)
+        found, error = _transforms(request)
+        if error:
+            return error
+        transforms, images = found
+        mode = request.data.get("mode", "reencode" if transforms else "keyframe")
+        modes = TRIM_MODES + (PARALLEL,)
+        if mode not in modes:
+            return Response({"error": f"mode must be one of {', '.join(modes)}."}, status=status.HTTP_400_BAD_REQUEST)
+        if transforms and mode != "reencode":
+            return Response({"error": "transforms need mode reencode."}, status=status.HTTP_400_BAD_REQUEST)
+        profile = request.data.get("profile", settings.VIDEO_DEFAULT_ENCODING_PROFILE)
+        if profile not in profile_names():
+            return _profile_error()
+        snap_options, error = _snap_options(request)
+        if error:
+            return error
+        cprofile = bool(request.data.get("cprofile"))
+        if cprofile and not request.user.is_staff:
+            return _cprofile_error()
+
+        try:
+            video = Video.objects.select_related("media_info").get(id=video_id)
+            snapper, error = _snapper(video, *snap_options)
+            if error:
+                return error
+            start_time, end_time = snapper(start_time), snapper(end_time)
+            params = {"start_time": start_time, "end_time": end_time, "mode": mode}
+            if mode != "keyframe":
+                params["profile"] = profile
+            plan = None
+            if transforms:
+                spec = graph.trim_spec(str(video.id), start_time, end_time, transforms)
+                checked, error = _check_graph(spec, dict(images, **{str(video.id): video}))
+                if error:
+                    return error
+                plan = checked[1]
+                # Images are keyed by content where they are stored.
+                params["transforms"] = _with_images(
+                    transforms, {image_id: image.blob_id or image_id for image_id, image in images.items()},
+                )
+            artifact_key = None
+            if video.blob_id:
+                artifact_key = ([video.blob_id], "trim", params)
+                artifact = find_artifact(*artifact_key)
+                if artifact:
+                    return _artifact_response(artifact)
+                output_path = incoming_path(".mp4")
+            else:
+                trimmed_video = f'trimmed_{video.name}_{start_time:g}_to_{end_time:g}.mp4'
+                output_path = os.path.join(settings.MEDIA_ROOT, trimmed_video)
 
             # Enqueue Celery task
-            task = trim_video_task.delay(video.file.path, start_time, end_time, output_path)
+            stem = os.path.splitext(video.name)[0]
+            if mode == PARALLEL:
+                task = transcode_task
+                args = ([(video.file.name, start_time, end_time)], output_path, artifact_key, profile)
+            else:
+                task = trim_video_task
+                args = (video.file.name, start_time, end_time, output_path, mode, artifact_key, profile)
+                if transforms:
+                    args += (_with_images(transforms, {image_id: image.file.name for image_id, image in images.items()}),)
+            info = video.media_info.to_dict() if video.media_info else None
+            job = enqueue(
+                task, "trim", args,
+                sources=[video] + list(images.values()),
+                output_name=f"{stem}_trim_{start_time:g}-{end_time:g}.mp4",
+                params=params,
+                cprofile=cprofile,
+                cost=graph_cost(plan) if plan else trim_cost(
+                    info, start_time, end_time, "reencode" if mode == PARALLEL else mode,
+                ),
+            )
             
             return Response({
-                "task_id": task.id,
+                "task_id": job.id,
+                "start_time": start_time,
+                "end_time": end_time,
                 "message": "Trimming started."
             }, status=status.HTTP_202_ACCEPTED)
         except Video.DoesNotExist:
             return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
 
 
+class VideoBatchTrimView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, video_id):
+        """
+        Cut several ``ranges`` ([start_time, end_time] pairs) of a video,
+        re-encoded with the given profile, as one job decoding the source
+        once. The job has an output Video per range. When every range was
+        cut before, the stored outputs are returned instead. ``snap`` and
+        ``snap_window`` move the range ends as for a single trim.
+        """
+        ranges = request.data.get("ranges")
+        try:
+            ranges = [(float(start_time), float(end_time)) for start_time, end_time in ranges]
+        except (TypeError, ValueError):
+            return Response({"error": "ranges must be a list of [start_time, end_time]."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < len(ranges) <= settings.VIDEO_BATCH_TRIM_MAX_RANGES:
+            return Response({"error": f"Send 1 to {settings.VIDEO_BATCH_TRIM_MAX_RANGES} ranges."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not all(0 <= start_time < end_time < math.inf for start_time, end_time in ranges):
+            return Response({"error": "Each range must have 0 <= start_time < end_time."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        profile = request.data.get("profile", settings.VIDEO_DEFAULT_ENCODING_PROFILE)
+        if profile not in profile_names():
+            return _profile_error()
+        snap_options, error = _snap_options(request)
+        if error:
+            return error
+        cprofile = bool(request.data.get("cprofile"))
+        if cprofile and not request.user.is_staff:
+            return _cprofile_error()
+
+        try:
+            video = Video.objects.select_related("media_info").get(id=video_id)
+        except Video.DoesNotExist:
+            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+        snapper, error = _snapper(video, *snap_options)
+        if error:
+            return error
+        ranges = [(snapper(start_time), snapper(end_time)) for start_time, end_time in ranges]
+        if any(start_time >= end_time for start_time, end_time in ranges):
+            return Response({"error": "A range is empty once snapped."}, status=status.HTTP_400_BAD_REQUEST)
+        stem = os.path.splitext(video.name)[0]
+        # Each range is keyed as a re-encoding trim, so single trims reuse it.
+        params = [
+            {"start_time": start_time, "end_time": end_time, "mode": "reencode", "profile": profile}
+            for start_time, end_time in ranges
+        ]
+        artifact_keys = None
+        if video.blob_id:
+            artifact_keys = [([video.blob_id], "trim", range_params) for range_params in params]
+            artifacts = [find_artifact(*key) for key in artifact_keys]
+            if all(artifacts):
+                return Response({
+                    "cached": True,
+                    "outputs": [_artifact_response(artifact).data for artifact in artifacts],
+                }, status=status.HTTP_200_OK)
+            output_paths = [incoming_path(".mp4") for _ in ranges]
+        else:
+            output_paths = [
+                os.path.join(settings.MEDIA_ROOT, f'trimmed_{video.name}_{start_time:g}_to_{end_time:g}.mp4')
+                for start_time, end_time in ranges
+            ]
+
+        info = video.media_info.to_dict() if video.media_info else None
+        job = enqueue(
+            batch_trim_task, "batch_trim",
+            (video.file.name, ranges, output_paths, artifact_keys, profile),
+            sources=[video],
+            output_name=f"{stem}_trim.mp4",
+            params={"ranges": ranges, "profile": profile},
+            cprofile=cprofile,
+            cost=sum(trim_cost(info, start_time, end_time, "reencode") for start_time, end_time in ranges),
+        )
+        return Response({
+            "task_id": job.id,
+            "message": f"Trimming {len(ranges)} ranges started."
+        }, status=status.HTTP_202_ACCEPTED)
+
+
 class VideoMergeView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
+        """
+        Merge videos in the order given. A merge of the same sources in the
+        same order, with the same mode and encoding profile, as an earlier
+        one is answered from its stored output. ``transforms`` (see
+        _transforms) are applied in the pass that encodes the merge. Staff
+        can send ``cprofile`` to run the task under cProfile.
+        """
         video_ids = request.data.get("video_ids", [])
-        print(f'video_ids: {video_ids}')
-        try:
-            videos = Video.objects.filter(id__in=video_ids)
-            file_paths = [video.file.path for video in videos]
-            base_names = [os.path.splitext(os.path.basename(video.file.name))[0] for video in videos]
-            merged_name = "_".join(base_names)[:50]
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            merged_file_name = f"merged_{merged_name}_{timestamp}.mp4"
-            output_path = os.path.join(settings.MEDIA_ROOT, merged_file_name)
+        mode = request.data.get("mode", "auto")
+        if mode not in ("auto", PARALLEL):
+            return Response({"error": f"mode must be one of auto, {PARALLEL}."}, status=status.HTTP_400_BAD_REQUEST)
+        found, error = _transforms(request)
+        if error:
+            return error
+        transforms, images = found
+        if transforms and mode == PARALLEL:
+            return Response({"error": f"transforms cannot be used with mode {PARALLEL}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        profile = request.data.get("profile", settings.VIDEO_DEFAULT_ENCODING_PROFILE)
+        if profile not in profile_names():
+            return _profile_error()
+        params = {"profile": profile}
+        if mode == PARALLEL:
+            params["mode"] = mode
+        cprofile = bool(request.data.get("cprofile"))
+        if cprofile and not request.user.is_staff:
+            return _cprofile_error()
+        try:
+            found = Video.objects.select_related("media_info").in_bulk(video_ids)
+            videos = [found[video_id] for video_id in map(uuid.UUID, map(str, video_ids)) if video_id in found]
+            file_paths = [video.file.name for video in videos]
+            plan = None
+            if transforms:
+                spec = graph.merge_spec([str(video.id) for video in videos], transforms)
+                checked, error = _check_graph(spec, dict(images, **{str(video.id): video for video in videos}))
+                if error:
+                    return error
+                plan = checked[1]
+                params["transforms"] = _with_images(
+                    transforms, {image_id: image.blob_id or image_id for image_id, image in images.items()},
+                )
+            artifact_key = None
+            if videos and all(video.blob_id for video in videos):
+                artifact_key = ([video.blob_id for video in videos], "merge", params)
+                artifact = find_artifact(*artifact_key)
+                if artifact:
+                    return _artifact_response(artifact)
+                output_path = incoming_path(".mp4")
+            else:
+                base_names = [os.path.splitext(os.path.basename(video.file.name))[0] for video in videos]
+                merged_name = "_".join(base_names)[:50]
+                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+                merged_file_name = f"merged_{merged_name}_{timestamp}.mp4"
+                output_path = os.path.join(settings.MEDIA_ROOT, merged_file_name)
             
             # Enqueue Celery task
-            task = merge_videos_task.delay(file_paths, output_path)
-            print(task)
+            stems = [os.path.splitext(video.name)[0] for video in videos]
+            if mode == PARALLEL:
+                task, args = transcode_task, ([(path, 0, None) for path in file_paths], output_path, artifact_key, profile)
+            else:
+                task, args = merge_videos_task, (file_paths, output_path, artifact_key, profile)
+                if transforms:
+                    args += (_with_images(transforms, {image_id: image.file.name for image_id, image in images.items()}),)
+            cost = None
+            if plan:
+                cost = graph_cost(plan)
+            elif videos and all(video.media_info for video in videos):
+                cost = merge_cost([video.media_info.to_dict() for video in videos], encode_all=mode == PARALLEL)
+            job = enqueue(
+                task, "merge", args,
+                sources=videos + list(images.values()),
+                output_name=f"merged_{'_'.join(stems)[:50]}.mp4",
+                params=params,
+                cprofile=cprofile,
+                cost=cost,
+            )
             return Response({
-                "task_id": task.id,
+                "task_id": job.id,
                 "message": "Merging started."
             }, status=status.HTTP_202_ACCEPTED)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class VideoGraphView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Run a transform graph (see videos.graph): ``inputs`` naming Videos
+        by id, ``nodes`` and ``outputs``. It runs as one job that decodes
+        each input once and encodes every output in the same pass, with
+        ``profile`` for outputs that name none. The job has an output Video
+        per output. When every output was made before, the stored outputs
+        are returned instead.
+        """
+        spec = {"inputs": request.data.get("inputs"), "nodes": request.data.get("nodes") or {},
+                "outputs": request.data.get("outputs")}
+        profile = request.data.get("profile", settings.VIDEO_DEFAULT_ENCODING_PROFILE)
+        if profile not in profile_names():
+            return _profile_error()
+        cprofile = bool(request.data.get("cprofile"))
+        if cprofile and not request.user.is_staff:
+            return _cprofile_error()
+        try:
+            video_ids = {name: uuid.UUID(str(value)) for name, value in graph.parse(spec).inputs.items()}
+        except graph.GraphError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({"error": "inputs must be video ids."}, status=status.HTTP_400_BAD_REQUEST)
+        found = Video.objects.select_related("media_info").in_bulk(set(video_ids.values()))
+        missing = sorted(name for name, video_id in video_ids.items() if video_id not in found)
+        if missing:
+            return Response({"error": f"Videos not found for inputs: {', '.join(missing)}."},
+                            status=status.HTTP_404_NOT_FOUND)
+        spec["inputs"] = {name: str(video_id) for name, video_id in video_ids.items()}
+        checked, error = _check_graph(spec, {str(video_id): video for video_id, video in found.items()})
+        if error:
+            return error
+        parsed, plan = checked
+        videos = {name: found[video_id] for name, video_id in video_ids.items()}
+
+        artifact_keys = None
+        if all(video.blob_id for video in videos.values()):
+            artifact_keys = []
+            for output in parsed.outputs:
+                names, params = graph.artifact_params(parsed, output)
+                params["profile"] = output.get("profile") or profile
+                artifact_keys.append(([videos[name].blob_id for name in names], "graph", params))
+            artifacts = [find_artifact(*key) for key in artifact_keys]
+            if all(artifacts):
+                return Response({
+                    "cached": True,
+                    "outputs": [_artifact_response(artifact).data for artifact in artifacts],
+                }, status=status.HTTP_200_OK)
+            output_paths = [incoming_path(".mp4") for _ in parsed.outputs]
+        else:
+            output_paths = [
+                os.path.join(settings.MEDIA_ROOT, f"graph_{uuid.uuid4().hex}.mp4") for _ in parsed.outputs
+            ]
+
+        first = videos[next(iter(parsed.inputs))]
+        job = enqueue(
+            graph_task, "graph",
+            (dict(spec, inputs={name: video.file.name for name, video in videos.items()}), output_paths,
+             artifact_keys, profile),
+            sources=list({video.id: video for video in videos.values()}.values()),
+            output_name=f"{os.path.splitext(first.name)[0]}_graph.mp4",
+            params={"spec": spec, "profile": profile},
+            cprofile=cprofile,
+            cost=graph_cost(plan) if plan else None,
+        )
+        return Response({
+            "task_id": job.id,
+            "message": f"Running {len(parsed.nodes)} operations into {len(parsed.outputs)} outputs."
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+def _expiry(request):
+    """
+    The ``expiry_time`` (seconds) of a link request, or None if it is not a
+    whole number between 1 and settings.VIDEO_LINK_MAX_EXPIRY.
+    """
+    try:
+        expiry_time = int(request.data.get("expiry_time", 60))
+    except (TypeError, ValueError):
+        return None
+    return expiry_time if 0 < expiry_time <= settings.VIDEO_LINK_MAX_EXPIRY else None
+
+
+def _expiry_error():
+    return Response(
+        {"error": f"expiry_time must be between 1 and {settings.VIDEO_LINK_MAX_EXPIRY} seconds."},
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
 class GenerateExpirableLinkView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, video_id):
-        expiry_time = request.data.get("expiry_time", 60)  # 1 hour default
-        
+        expiry_time = _expiry(request)
+        if expiry_time is None:
+            return _expiry_error()
+
         try:
             video = Video.objects.get(id=video_id)
-            link = generate_expirable_link(video.id, expiry_time)
+            link = generate_expirable_link(video, expiry_time)
+            data = {"link": link}
+
+            package = VideoPackage.objects.filter(video=video, status=VideoPackage.READY).first()
+            if package:
+                data.update(generate_stream_links(package, expiry_time))
 
-            return Response({"link": link}, status=status.HTTP_200_OK)
+            thumbnails = ThumbnailSet.objects.filter(video=video, status=ThumbnailSet.READY).first()
+            if thumbnails:
+                data.update(generate_thumbnail_links(thumbnails, expiry_time))
+
+            return Response(data, status=status.HTTP_200_OK)
         except Video.DoesNotExist:
             return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
-        
+
+
+class BatchExpirableLinkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Expirable links for up to settings.VIDEO_LINK_BATCH_SIZE videos
+        (``video_ids``) in one call, keyed by video id. Ids with no video
+        are listed in ``missing``.
+        """
+        expiry_time = _expiry(request)
+        if expiry_time is None:
+            return _expiry_error()
+        video_ids = request.data.get("video_ids")
+        if not isinstance(video_ids, list) or not 0 < len(video_ids) <= settings.VIDEO_LINK_BATCH_SIZE:
+            return Response(
+                {"error": f"video_ids must be a list of 1 to {settings.VIDEO_LINK_BATCH_SIZE} ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            video_ids = [str(uuid.UUID(str(video_id))) for video_id in video_ids]
+        except ValueError:
+            return Response({"error": "video_ids must be UUIDs."}, status=status.HTTP_400_BAD_REQUEST)
+
+        videos = {str(video.id): video for video in Video.objects.filter(id__in=video_ids).only("id", "file", "name")}
+        return Response({
+            "links": {video_id: generate_expirable_link(video, expiry_time) for video_id, video in videos.items()},
+            "missing": [video_id for video_id in video_ids if video_id not in videos],
+        }, status=status.HTTP_200_OK)
+
+
+class RevokeLinksView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, video_id):
+        """
+        Revoke every link to a video issued so far, stream and thumbnail
+        links included. Other processes notice within
+        settings.VIDEO_LINK_CACHE_TTL seconds.
+        """
+        revoked_at = now()
+        if not Video.objects.filter(id=video_id).update(links_revoked_at=revoked_at):
+            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+        links.forget(video_id)
+        return Response({"revoked_at": revoked_at}, status=status.HTTP_200_OK)
+
 
 class ServeVideoView(APIView):
     def get(self, request, *args, **kwargs):
@@ -179,24 +915,514 @@ class ServeVideoView(APIView):
         if not token:
             raise Http404("Token is missing from the request")
 
+        link = _verified_link(token)
         try:
-            
-            data = signer.unsign_object(token, max_age=3600)  # Token expires after 1 hour
-            video_id = data.get('video_id')
-            expires_at = data.get('expires_at')
+            return serve_stored(request, link.file, link.name)
+        except FileNotFoundError:
+            raise Http404("Video not found")
 
-            # Validate expiration
-            if expires_at < now().timestamp():
-                raise Http404("Token has expired")
 
-            video = Video.objects.get(id=video_id)
+async def _unauthorized(request):
+    """
+    The 401 response for an async view's request without a valid token, or
+    None.
+    """
+    if await aauthenticate(request) is not None:
+        return None
+    response = JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    response["WWW-Authenticate"] = "Token"
+    return response
+
 
-            # Serve the video file
-            return FileResponse(video.file, as_attachment=False)
+async def serve_video_async(request):
+    """
+    ServeVideoView for ASGI deployments (settings.VIDEO_ASYNC_SERVE). The
+    token user is looked up with the async ORM and the file is streamed
+    from an async reader, so a download holds no thread while it waits on
+    a slow client.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+    unauthorized = await _unauthorized(request)
+    if unauthorized:
+        return unauthorized
+    token = request.GET.get('token')
+    if not token:
+        raise Http404("Token is missing from the request")
+    try:
+        link = await links.acheck(links.verify(token))
+    except links.InvalidLink as e:
+        raise Http404(str(e))
+    try:
+        return await aserve_stored(request, link.file, link.name)
+    except FileNotFoundError:
+        raise Http404("Video not found")
 
-        except (BadSignature, SignatureExpired):
-            raise Http404("Invalid or expired token")
+
+def _verified_link(token):
+    """
+    The checked Link of a token, raising Http404 if it is invalid, expired
+    or revoked.
+    """
+    try:
+        return links.check(links.verify(token))
+    except links.InvalidLink as e:
+        raise Http404(str(e))
+
+
+def _stream_video_id(token):
+    """
+    Video id carried by a stream token, raising Http404 if it is invalid,
+    expired or revoked.
+    """
+    return _verified_link(token).video_id
+
+
+def _serve_asset(request, directory, asset):
+    """
+    Serve a file under ``directory`` (relative to MEDIA_ROOT), refusing paths
+    that leave it.
+    """
+    root = os.path.realpath(os.path.join(settings.MEDIA_ROOT, directory))
+    path = os.path.realpath(os.path.join(root, asset))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        raise Http404("File not found")
+
+    return serve_file(request, path, asset, url_path=f"{directory}/{asset}")
+
+
+class StreamVideoView(APIView):
+    """
+    Serves the playlists and segments of a packaged video. The signed token
+    in the path is the only credential, so players need no auth header.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, token, asset):
+        video_id = _stream_video_id(token)
+        try:
+            package = VideoPackage.objects.get(video_id=video_id, status=VideoPackage.READY)
+        except VideoPackage.DoesNotExist:
+            raise Http404("Video is not packaged")
+        return _serve_asset(request, package.directory, asset)
+
+
+class StreamThumbnailsView(APIView):
+    """
+    Serves the poster, sprite sheets and WebVTT track of a video under the
+    same signed path as its stream.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, token, asset):
+        video_id = _stream_video_id(token)
+        try:
+            thumbnails = ThumbnailSet.objects.get(video_id=video_id, status=ThumbnailSet.READY)
+        except ThumbnailSet.DoesNotExist:
+            raise Http404("Video has no thumbnails")
+        return _serve_asset(request, thumbnails.directory, asset)
+
+
+class VideoPackageView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, video_id):
+        """
+        Packaging status and renditions of a video.
+        """
+        try:
+            package = VideoPackage.objects.get(video_id=video_id)
+        except VideoPackage.DoesNotExist:
+            return Response({"error": "Video is not packaged."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            "status": package.status,
+            "error": package.error,
+            "segment_duration": package.segment_duration,
+            "renditions": [
+                {
+                    "name": rendition.name,
+                    "kind": rendition.kind,
+                    "width": rendition.width,
+                    "height": rendition.height,
+                    "bitrate": rendition.bitrate,
+                    "segments": rendition.segments.count(),
+                }
+                for rendition in package.renditions.all()
+            ],
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request, video_id):
+        """
+        (Re)package a video into the HLS/DASH bitrate ladder.
+        """
+        if not Video.objects.filter(id=video_id).exists():
+            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        task = package_video_task.delay(str(video_id))
+        return Response({
+            "task_id": task.id,
+            "message": "Packaging started."
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class VideoThumbnailsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, video_id):
+        """
+        Status and layout of the thumbnail sprite sheets of a video.
+        """
+        try:
+            thumbnails = ThumbnailSet.objects.get(video_id=video_id)
+        except ThumbnailSet.DoesNotExist:
+            return Response({"error": "Video has no thumbnails."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            "status": thumbnails.status,
+            "error": thumbnails.error,
+            "interval": thumbnails.interval,
+            "count": thumbnails.count,
+            "sprites": thumbnails.sprite_count,
+            "columns": thumbnails.columns,
+            "rows": thumbnails.rows,
+            "tile_width": thumbnails.tile_width,
+            "tile_height": thumbnails.tile_height,
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request, video_id):
+        """
+        (Re)generate the poster and sprite sheets of a video.
+        """
+        if not Video.objects.filter(id=video_id).exists():
+            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        task = thumbnail_video_task.delay(str(video_id))
+        return Response({
+            "task_id": task.id,
+            "message": "Thumbnail generation started."
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class VideoAnalysisView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, video_id):
+        """
+        Scene cut times and black and silent stretches of a video, plus the
+        boundaries trims snap to.
+        """
+        try:
+            video = Video.objects.select_related("media_info").get(id=video_id)
         except Video.DoesNotExist:
-            raise Http404("Video not found")
-        except Exception as e:
-            raise Http404(f"An error occurred: {str(e)}")
\ No newline at end of file
+            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+        found = analysis.get_analysis(video.media_info) if video.media_info else None
+        if found is None:
+            return Response({"error": "Video has not been analyzed."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(_analysis_data(found), status=status.HTTP_200_OK)
+
+    def post(self, request, video_id):
+        """
+        Analyze a video. A video whose content was analyzed before is
+        answered at once.
+        """
+        try:
+            video = Video.objects.select_related("media_info").get(id=video_id)
+        except Video.DoesNotExist:
+            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+        found = analysis.get_analysis(video.media_info or get_media_info(fetch(video.file.name), video.blob_id))
+        if found:
+            return Response(dict(_analysis_data(found), cached=True), status=status.HTTP_200_OK)
+
+        task = analyze_video_task.delay(str(video_id))
+        return Response({
+            "task_id": task.id,
+            "message": "Analysis started."
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+def _analysis_data(found):
+    return dict(
+        analysis.summary(found),
+        duration=found.duration,
+        analysis_time=found.analysis_time,
+        boundaries=analysis.boundaries(found),
+    )
+
+
+class VideoFrameView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, video_id):
+        """
+        A JPEG of the frame at ``t`` seconds (default: the poster time),
+        ``width`` pixels wide. Frames are extracted on first request and kept
+        in a disk cache bounded by VIDEO_THUMBNAIL_CACHE_SIZE.
+        """
+        try:
+            video = Video.objects.select_related("media_info").get(id=video_id)
+        except Video.DoesNotExist:
+            return Response({"error": "Video not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        duration = video.media_info.duration if video.media_info else video.duration
+        try:
+            time = float(request.query_params.get("t", poster_time(duration)))
+            width = int(request.query_params.get("width", settings.VIDEO_POSTER_WIDTH))
+        except ValueError:
+            return Response({"error": "t and width must be numbers."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= time < duration:
+            return Response({"error": "t is outside the video."}, status=status.HTTP_400_BAD_REQUEST)
+        if not MIN_FRAME_WIDTH <= width <= MAX_FRAME_WIDTH:
+            return Response(
+                {"error": f"width must be between {MIN_FRAME_WIDTH} and {MAX_FRAME_WIDTH}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            path = cached_frame(video, time, width)
+        except IOError as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return serve_file(request, path, os.path.basename(path), url_path=os.path.relpath(path, settings.MEDIA_ROOT))
+
+
+class QueueStatsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Depth and wait time of each task queue. ``window`` (seconds) sets
+        how far back started jobs count towards the wait statistics.
+        """
+        try:
+            window = int(request.query_params.get("window", settings.VIDEO_QUEUE_STATS_WINDOW))
+        except ValueError:
+            return Response({"error": "window must be a number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"window": window, "queues": queue_stats(window)})
+
+
+def _poll_params(params, max_wait):
+    """
+    The ``wait`` (capped at max_wait) and ``version`` of a long poll,
+    raising ValueError if they are not numbers or the wait is negative or
+    not finite.
+    """
+    wait = float(params.get("wait", 0))
+    if not 0 <= wait < math.inf:
+        raise ValueError(wait)
+    return min(wait, max_wait), int(params.get("version", -1))
+
+
+def _job_data(task_id):
+    """
+    The serialized Job, or None if it no longer exists.
+    """
+    job = Job.objects.select_related("output__media_info").filter(id=task_id).first()
+    return JobSerializer(job).data if job else None
+
+
+def _job_event(data):
+    event = "done" if data["status"] in Job.FINISHED else "progress"
+    return f"id: {data['version']}\nevent: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n", event == "done"
+
+
+def _last_event_id(request):
+    """
+    The job version a reconnecting event stream last received, if any.
+    """
+    try:
+        return int(request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        return None
+
+
+class TaskStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Longest a long-poll request is held open, in seconds. Each one holds a
+    # worker thread; under ASGI task_status_async waits without one, for up
+    # to ASYNC_MAX_WAIT.
+    MAX_WAIT = 10
+    ASYNC_MAX_WAIT = 30
+    POLL_INTERVAL = 0.25
+
+    def get(self, request, task_id):
+        """
+        Status and progress of a trim or merge task. With ``wait=<seconds>``
+        (and ``version`` from an earlier response) the request is held until
+        the job changes, finishes, or the wait runs out.
+        """
+        try:
+            wait, version = _poll_params(request.query_params, self.MAX_WAIT)
+        except ValueError:
+            return Response({"error": "wait must be a non-negative number and version a number."}, status=status.HTTP_400_BAD_REQUEST)
+
+        deadline = time.monotonic() + wait
+        while True:
+            job = Job.objects.select_related("output__media_info").filter(id=task_id).first()
+            if job is None:
+                return Response({"error": "Task not found."}, status=status.HTTP_404_NOT_FOUND)
+            if job.version != version or job.status in Job.FINISHED or time.monotonic() >= deadline:
+                return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+            time.sleep(self.POLL_INTERVAL)
+
+
+class TaskEventsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    POLL_INTERVAL = 0.5
+    # Comment lines keep proxies from closing an idle stream.
+    KEEPALIVE = 15
+    # Longest a stream is held open, in seconds (ASYNC_MAX_DURATION under
+    # ASGI, see task_events_async). It then ends with a ``reconnect`` event;
+    # EventSource reconnects by itself, sending the last event id.
+    MAX_DURATION = 60
+    ASYNC_MAX_DURATION = 600
+    RECONNECT = "retry: 1000\nevent: reconnect\ndata: {}\n\n"
+
+    def get(self, request, task_id):
+        """
+        Server-sent events for a trim or merge task: a ``progress`` event
+        whenever the job changes and a final ``done`` event.
+        """
+        if not Job.objects.filter(id=task_id).exists():
+            return Response({"error": "Task not found."}, status=status.HTTP_404_NOT_FOUND)
+        return _event_stream(self._events(task_id, _last_event_id(request)))
+
+    def _events(self, task_id, version):
+        deadline = time.monotonic() + self.MAX_DURATION
+        idle = 0.0
+        while True:
+            state = Job.objects.filter(id=task_id).values_list("version", "status").first()
+            if state is None:
+                return
+            if state[0] != version or state[1] in Job.FINISHED:
+                data = _job_data(task_id)
+                if data is None:
+                    return
+                version, idle = data["version"], 0.0
+                event, done = _job_event(data)
+                yield event
+                if done:
+                    return
+            elif time.monotonic() >= deadline:
+                yield self.RECONNECT
+                return
+            elif idle >= self.KEEPALIVE:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            time.sleep(self.POLL_INTERVAL)
+            idle += self.POLL_INTERVAL
+
+
+def _event_stream(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def task_status_async(request, task_id):
+    """
+    TaskStatusView for ASGI deployments (settings.VIDEO_ASYNC_SERVE): a
+    long poll waits on the event loop, not in a thread.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    unauthorized = await _unauthorized(request)
+    if unauthorized:
+        return unauthorized
+    try:
+        wait, version = _poll_params(request.GET, TaskStatusView.ASYNC_MAX_WAIT)
+    except ValueError:
+        return JsonResponse({"error": "wait must be a non-negative number and version a number."}, status=400)
+
+    deadline = time.monotonic() + wait
+    while True:
+        state = await Job.objects.filter(id=task_id).values_list("version", "status").afirst()
+        if state is not None and state[0] == version and state[1] not in Job.FINISHED and time.monotonic() < deadline:
+            await asyncio.sleep(TaskStatusView.POLL_INTERVAL)
+            continue
+        data = await sync_to_async(_job_data)(task_id) if state else None
+        if data is None:
+            return JsonResponse({"error": "Task not found."}, status=404)
+        return JsonResponse(data)
+
+
+async def task_events_async(request, task_id):
+    """
+    TaskEventsView for ASGI deployments (settings.VIDEO_ASYNC_SERVE): the
+    stream waits between events on the event loop, not in a thread.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    unauthorized = await _unauthorized(request)
+    if unauthorized:
+        return unauthorized
+    if not await Job.objects.filter(id=task_id).aexists():
+        return JsonResponse({"error": "Task not found."}, status=404)
+    return _event_stream(_aevents(task_id, _last_event_id(request)))
+
+
+async def _aevents(task_id, version):
+    view = TaskEventsView
+    deadline = time.monotonic() + view.ASYNC_MAX_DURATION
+    idle = 0.0
+    while True:
+        state = await Job.objects.filter(id=task_id).values_list("version", "status").afirst()
+        if state is None:
+            return
+        if state[0] != version or state[1] in Job.FINISHED:
+            data = await sync_to_async(_job_data)(task_id)
+            if data is None:
+                return
+            version, idle = data["version"], 0.0
+            event, done = _job_event(data)
+            yield event
+            if done:
+                return
+        elif time.monotonic() >= deadline:
+            yield view.RECONNECT
+            return
+        elif idle >= view.KEEPALIVE:
+            idle = 0.0
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(view.POLL_INTERVAL)
+        idle += view.POLL_INTERVAL
+
+
+def schedule_thumbnails(video):
+    """
+    Generate the thumbnails of a new upload once its row is committed, if
+    enabled.
+    """
+    if settings.VIDEO_THUMBNAILS_ON_UPLOAD:
+        transaction.on_commit(lambda: thumbnail_video_task.delay(str(video.id)))
+
+
+def schedule_analysis(video):
+    """
+    Analyze a new upload once its row is committed, if enabled.
+    """
+    if settings.VIDEO_ANALYZE_ON_UPLOAD:
+        transaction.on_commit(lambda: analyze_video_task.delay(str(video.id)))
+
+
+def schedule_packaging(video):
+    """
+    Package a new upload once its row is committed, if enabled.
+    """
+    if settings.VIDEO_PACKAGE_ON_UPLOAD:
+        transaction.on_commit(lambda: package_video_task.delay(str(video.id)))
+
+
+def metrics_view(request):
+    """
+    The metrics in the Prometheus text format. When VIDEO_METRICS_TOKEN is
+    set, scrapers have to send it as a bearer token.
+    """
+    token = settings.VIDEO_METRICS_TOKEN
+    if token and request.META.get("HTTP_AUTHORIZATION") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")